@@ -6,10 +6,9 @@
 """
 
 import logging
+import threading
 from typing import List, Dict, Optional, Tuple
-from datetime import datetime
-import mysql.connector
-from config import DB_HOST, DB_USER, DB_PASSWORD, DB_NAME
+from database import get_db
 
 logger = logging.getLogger(__name__)
 
@@ -18,151 +17,182 @@ class AchievementManager:
     
     def __init__(self):
         """Инициализация менеджера достижений."""
-        self.db_config = {
-            'host': DB_HOST,
-            'user': DB_USER,
-            'password': DB_PASSWORD,
-            'database': DB_NAME,
-            'charset': 'utf8mb4',
-            'collation': 'utf8mb4_unicode_ci'
-        }
+        self.db = get_db()
+        # Справочник достижений почти не меняется - держим его в памяти,
+        # чтобы выдача достижения стоила один INSERT, а не три запроса
+        self._achievements: Optional[Dict[str, Dict]] = None
+        self._lock = threading.Lock()
+    
+    def _ensure_connection(self):
+        if not self.db.connection or not self.db.connection.is_connected():
+            self.db.connect()
     
-    def _get_connection(self):
-        """Создает новое подключение к базе данных."""
-        return mysql.connector.connect(**self.db_config)
+    def _get_achievements(self) -> Dict[str, Dict]:
+        """Возвращает справочник достижений {code: row}, загружая его при первом обращении."""
+        with self._lock:
+            if self._achievements is None:
+                self._ensure_connection()
+                rows = self.db.execute_query("SELECT * FROM achievements")
+                if rows is None:
+                    return {}
+                self._achievements = {row['code']: row for row in rows}
+            return self._achievements
+    
+    def reload_achievements(self):
+        """Сбрасывает кэш справочника (после изменения таблицы achievements)."""
+        with self._lock:
+            self._achievements = None
     
     def get_achievement_by_code(self, code: str) -> Optional[Dict]:
         """Получает достижение по его коду."""
-        conn = self._get_connection()
-        cursor = conn.cursor(dictionary=True)
-        
-        try:
-            query = "SELECT * FROM achievements WHERE code = %s"
-            cursor.execute(query, (code,))
-            result = cursor.fetchone()
-            return result
-        finally:
-            cursor.close()
-            conn.close()
+        return self._get_achievements().get(code)
     
     def get_user_achievements(self, user_id: int) -> List[Dict]:
         """Получает список достижений пользователя."""
-        conn = self._get_connection()
-        cursor = conn.cursor(dictionary=True)
-        
-        try:
-            query = """
-                SELECT a.*, ua.achieved_at, ua.character_name, ua.details
-                FROM achievements a
-                JOIN user_achievements ua ON a.id = ua.achievement_id
-                WHERE ua.user_id = %s
-                ORDER BY ua.achieved_at DESC
-            """
-            cursor.execute(query, (user_id,))
-            return cursor.fetchall()
-        finally:
-            cursor.close()
-            conn.close()
+        self._ensure_connection()
+        query = """
+            SELECT a.*, ua.achieved_at, ua.character_name, ua.details
+            FROM achievements a
+            JOIN user_achievements ua ON a.id = ua.achievement_id
+            WHERE ua.user_id = %s
+            ORDER BY ua.achieved_at DESC
+        """
+        return self.db.execute_query(query, (user_id,)) or []
     
     def has_achievement(self, user_id: int, code: str) -> bool:
         """Проверяет, есть ли у пользователя достижение."""
-        conn = self._get_connection()
-        cursor = conn.cursor()
+        achievement = self.get_achievement_by_code(code)
+        if not achievement:
+            return False
         
-        try:
-            query = """
-                SELECT COUNT(*) FROM user_achievements ua
-                JOIN achievements a ON ua.achievement_id = a.id
-                WHERE ua.user_id = %s AND a.code = %s
-            """
-            cursor.execute(query, (user_id, code))
-            count = cursor.fetchone()[0]
-            return count > 0
-        finally:
-            cursor.close()
-            conn.close()
+        self._ensure_connection()
+        result = self.db.execute_query(
+            "SELECT 1 FROM user_achievements WHERE user_id = %s AND achievement_id = %s",
+            (user_id, achievement['id'])
+        )
+        return bool(result)
     
     def grant_achievement(self, user_id: int, code: str, character_name: str = None, details: str = None) -> Optional[Dict]:
         """
         Выдает достижение пользователю.
         Возвращает информацию о достижении, если оно было выдано, иначе None.
         """
-        conn = self._get_connection()
-        cursor = conn.cursor(dictionary=True)
+        # Проверяем, существует ли достижение
+        achievement = self.get_achievement_by_code(code)
+        if not achievement:
+            logger.error(f"Достижение с кодом {code} не найдено")
+            return None
+        
+        # Уникальный ключ (user_id, achievement_id) отсекает повторную выдачу,
+        # в том числе при гонке двух одновременных вызовов
+        self._ensure_connection()
+        inserted = self.db.execute_query("""
+            INSERT IGNORE INTO user_achievements (user_id, achievement_id, character_name, details)
+            VALUES (%s, %s, %s, %s)
+        """, (user_id, achievement['id'], character_name, details))
+        
+        if not inserted:
+            if inserted == 0:
+                logger.info(f"Пользователь {user_id} уже имеет достижение {code}")
+            return None
+        
+        logger.info(f"Пользователю {user_id} выдано достижение: {achievement['name']}")
+        return achievement
+    
+    def grant_achievements(self, grants: List[Tuple]) -> List[Tuple[int, Dict]]:
+        """
+        Выдает пачку достижений одной транзакцией.
         
-        try:
-            # Проверяем, существует ли достижение
+        Args:
+            grants: Кортежи (user_id, code[, character_name[, details]])
+        
+        Returns:
+            Список пар (user_id, достижение) для реально выданных достижений
+        """
+        rows = []
+        granted = []
+        seen = set()
+        for grant in grants:
+            user_id, code = grant[0], grant[1]
+            character_name = grant[2] if len(grant) > 2 else None
+            details = grant[3] if len(grant) > 3 else None
+            
             achievement = self.get_achievement_by_code(code)
             if not achievement:
                 logger.error(f"Достижение с кодом {code} не найдено")
-                return None
-            
-            # Проверяем, не получено ли уже достижение
-            if self.has_achievement(user_id, code):
-                logger.info(f"Пользователь {user_id} уже имеет достижение {code}")
-                return None
-            
-            # Выдаем достижение
-            query = """
-                INSERT INTO user_achievements (user_id, achievement_id, character_name, details)
-                VALUES (%s, %s, %s, %s)
-            """
-            cursor.execute(query, (user_id, achievement['id'], character_name, details))
-            conn.commit()
-            
+                continue
+            if (user_id, achievement['id']) in seen:
+                continue
+            seen.add((user_id, achievement['id']))
+            rows.append((user_id, achievement['id'], character_name, details))
+            granted.append((user_id, achievement))
+        
+        if not rows:
+            return []
+        
+        # Отбрасываем то, что уже получено, одним запросом на всех пользователей
+        self._ensure_connection()
+        user_ids = sorted({row[0] for row in rows})
+        placeholders = ', '.join(['%s'] * len(user_ids))
+        existing = self.db.execute_query(
+            f"SELECT user_id, achievement_id FROM user_achievements WHERE user_id IN ({placeholders})",
+            tuple(user_ids)
+        )
+        if existing is None:
+            return []
+        owned = {(row['user_id'], row['achievement_id']) for row in existing}
+        
+        new_rows = []
+        result = []
+        for row, item in zip(rows, granted):
+            if (row[0], row[1]) not in owned:
+                new_rows.append(row)
+                result.append(item)
+        
+        if not new_rows:
+            return []
+        
+        inserted = self.db.execute_many("""
+            INSERT IGNORE INTO user_achievements (user_id, achievement_id, character_name, details)
+            VALUES (%s, %s, %s, %s)
+        """, new_rows)
+        if inserted is None:
+            return []
+        
+        for user_id, achievement in result:
             logger.info(f"Пользователю {user_id} выдано достижение: {achievement['name']}")
-            return achievement
-            
-        except mysql.connector.IntegrityError:
-            # Достижение уже есть (race condition)
-            return None
-        except Exception as e:
-            logger.error(f"Ошибка при выдаче достижения: {e}")
-            conn.rollback()
-            return None
-        finally:
-            cursor.close()
-            conn.close()
+        return result
     
     def get_user_achievement_summary(self, user_id: int) -> Dict:
         """Получает сводку по достижениям пользователя."""
-        conn = self._get_connection()
-        cursor = conn.cursor(dictionary=True)
+        # Получаем достижения пользователя
+        achievements = self.get_user_achievements(user_id)
         
-        try:
-            # Получаем достижения пользователя
-            achievements = self.get_user_achievements(user_id)
-            
-            # Считаем общие очки
-            total_points = sum(a['points'] for a in achievements)
-            
-            # Получаем общее количество достижений
-            cursor.execute("SELECT COUNT(*) as total FROM achievements WHERE is_hidden = FALSE")
-            total_visible = cursor.fetchone()['total']
-            
-            cursor.execute("SELECT COUNT(*) as total FROM achievements")
-            total_all = cursor.fetchone()['total']
-            
-            # Группируем по категориям
-            categories = {}
-            for achievement in achievements:
-                cat = achievement.get('category', 'other')
-                if cat not in categories:
-                    categories[cat] = {'count': 0, 'points': 0}
-                categories[cat]['count'] += 1
-                categories[cat]['points'] += achievement['points']
-            
-            return {
-                'total_achievements': len(achievements),
-                'total_points': total_points,
-                'total_available': total_all,
-                'total_visible': total_visible,
-                'categories': categories,
-                'achievements': achievements
-            }
-        finally:
-            cursor.close()
-            conn.close()
+        # Считаем общие очки
+        total_points = sum(a['points'] for a in achievements)
+        
+        # Общее количество достижений берем из справочника
+        all_achievements = self._get_achievements()
+        total_all = len(all_achievements)
+        total_visible = sum(1 for a in all_achievements.values() if not a.get('is_hidden'))
+        
+        # Группируем по категориям
+        categories = {}
+        for achievement in achievements:
+            cat = achievement.get('category', 'other')
+            if cat not in categories:
+                categories[cat] = {'count': 0, 'points': 0}
+            categories[cat]['count'] += 1
+            categories[cat]['points'] += achievement['points']
+        
+        return {
+            'total_achievements': len(achievements),
+            'total_points': total_points,
+            'total_available': total_all,
+            'total_visible': total_visible,
+            'categories': categories,
+            'achievements': achievements
+        }
     
     def update_progress(self, user_id: int, code: str, progress: int = 1, increment: bool = True) -> bool:
         """
@@ -174,58 +204,40 @@ class AchievementManager:
             progress: Значение прогресса
             increment: Если True, добавляет к текущему прогрессу, иначе устанавливает новое значение
         """
-        conn = self._get_connection()
-        cursor = conn.cursor()
+        if increment:
+            query = """
+                INSERT INTO achievement_progress (user_id, achievement_code, progress)
+                VALUES (%s, %s, %s)
+                ON DUPLICATE KEY UPDATE progress = progress + VALUES(progress)
+            """
+        else:
+            query = """
+                INSERT INTO achievement_progress (user_id, achievement_code, progress)
+                VALUES (%s, %s, %s)
+                ON DUPLICATE KEY UPDATE progress = VALUES(progress)
+            """
         
-        try:
-            if increment:
-                query = """
-                    INSERT INTO achievement_progress (user_id, achievement_code, progress)
-                    VALUES (%s, %s, %s)
-                    ON DUPLICATE KEY UPDATE progress = progress + VALUES(progress)
-                """
-            else:
-                query = """
-                    INSERT INTO achievement_progress (user_id, achievement_code, progress)
-                    VALUES (%s, %s, %s)
-                    ON DUPLICATE KEY UPDATE progress = VALUES(progress)
-                """
-            
-            cursor.execute(query, (user_id, code, progress))
-            conn.commit()
-            return True
-            
-        except Exception as e:
-            logger.error(f"Ошибка при обновлении прогресса: {e}")
-            conn.rollback()
+        self._ensure_connection()
+        result = self.db.execute_query(query, (user_id, code, progress))
+        if result is None:
+            logger.error(f"Ошибка при обновлении прогресса: {user_id}/{code}")
             return False
-        finally:
-            cursor.close()
-            conn.close()
+        return True
     
     def get_progress(self, user_id: int, code: str) -> Tuple[int, int]:
         """
         Получает прогресс к достижению.
         Возвращает кортеж (текущий_прогресс, цель).
         """
-        conn = self._get_connection()
-        cursor = conn.cursor()
+        self._ensure_connection()
+        result = self.db.execute_query("""
+            SELECT progress, target FROM achievement_progress
+            WHERE user_id = %s AND achievement_code = %s
+        """, (user_id, code))
         
-        try:
-            query = """
-                SELECT progress, target FROM achievement_progress
-                WHERE user_id = %s AND achievement_code = %s
-            """
-            cursor.execute(query, (user_id, code))
-            result = cursor.fetchone()
-            
-            if result:
-                return result[0], result[1]
-            return 0, 1
-            
-        finally:
-            cursor.close()
-            conn.close()
+        if result:
+            return result[0]['progress'], result[0]['target']
+        return 0, 1
     
     def check_level_achievement(self, user_id: int, level: int, character_name: str = None) -> Optional[Dict]:
         """Проверяет и выдает достижение за достижение уровня."""
@@ -235,6 +247,13 @@ class AchievementManager:
         
         return self.grant_achievement(user_id, code, character_name, f"Достиг {level}-го уровня")
     
+    def check_level_achievements(self, user_id: int, old_level: int, new_level: int,
+                                 character_name: str = None) -> List[Dict]:
+        """Выдает достижения за все уровни от old_level+1 до new_level одной транзакцией."""
+        grants = [(user_id, f"level_{lvl}", character_name, f"Достиг {lvl}-го уровня")
+                  for lvl in range(max(old_level + 1, 2), min(new_level, 20) + 1)]
+        return [achievement for _, achievement in self.grant_achievements(grants)]
+    
     def check_damage_achievement(self, user_id: int, damage: int, character_name: str = None) -> Optional[Dict]:
         """Проверяет и выдает достижение за нанесенный урон."""
         if damage >= 100:
@@ -3,11 +3,12 @@ import re
 from telegram import Update
 from telegram.ext import ContextTypes
 from database import get_db
+from reference_cache import reference_cache
 from grok_api import grok
 from combat_manager import combat_manager
-from telegram_utils import send_long_message
+from combat_state import combat_states
+from telegram_utils import send_long_message, StreamingMessage
 from spell_slot_manager import spell_slot_manager
-import asyncio
 
 logger = logging.getLogger(__name__)
 
@@ -25,11 +26,8 @@ class ActionHandler:
         user_id = update.effective_user.id
         action_text = " ".join(context.args)
 
-        if not self.db.connection or not self.db.connection.is_connected():
-            self.db.connect()
-
         # Check if user has character in active adventure
-        character_info = self.db.execute_query("""
+        character_info = await self.db.fetch("""
             SELECT c.id, c.name, a.id as adventure_id
             FROM characters c
             JOIN adventure_participants ap ON c.id = ap.character_id
@@ -48,17 +46,24 @@ class ActionHandler:
         # Проверяем навыки и заклинания в квадратных скобках
         skill_spell_pattern = r'\[([^\]]+)\]'
         matches = re.findall(skill_spell_pattern, action_text)
-        
+
+        # Слоты, уже оплаченные прежней версией действия (повторная отправка после
+        # сбоя Grok или правка действия), второй раз не расходуются
+        previous = self.pending_actions.get(adventure_id, {}).get(user_id)
+        unpaid = list(previous.get('spent_slots', [])) if previous else []
+        kept_slots = []
+        used_spells = []
+
         if matches:
             # Получаем навыки персонажа
-            character_skills = self.db.execute_query(
+            character_skills = await self.db.fetch(
                 "SELECT skill_name FROM character_skills WHERE character_id = %s",
                 (character_id,)
             )
             skill_names = [skill['skill_name'] for skill in character_skills] if character_skills else []
             
             # Получаем заклинания персонажа с уровнем
-            character_spells = self.db.execute_query(
+            character_spells = await self.db.fetch(
                 "SELECT s.name, s.level, s.id FROM character_spells cs "
                 "JOIN spells s ON cs.spell_id = s.id "
                 "WHERE cs.character_id = %s",
@@ -67,6 +72,18 @@ class ActionHandler:
             spell_data = {spell['name']: {'level': spell['level'], 'id': spell['id']} 
                          for spell in character_spells} if character_spells else {}
             spell_names = list(spell_data.keys())
+
+            # Заклинания, за которые слот уже заплачен, и те, за которые платить сейчас
+            to_spend = []
+            for match in matches:
+                if match not in spell_names:
+                    continue
+                paid = next((slot for slot in unpaid if slot[0] == match), None)
+                if paid:
+                    unpaid.remove(paid)
+                    kept_slots.append(paid)
+                else:
+                    to_spend.append(match)
             
             # Проверяем каждое упоминание в квадратных скобках
             for match in matches:
@@ -79,11 +96,11 @@ class ActionHandler:
                     )
                     return
                 
-                # Если это заклинание, проверяем наличие слотов
-                if match in spell_names:
+                # Если за заклинание еще не заплачено, проверяем наличие слотов
+                if match in to_spend:
                     spell_level = spell_data[match]['level']
-                    if not spell_slot_manager.has_available_slot(character_id, spell_level):
-                        slot_info = spell_slot_manager.get_spell_slots_info(character_id)
+                    if not await self.db.run(spell_slot_manager.has_available_slot, character_id, spell_level):
+                        slot_info = await self.db.run(spell_slot_manager.get_spell_slots_info, character_id)
                         await context.bot.send_message(
                             chat_id=update.effective_chat.id,
                             text=f"❌ У вас нет доступных слотов для заклинания '{match}' (уровень {spell_level})!\n\n{slot_info}"
@@ -91,17 +108,22 @@ class ActionHandler:
                         return
             
             # Расходуем слоты заклинаний (после всех проверок)
-            used_spells = []
-            for match in matches:
-                if match in spell_names:
-                    spell_level = spell_data[match]['level']
-                    used_slot_level = spell_slot_manager.use_spell_slot(character_id, spell_level)
-                    if used_slot_level is not None:
-                        used_spell_text = f"{match}"
-                        if used_slot_level > spell_level:
-                            used_spell_text += f" (использован слот {used_slot_level} уровня)"
-                        used_spells.append(used_spell_text)
-                        logger.info(f"Character {character_id} used spell slot for '{match}'")
+            for match in to_spend:
+                spell_level = spell_data[match]['level']
+                used_slot_level = await self.db.run(spell_slot_manager.use_spell_slot, character_id, spell_level)
+                if used_slot_level is not None:
+                    kept_slots.append((match, used_slot_level))
+                    used_spell_text = f"{match}"
+                    if used_slot_level > spell_level:
+                        used_spell_text += f" (использован слот {used_slot_level} уровня)"
+                    used_spells.append(used_spell_text)
+                    logger.info(f"Character {character_id} used spell slot for '{match}'")
+
+        # Заклинания, которых в новой версии действия нет, - слот возвращается
+        for spell_name, slot_level in unpaid:
+            if slot_level:
+                await self.db.run(spell_slot_manager.restore_spell_slot, character_id, slot_level)
+                logger.info(f"Character {character_id} got back spell slot {slot_level} for '{spell_name}'")
 
         # Store the action
         if adventure_id not in self.pending_actions:
@@ -109,14 +131,15 @@ class ActionHandler:
 
         self.pending_actions[adventure_id][user_id] = {
             'character_name': character['name'],
-            'action': action_text
+            'action': action_text,
+            'spent_slots': kept_slots
         }
         
         # Подтверждение действия с информацией об использованных слотах
         confirmation_text = f"✅ Действие записано: {action_text}"
-        if 'used_spells' in locals() and used_spells:
+        if used_spells:
             confirmation_text += f"\n🔮 Использованы заклинания: {', '.join(used_spells)}"
-            slot_info = spell_slot_manager.get_spell_slots_info(character_id)
+            slot_info = await self.db.run(spell_slot_manager.get_spell_slots_info, character_id)
             confirmation_text += f"\n{slot_info}"
 
         await context.bot.send_message(chat_id=update.effective_chat.id, text=confirmation_text)
@@ -126,11 +149,8 @@ class ActionHandler:
 
     async def check_all_actions_submitted(self, update: Update, context: ContextTypes.DEFAULT_TYPE, adventure_id: int):
         """Check if all participants have submitted their actions"""
-        if not self.db.connection or not self.db.connection.is_connected():
-            self.db.connect()
-
         # Get all participants
-        participants = self.db.execute_query("""
+        participants = await self.db.fetch("""
             SELECT c.user_id, c.name
             FROM adventure_participants ap
             JOIN characters c ON ap.character_id = c.id
@@ -158,25 +178,35 @@ class ActionHandler:
         
         # Send to Grok
         logger.info(f"ACTION DEBUG: Sending actions to Grok API...")
-        response_text, enemies, xp_reward = await asyncio.to_thread(
-            grok.continue_adventure, 
-            adventure_id, 
-            actions
-        )
+        # Ответ показывается игрокам по мере генерации
+        stream = StreamingMessage(context.bot, update.effective_chat.id)
+        parsed = await grok.continue_adventure(adventure_id, actions, on_text=stream.update)
+        if parsed is None:
+            # Grok недоступен: действия остаются в pending_actions, ход можно повторить
+            logger.warning(f"ACTION DEBUG: No response from Grok, keeping pending actions for adventure {adventure_id}")
+            notice = ("⚠️ Мастер сейчас не отвечает. Действия сохранены — чтобы отправить ход снова, "
+                      "любой игрок может повторить свое действие.")
+            # Оборванный на полуслове ответ заменяется этим предупреждением
+            if not await stream.finish(notice):
+                await context.bot.send_message(chat_id=update.effective_chat.id, text=notice)
+            return
+        enemies = parsed.enemies
+        xp_reward = parsed.xp_reward
         
         logger.info(f"ACTION DEBUG: Received response from Grok API")
-        logger.info(f"ACTION DEBUG: Response length: {len(response_text)} characters")
+        logger.info(f"ACTION DEBUG: Response length: {len(parsed.text)} characters")
         logger.info(f"ACTION DEBUG: Number of enemies parsed: {len(enemies)}")
         logger.info(f"ACTION DEBUG: XP reward: {xp_reward}")
-        logger.info(f"ACTION DEBUG: Response contains COMBAT_START: {'***COMBAT_START***' in response_text}")
+        logger.info(f"ACTION DEBUG: Response contains COMBAT_START: {parsed.combat_started}")
 
         # Clean response for players (remove enemy stats)
-        clean_response = grok.clean_response_for_players(response_text)
+        clean_response = parsed.clean_text
         logger.info(f"ACTION DEBUG: Clean response length: {len(clean_response)} characters")
         
         # Send response to chat
         logger.info(f"ACTION DEBUG: Sending clean response to chat...")
-        await send_long_message(update, context, clean_response)
+        if not await stream.finish(clean_response):
+            await send_long_message(update, context, clean_response)
 
         # Handle XP reward if any
         if xp_reward > 0:
@@ -184,7 +214,7 @@ class ActionHandler:
             await self.award_experience(update, adventure_id, xp_reward)
 
         # Check if adventure should end
-        if grok.is_adventure_ended(response_text):
+        if parsed.adventure_ended:
             logger.info(f"ACTION DEBUG: Adventure end trigger detected, ending adventure {adventure_id}")
             await self.end_adventure(update, context, adventure_id)
             return
@@ -194,13 +224,15 @@ class ActionHandler:
             logger.info(f"ACTION DEBUG: Starting combat with {len(enemies)} enemies!")
             for i, enemy in enumerate(enemies):
                 logger.info(f"ACTION DEBUG: Enemy {i+1}: {enemy['name']} (HP: {enemy['hit_points']})")
-            await combat_manager.start_combat(update, context, adventure_id, enemies)
-            # Update adventure status to combat
-            self.db.execute_query(
-                "UPDATE adventures SET status = 'combat' WHERE id = %s",
-                (adventure_id,)
-            )
-            logger.info(f"ACTION DEBUG: Adventure status updated to 'combat'")
+            if await combat_manager.start_combat(update, context, adventure_id, enemies):
+                # Update adventure status to combat
+                await self.db.execute(
+                    "UPDATE adventures SET status = 'combat' WHERE id = %s",
+                    (adventure_id,)
+                )
+                logger.info(f"ACTION DEBUG: Adventure status updated to 'combat'")
+            else:
+                logger.warning(f"ACTION DEBUG: Combat did not start for adventure {adventure_id}, continuing the story")
         else:
             logger.info(f"ACTION DEBUG: No enemies found, continuing normal adventure")
 
@@ -210,11 +242,8 @@ class ActionHandler:
 
     async def award_experience(self, update: Update, adventure_id: int, xp_amount: int):
         """Award experience to all participants"""
-        if not self.db.connection or not self.db.connection.is_connected():
-            self.db.connect()
-
         # Get all participants
-        participants = self.db.execute_query("""
+        participants = await self.db.fetch("""
             SELECT c.id, c.name, c.experience, c.level
             FROM adventure_participants ap
             JOIN characters c ON ap.character_id = c.id
@@ -231,7 +260,7 @@ class ActionHandler:
             old_level = participant['level']
 
             # Update character
-            self.db.execute_query(
+            await self.db.execute(
                 "UPDATE characters SET experience = %s, level = %s WHERE id = %s",
                 (new_xp, new_level, participant['id'])
             )
@@ -248,25 +277,14 @@ class ActionHandler:
 
     def calculate_level_from_xp(self, xp: int) -> int:
         """Calculate character level from experience points"""
-        if not self.db.connection or not self.db.connection.is_connected():
-            self.db.connect()
-
-        level_data = self.db.execute_query(
-            "SELECT level FROM levels WHERE experience_required <= %s ORDER BY level DESC LIMIT 1",
-            (xp,)
-        )
-
-        return level_data[0]['level'] if level_data else 1
+        return reference_cache.level_for_xp(xp)
     
     async def end_adventure(self, update: Update, context: ContextTypes.DEFAULT_TYPE, adventure_id: int):
         """Завершает приключение"""
-        if not self.db.connection or not self.db.connection.is_connected():
-            self.db.connect()
-        
         logger.info(f"ACTION DEBUG: Ending adventure {adventure_id}")
         
         # Update adventure status to finished
-        self.db.execute_query(
+        await self.db.execute(
             "UPDATE adventures SET status = 'finished' WHERE id = %s",
             (adventure_id,)
         )
@@ -276,13 +294,14 @@ class ActionHandler:
             del self.pending_actions[adventure_id]
         
         # Clear combat data if any
-        self.db.execute_query(
+        combat_states.discard(adventure_id)
+        await self.db.execute(
             "DELETE FROM combat_participants WHERE adventure_id = %s",
             (adventure_id,)
         )
         
         # Also clear accumulated combat metrics for this adventure
-        self.db.execute_query(
+        await self.db.execute(
             "DELETE FROM combat_metrics WHERE adventure_id = %s",
             (adventure_id,)
         )
@@ -303,11 +322,8 @@ class ActionHandler:
 
         user_id = update.effective_user.id
 
-        if not self.db.connection or not self.db.connection.is_connected():
-            self.db.connect()
-
         # Check if user has character
-        character = self.db.execute_query(
+        character = await self.db.fetch(
             "SELECT id, name FROM characters WHERE user_id = %s AND is_active = TRUE",
             (user_id,)
         )
@@ -317,14 +333,14 @@ class ActionHandler:
             return
 
         # Check if there's a preparing adventure
-        adventure = self.db.execute_query(
+        adventure = await self.db.fetch(
             "SELECT id FROM adventures WHERE chat_id = %s AND status = 'preparing'",
             (update.effective_chat.id,)
         )
 
         if adventure:
             # Join the existing adventure
-            self.db.execute_query(
+            await self.db.execute(
                 "INSERT IGNORE INTO adventure_participants (adventure_id, character_id) VALUES (%s, %s)",
                 (adventure[0]['id'], character[0]['id'])
             )
@@ -334,7 +350,7 @@ class ActionHandler:
             logger.info(f"No preparing adventure found, creating new one for user {user_id} in chat {update.effective_chat.id}")
             
             # Check if there's already an active adventure
-            active_adventure = self.db.execute_query(
+            active_adventure = await self.db.fetch(
                 "SELECT id FROM adventures WHERE chat_id = %s AND status = 'active'",
                 (update.effective_chat.id,)
             )
@@ -344,32 +360,25 @@ class ActionHandler:
                 return
                 
             # Create new adventure
-            result = self.db.execute_query(
+            adventure_id = await self.db.insert(
                 "INSERT INTO adventures (chat_id, status) VALUES (%s, 'preparing')",
                 (update.effective_chat.id,)
             )
             
-            if result:
-                # Get the created adventure ID
-                adventure_id_result = self.db.execute_query("SELECT LAST_INSERT_ID() as id")
-                if adventure_id_result:
-                    adventure_id = adventure_id_result[0]['id']
-                    
-                    # Add the character to the new adventure
-                    self.db.execute_query(
-                        "INSERT INTO adventure_participants (adventure_id, character_id) VALUES (%s, %s)",
-                        (adventure_id, character[0]['id'])
-                    )
-                    
-                    await query.edit_message_text(
-                        f"🎉 Создана новая группа!\n"
-                        f"✅ {character[0]['name']} присоединился к группе!\n\n"
-                        f"Пригласите других игроков присоединиться, затем используйте команды для начала приключения."
-                    )
-                    
-                    logger.info(f"Created new adventure {adventure_id} and added character {character[0]['id']} to it")
-                else:
-                    await query.edit_message_text("Ошибка при создании группы.")
+            if adventure_id:
+                # Add the character to the new adventure
+                await self.db.execute(
+                    "INSERT INTO adventure_participants (adventure_id, character_id) VALUES (%s, %s)",
+                    (adventure_id, character[0]['id'])
+                )
+                
+                await query.edit_message_text(
+                    f"🎉 Создана новая группа!\n"
+                    f"✅ {character[0]['name']} присоединился к группе!\n\n"
+                    f"Пригласите других игроков присоединиться, затем используйте команды для начала приключения."
+                )
+                
+                logger.info(f"Created new adventure {adventure_id} and added character {character[0]['id']} to it")
             else:
                 await query.edit_message_text("Ошибка при создании группы.")
 
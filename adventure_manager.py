@@ -3,8 +3,7 @@ from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes
 from database import get_db
 from grok_api import grok
-from telegram_utils import send_long_message
-import asyncio
+from telegram_utils import send_long_message, StreamingMessage
 
 logger = logging.getLogger(__name__)
 
@@ -15,11 +14,8 @@ class AdventureManager:
     async def start_new_adventure(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         user_id = update.effective_user.id
         
-        if not self.db.connection or not self.db.connection.is_connected():
-            self.db.connect()
-
         # Check if there is already an active adventure
-        active_adventure = self.db.execute_query(
+        active_adventure = await self.db.fetch(
             "SELECT id FROM adventures WHERE chat_id = %s AND status = 'active'",
             (update.effective_chat.id,)
         )
@@ -28,7 +24,7 @@ class AdventureManager:
             await update.message.reply_text("Already there is an active adventure. Terminate it first.")
             return
 
-        characters = self.db.execute_query(
+        characters = await self.db.fetch(
             "SELECT id, name FROM characters WHERE user_id = %s AND is_active = TRUE",
             (user_id,)
         )
@@ -38,30 +34,22 @@ class AdventureManager:
             return
 
         # Create new adventure
-        result = self.db.execute_query(
+        adventure_id = await self.db.insert(
             "INSERT INTO adventures (chat_id, status) VALUES (%s, 'preparing')",
             (update.effective_chat.id,)
         )
 
-        if result:
-            # Get the created adventure ID
-            adventure_id_result = self.db.execute_query("SELECT LAST_INSERT_ID() as id")
-            if adventure_id_result:
-                adventure_id = adventure_id_result[0]['id']
-                
-                await update.message.reply_text("Adventure created! Invite others to join.")
-                self.db.execute_query(
-                    "INSERT INTO adventure_participants (adventure_id, character_id) VALUES (%s, %s)",
-                    (adventure_id, characters[0]['id'])
-                )
-                # Output current party composition
-                await self.show_party_composition(update, context, adventure_id)
+        if adventure_id:
+            await update.message.reply_text("Adventure created! Invite others to join.")
+            await self.db.execute(
+                "INSERT INTO adventure_participants (adventure_id, character_id) VALUES (%s, %s)",
+                (adventure_id, characters[0]['id'])
+            )
+            # Output current party composition
+            await self.show_party_composition(update, context, adventure_id)
 
     async def show_party_composition(self, update: Update, context: ContextTypes.DEFAULT_TYPE, adventure_id: int):
-        if not self.db.connection or not self.db.connection.is_connected():
-            self.db.connect()
-
-        participants = self.db.execute_query(
+        participants = await self.db.fetch(
             "SELECT characters.name FROM adventure_participants "
             "INNER JOIN characters ON adventure_participants.character_id = characters.id "
             "WHERE adventure_participants.adventure_id = %s",
@@ -84,13 +72,10 @@ class AdventureManager:
         query = update.callback_query
         await query.answer()
 
-        if not self.db.connection or not self.db.connection.is_connected():
-            self.db.connect()
-
         adventure_id = int(query.data.split('_')[-1])
         
         # Get characters information
-        characters = self.db.execute_query(
+        characters = await self.db.fetch(
             "SELECT c.*, r.name as race_name, o.name as origin_name, cl.name as class_name "
             "FROM adventure_participants ap "
             "INNER JOIN characters c ON ap.character_id = c.id "
@@ -104,14 +89,14 @@ class AdventureManager:
         # Получаем навыки и заклинания для каждого персонажа
         for character in characters:
             # Получаем навыки персонажа
-            skills = self.db.execute_query(
+            skills = await self.db.fetch(
                 "SELECT skill_name FROM character_skills WHERE character_id = %s",
                 (character['id'],)
             )
             character['skills'] = [skill['skill_name'] for skill in skills] if skills else []
             
             # Получаем заклинания персонажа
-            spells = self.db.execute_query(
+            spells = await self.db.fetch(
                 "SELECT s.name, s.level FROM character_spells cs "
                 "JOIN spells s ON cs.spell_id = s.id "
                 "WHERE cs.character_id = %s ORDER BY s.level, s.name",
@@ -125,7 +110,8 @@ class AdventureManager:
 
         # Generate adventure intro
         logger.info("FLOW: About to call grok.generate_adventure_intro")
-        intro_text = await asyncio.to_thread(grok.generate_adventure_intro, adventure_id, characters)
+        stream = StreamingMessage(context.bot, update.effective_chat.id)
+        intro_text = await grok.generate_adventure_intro(adventure_id, characters, on_text=stream.update)
         logger.info(f"FLOW: Received intro_text from Grok, length: {len(intro_text)} characters")
         logger.info(f"FLOW: First 200 characters of intro_text: {intro_text[:200]}...")
 
@@ -133,20 +119,18 @@ class AdventureManager:
         clean_intro = grok.clean_response_for_players(intro_text)
         
         logger.info("FLOW: About to send intro_text to Telegram")
-        await send_long_message(update, context, clean_intro)
+        if not await stream.finish(clean_intro):
+            await send_long_message(update, context, clean_intro)
         logger.info("FLOW: Finished sending intro_text to Telegram")
         # Update adventure status
-        self.db.execute_query(
+        await self.db.execute(
             "UPDATE adventures SET status = 'active' WHERE id = %s",
             (adventure_id,)
         )
 
     async def terminate_adventure(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        if not self.db.connection or not self.db.connection.is_connected():
-            self.db.connect()
-
         # Checking if there is an active adventure
-        active_adventure = self.db.execute_query(
+        active_adventure = await self.db.fetch(
             "SELECT id FROM adventures WHERE chat_id = %s AND status = 'active'",
             (update.effective_chat.id,)
         )
@@ -157,10 +141,10 @@ class AdventureManager:
 
         # Terminate the active adventure
         adventure_id = active_adventure[0]['id']
-        self.db.execute_query("UPDATE adventures SET status = 'terminated' WHERE id = %s", (adventure_id,))
+        await self.db.execute("UPDATE adventures SET status = 'terminated' WHERE id = %s", (adventure_id,))
 
         # Also clear accumulated combat metrics for this adventure
-        self.db.execute_query(
+        await self.db.execute(
             "DELETE FROM combat_metrics WHERE adventure_id = %s",
             (adventure_id,)
         )
@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Микро-бенчмарк разбора ответов Grok: однопроходный response_parser против
+прежней цепочки clean_response_for_players + parse_enemies + parse_xp_reward +
+is_adventure_ended (скопирована ниже без записи в базу).
+
+Строки combat_start_json.txt и combat_drifted (synthetic) всегда помечены
+"differs", и парсер на них медленнее (около 0.2-0.4x): старые regex не
+находят там ни одного врага (0/2), а парсер разбирает JSON со схемой или
+блоки построчно. Это ожидаемо - прежняя цепочка этих форматов не понимает,
+и сравнивать там нечего.
+
+Запуск: python benchmark_response_parser.py [число повторов]
+"""
+
+import os
+import re
+import sys
+import timeit
+
+from response_parser import parse_response
+
+RESPONSES_DIR = "mock_responses"
+
+
+# --- Прежние функции GrokAPI (без сохранения в базу) --------------------------
+
+def legacy_clean_response_for_players(text):
+    clean_text = text
+    clean_text = re.sub(r'\*\*\*XP_REWARD: \d+\*\*\*', '', clean_text)
+    clean_text = re.sub(r'\*\*\*ADVENTURE_END\*\*\*', '', clean_text)
+    if "***COMBAT_START***" in clean_text:
+        combat_start_index = clean_text.find("***COMBAT_START***")
+        clean_text = clean_text[:combat_start_index].strip()
+    return clean_text.strip()
+
+
+def legacy_parse_enemies(text):
+    if "***COMBAT_START***" not in text:
+        return []
+    enemies = []
+    combat_start_pos = text.find("***COMBAT_START***")
+    combat_text = text[combat_start_pos:]
+    enemy_blocks = re.split(r'(?=ENEMY:)', combat_text)[1:]
+    for block in enemy_blocks:
+        enemy_match = re.search(r"ENEMY: (.+?)\nHP: (\d+)\nSTR: (\d+) \(мод: ([+-]?\d+)\)\nDEX: (\d+) \(мод: ([+-]?\d+)\)\nCON: (\d+) \(мод: ([+-]?\d+)\)\nINT: (\d+) \(мод: ([+-]?\d+)\)\nWIS: (\d+) \(мод: ([+-]?\d+)\)\nCHA: (\d+) \(мод: ([+-]?\d+)\)", block, re.DOTALL)
+        if not enemy_match:
+            continue
+        attack_matches = re.findall(r"ATTACK: (.+?) \((.+?), бонус к атаке: ([+-]?\d+)\)", block)
+        xp_match = re.search(r"XP: (\d+)", block)
+        if not xp_match:
+            continue
+        enemies.append({
+            'name': enemy_match.group(1).strip(),
+            'hit_points': int(enemy_match.group(2)),
+            'experience_reward': int(xp_match.group(1)),
+            'attacks': attack_matches,
+        })
+    return enemies
+
+
+def legacy_parse_xp_reward(text):
+    match = re.search(r"\*\*\*XP_REWARD: (\d+)\*\*\*", text)
+    return int(match.group(1)) if match else 0
+
+
+def legacy_is_adventure_ended(text):
+    return "***ADVENTURE_END***" in text
+
+
+def legacy_pipeline(text):
+    # Как это делали continue_adventure и action_handler
+    "***COMBAT_START***" in text
+    enemies = legacy_parse_enemies(text)
+    xp_reward = legacy_parse_xp_reward(text)
+    clean_text = legacy_clean_response_for_players(text)
+    ended = legacy_is_adventure_ended(text)
+    return clean_text, enemies, xp_reward, ended
+
+
+# --- Замер ------------------------------------------------------------------------
+
+def load_samples():
+    samples = {}
+    for filename in sorted(os.listdir(RESPONSES_DIR)):
+        if filename.endswith('.txt'):
+            with open(os.path.join(RESPONSES_DIR, filename), encoding='utf-8') as f:
+                samples[filename] = f.read()
+    # Длинный ответ: повествование в несколько раз больше и бой в конце
+    combat = samples.get('combat_start.txt', '')
+    samples['long_combat (synthetic)'] = samples.get('continue_adventure.txt', '') * 8 + "\n\n" + combat
+    # Отклонения формата: переводы строк Windows, лишние пробелы, нет строк ATTACK
+    drifted = re.sub(r"ATTACK: [^\n]*\n", "", combat).replace("HP: ", "HP:  ").replace("\n", "\r\n")
+    samples['combat_drifted (synthetic)'] = drifted
+    return samples
+
+
+def main():
+    number = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    samples = load_samples()
+
+    print(f"{'sample':<28} {'legacy, us':>12} {'parser, us':>12} {'speedup':>8}  {'enemies':>7}  check")
+    for name, text in samples.items():
+        legacy = timeit.timeit(lambda: legacy_pipeline(text), number=number) / number * 1e6
+        single = timeit.timeit(lambda: parse_response(text), number=number) / number * 1e6
+
+        clean_text, enemies, xp_reward, ended = legacy_pipeline(text)
+        parsed = parse_response(text)
+        same = (parsed.clean_text == clean_text.replace('\r\n', '\n') and parsed.xp_reward == xp_reward
+                and parsed.adventure_ended == ended
+                and [e['name'] for e in parsed.enemies] == [e['name'] for e in enemies])
+        found = f"{len(enemies)}/{len(parsed.enemies)}"
+        print(f"{name:<28} {legacy:>12.1f} {single:>12.1f} {legacy / single:>7.1f}x  {found:>7}  "
+              f"{'same' if same else 'differs'}")
+
+
+if __name__ == "__main__":
+    main()
@@ -11,6 +11,10 @@ from callback_handler import handle_callback_query
 from rest_handler import rest_handler
 from spell_slot_manager import spell_slot_manager
 from achievement_manager import achievement_manager
+from reference_cache import reference_cache
+from migrations import apply_migrations
+from grok_api import grok
+from combat_state import combat_states
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
@@ -573,6 +577,19 @@ async def show_party(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None
     
     await update.message.reply_text(party_text, parse_mode='HTML')
 
+async def reload_reference_data(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Сбрасывает кэш справочников после запуска скриптов импорта"""
+    if update.effective_chat.id != ALLOWED_CHAT_ID:
+        return
+    
+    db = get_db()
+    reference_cache.invalidate()
+    await db.run(reference_cache.warm_up)
+    
+    stats = reference_cache.stats()
+    stats_text = "\n".join(f"• {name}: {info['rows']}" for name, info in stats.items())
+    await update.message.reply_text(f"🔄 Справочники перезагружены:\n{stats_text}")
+
 async def error_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Handler for errors"""
     logger.error(f"Update {update} caused error {context.error}")
@@ -591,10 +608,15 @@ async def unknown_command(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     if update.message:
         await update.message.reply_text("Sorry, I didn't understand that command.")
 
+async def shutdown_resources(application) -> None:
+    """Закрывает долгоживущие соединения при остановке бота"""
+    await combat_states.close()
+    await grok.close()
+
 # Main function to start the bot
 async def main() -> None:
     # Create the Application
-    application = ApplicationBuilder().token(TELEGRAM_BOT_TOKEN).build()
+    application = ApplicationBuilder().token(TELEGRAM_BOT_TOKEN).post_shutdown(shutdown_resources).build()
     
     # Register handlers for commands
     application.add_handler(CommandHandler("start", start))
@@ -611,6 +633,7 @@ async def main() -> None:
     application.add_handler(CommandHandler("leaveadventure", leave_adventure))
     application.add_handler(CommandHandler("action", action_handler.handle_action_command))
     application.add_handler(CommandHandler("rest", rest_handler.handle_rest_command))
+    application.add_handler(CommandHandler("reloaddata", reload_reference_data))
     
     # Add callback query handler
     application.add_handler(CallbackQueryHandler(handle_callback_query))
@@ -621,6 +644,12 @@ async def main() -> None:
     # Register error handler
     application.add_error_handler(error_handler)
 
+    # Доводим схему БД до актуальной версии до обработки первых апдейтов
+    await get_db().run(apply_migrations)
+    
+    # Загружаем справочники заранее, чтобы горячие пути не ходили в БД
+    await get_db().run(reference_cache.warm_up)
+
     # Start the bot
     logger.info("Starting the bot...")
     await application.run_polling()
@@ -6,9 +6,10 @@ from character_generation import character_gen
 from adventure_manager import adventure_manager
 from action_handler import action_handler
 from database import get_db
-from dice_utils import roll_d20, is_critical_hit, is_critical_miss, roll_dice, roll_dice_detailed, calculate_modifier
 from achievement_manager import achievement_manager
 from combat_achievements import record_damage_dealt, record_kill
+from combat_state import combat_states
+from combat_rules import ENEMY, player_attack
 from rest_handler import rest_handler
 
 logger = logging.getLogger(__name__)
@@ -89,9 +90,6 @@ async def handle_combat_action(update: Update, context: ContextTypes.DEFAULT_TYP
     logger.info(f"COMBAT DEBUG: Processing action {action_type} for character {character_id} in adventure {adventure_id}, turn {turn_index}")
     
     db = get_db()
-    if not db.connection or not db.connection.is_connected():
-        db.connect()
-    
     # Handle the specific combat action
     if action_type == 'attack':
         # Show target selection instead of immediate attack
@@ -135,9 +133,6 @@ async def handle_target_selection(update: Update, context: ContextTypes.DEFAULT_
     logger.info(f"COMBAT DEBUG: Character {character_id} selected target {target_id} in adventure {adventure_id}")
     
     db = get_db()
-    if not db.connection or not db.connection.is_connected():
-        db.connect()
-    
     # Perform the attack with the selected target
     await perform_character_attack(query, character_id, adventure_id, target_id, db)
     
@@ -149,7 +144,7 @@ async def perform_character_attack(query, character_id: int, adventure_id: int,
     """Perform a character attack against a specific target."""
     # Get character data
     char_query = "SELECT * FROM characters WHERE id = %s"
-    char_data = db.execute_query(char_query, (character_id,))
+    char_data = await db.fetch(char_query, (character_id,))
     
     if not char_data:
         await query.edit_message_text("❌ Ошибка: персонаж не найден")
@@ -158,136 +153,71 @@ async def perform_character_attack(query, character_id: int, adventure_id: int,
     character = char_data[0]
     char_name = character['name']
     
-    # Get target enemy data
-    enemy_query = "SELECT * FROM enemies WHERE id = %s AND hit_points > 0"
-    enemy_data = db.execute_query(enemy_query, (target_id,))
+    # Target enemy from the in-memory combat state
+    state = await combat_states.get(adventure_id)
+    target = state.get(ENEMY, target_id) if state else None
     
-    if not enemy_data:
+    if target is None or not target.active:
         await query.edit_message_text("❌ Ошибка: цель не найдена или уже повержена")
         return
     
-    target = enemy_data[0]
-    
-    # Get character's weapon/attack info - for simplicity, use strength modifier for melee attacks
-    strength_mod = calculate_modifier(character.get('strength', 10))
-    proficiency_bonus = 2  # Simplified proficiency bonus
-    attack_bonus = strength_mod + proficiency_bonus
-    
-    # Use enemy's stored AC (calculated when enemy was created)
-    target_ac = target['armor_class'] or 12  # Default AC if not set
-    
-    # Perform attack roll
-    attack_roll_result, attack_breakdown = roll_d20(attack_bonus)
-    raw_roll = attack_roll_result - attack_bonus  # Get the raw d20 roll
+    # Melee weapon attack against the enemy's stored AC (same rules as combat_simulator)
+    attack = player_attack(character.get('strength', 10), target.ac)
     
-    result_text = f"⚔️ {char_name} атакует {target['name']}!\n"
-    result_text += f"🎲 Бросок атаки: {attack_breakdown} против AC {target_ac}"
+    result_text = f"⚔️ {char_name} атакует {target.name}!\n"
+    result_text += f"🎲 Бросок атаки: {attack.roll_text} против AC {target.ac}"
     
-    # Check for critical hit/miss
-    if is_critical_hit(raw_roll):
+    user_id = character.get('user_id')
+    if attack.critical:
         result_text += f"\n🎯 КРИТИЧЕСКОЕ ПОПАДАНИЕ! (натуральная 20)"
-        # Double damage dice on crit - roll twice and combine
-        total1, rolls1, modifier1, _ = roll_dice_detailed('1d8')
-        total2, rolls2, modifier2, _ = roll_dice_detailed('1d8')
-        
-        # Combine all rolls and add strength modifier
-        all_rolls = rolls1 + rolls2
-        total_damage = sum(all_rolls) + strength_mod
-        
-        # Create detailed breakdown
-        rolls_str = " + ".join(map(str, all_rolls))
-        damage_text = f"{rolls_str} + {strength_mod} = {total_damage}"
-        result_text += f"\n💥 Урон: {damage_text} урона"
-        
-        # Apply damage
-        new_hp = max(0, target['hit_points'] - total_damage)
-        db.execute_query("UPDATE enemies SET hit_points = %s WHERE id = %s", 
-                         (new_hp, target['id']))
-        # DO NOT show enemy HP for player attacks
-        
-        # Метрики боя: нанесенный урон
-        try:
-            dealt = target['hit_points'] - new_hp
-            if dealt > 0:
-                record_damage_dealt(adventure_id, character_id, dealt)
-        except Exception as e:
-            logger.warning(f"COMBAT METRICS WARNING: record_damage_dealt failed: {e}")
-        
-        # Проверяем достижения
-        # За критический удар
-        user_id = character.get('user_id')
+        # Достижение за критический удар
         if user_id:
-            ach = achievement_manager.grant_achievement(user_id, 'critical_hit', char_name)
-            # За высокий урон
-            ach_damage = achievement_manager.check_damage_achievement(user_id, total_damage, char_name)
-        
-        # Check if enemy is defeated
-        if new_hp <= 0:
-            result_text += f"\n💀 {target['name']} повержен!"
-            # Достижение за первое убийство
-            if user_id:
-                ach = achievement_manager.grant_achievement(user_id, 'first_kill', char_name)
-            # Метрики: убийство
-            try:
-                record_kill(adventure_id, character_id, 1)
-            except Exception as e:
-                logger.warning(f"COMBAT METRICS WARNING: record_kill failed: {e}")
-        
-    elif is_critical_miss(raw_roll):
+            await db.run(achievement_manager.grant_achievement, user_id, 'critical_hit', char_name)
+    elif attack.fumble:
         result_text += f"\n💨 КРИТИЧЕСКИЙ ПРОМАХ! (натуральная 1)"
         # Достижение за критический промах
-        user_id = character.get('user_id')
         if user_id:
-            ach = achievement_manager.grant_achievement(user_id, 'critical_miss', char_name)
-        
-    elif attack_roll_result >= target_ac:
+            await db.run(achievement_manager.grant_achievement, user_id, 'critical_miss', char_name)
+    elif attack.hit:
         result_text += f"\n✅ ПОПАДАНИЕ!"
-        # Calculate damage (1d8 + strength modifier for simplicity)
-        damage_result, damage_breakdown = roll_dice('1d8')
-        total_damage = damage_result + strength_mod
-        result_text += f"\n💥 Урон: {damage_breakdown} + {strength_mod} = {total_damage} урона"
+    else:
+        result_text += f"\n❌ ПРОМАХ!"
+    
+    if attack.hit:
+        result_text += f"\n💥 Урон: {attack.damage_text} урона"
         
-        # Apply damage
-        new_hp = max(0, target['hit_points'] - total_damage)
-        db.execute_query("UPDATE enemies SET hit_points = %s WHERE id = %s", 
-                         (new_hp, target['id']))
+        # Apply damage (written to the database at the end of the round)
+        old_hp, new_hp = state.damage(ENEMY, target.id, attack.damage)
         # DO NOT show enemy HP for player attacks
         
         # Метрики боя: нанесенный урон
         try:
-            dealt = target['hit_points'] - new_hp
+            dealt = old_hp - new_hp
             if dealt > 0:
                 record_damage_dealt(adventure_id, character_id, dealt)
         except Exception as e:
             logger.warning(f"COMBAT METRICS WARNING: record_damage_dealt failed: {e}")
         
         # Проверяем достижения за урон
-        user_id = character.get('user_id')
         if user_id:
-            ach_damage = achievement_manager.check_damage_achievement(user_id, total_damage, char_name)
+            await db.run(achievement_manager.check_damage_achievement, user_id, attack.damage, char_name)
         
         # Check if enemy is defeated
         if new_hp <= 0:
-            result_text += f"\n💀 {target['name']} повержен!"
+            result_text += f"\n💀 {target.name} повержен!"
             # Достижение за первое убийство
             if user_id:
-                ach = achievement_manager.grant_achievement(user_id, 'first_kill', char_name)
+                await db.run(achievement_manager.grant_achievement, user_id, 'first_kill', char_name)
             # Метрики: убийство
             try:
                 record_kill(adventure_id, character_id, 1)
             except Exception as e:
                 logger.warning(f"COMBAT METRICS WARNING: record_kill failed: {e}")
-            
-    else:
-        result_text += f"\n❌ ПРОМАХ!"
     
     await query.edit_message_text(result_text)
     
     # Check if all enemies are defeated
-    alive_enemies_query = "SELECT COUNT(*) as count FROM enemies WHERE adventure_id = %s AND hit_points > 0"
-    alive_enemies = db.execute_query(alive_enemies_query, (adventure_id,))
-    
-    if alive_enemies and alive_enemies[0]['count'] == 0:
+    if not state.alive(ENEMY):
         # Import combat_manager here to avoid circular imports
         from combat_manager import combat_manager
         await combat_manager.end_combat(query, adventure_id, victory='players')
@@ -5,6 +5,7 @@ from typing import Dict, List, Tuple, Optional
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes
 from database import get_db
+from reference_cache import reference_cache
 from spell_slot_manager import spell_slot_manager
 from armor_utils import update_character_ac
 from achievement_manager import achievement_manager
@@ -107,7 +108,7 @@ class CharacterGenerator:
             try:
                 if not self.db.connection or not self.db.connection.is_connected():
                     self.db.connect()
-                race_info = self.db.execute_query("SELECT name FROM races WHERE id = %s", (char_data['race_id'],))
+                race_info = reference_cache.lookup('races', char_data['race_id'])
                 if race_info:
                     info_text += f"🧝‍♂️ **Раса:** {race_info[0]['name']}\n"
             except Exception as e:
@@ -116,7 +117,7 @@ class CharacterGenerator:
         # Происхождение
         if char_data.get('origin_id'):
             try:
-                origin_info = self.db.execute_query("SELECT name FROM origins WHERE id = %s", (char_data['origin_id'],))
+                origin_info = reference_cache.lookup('origins', char_data['origin_id'])
                 if origin_info:
                     info_text += f"🎭 **Происхождение:** {origin_info[0]['name']}\n"
             except Exception as e:
@@ -125,7 +126,7 @@ class CharacterGenerator:
         # Класс
         if char_data.get('class_id'):
             try:
-                class_info = self.db.execute_query("SELECT name FROM classes WHERE id = %s", (char_data['class_id'],))
+                class_info = reference_cache.lookup('classes', char_data['class_id'])
                 if class_info:
                     info_text += f"⚔️ **Класс:** {class_info[0]['name']}\n"
             except Exception as e:
@@ -144,14 +145,11 @@ class CharacterGenerator:
         equipment_text = ""
         for equipment in char_data.get('equipment', []):
             if equipment['type'] == 'armor':
-                armor_info = self.db.execute_query("SELECT name FROM armor WHERE id = %s", (equipment['id'],))
+                armor_info = reference_cache.lookup('armor', equipment['id'])
                 if armor_info:
                     equipment_text += f"🛡️ **Доспехи:** {armor_info[0]['name']}\n"
             elif equipment['type'] == 'weapon':
-                weapon_info = self.db.execute_query(
-                    "SELECT name, damage, damage_type, properties FROM weapons WHERE id = %s", 
-                    (equipment['id'],)
-                )
+                weapon_info = reference_cache.lookup('weapons', equipment['id'])
                 if weapon_info:
                     weapon = weapon_info[0]
                     equipment_text += f"⚔️ **Оружие:** {weapon['name']} ({weapon['damage']} {weapon['damage_type']})\n"
@@ -163,8 +161,7 @@ class CharacterGenerator:
         if char_data.get('class_id'):
             try:
                 # Получаем бонус мастерства из таблицы levels
-                level_info = self.db.execute_query("SELECT proficiency_bonus FROM levels WHERE level = 1")
-                proficiency_bonus = level_info[0]['proficiency_bonus'] if level_info else 2
+                proficiency_bonus = reference_cache.proficiency_bonus(1)
                 info_text += f"🎯 **Бонус мастерства:** +{proficiency_bonus}\n"
                 
                 # Класс доспехов
@@ -174,7 +171,7 @@ class CharacterGenerator:
                 # Проверяем наличие доспехов
                 for equipment in char_data.get('equipment', []):
                     if equipment['type'] == 'armor':
-                        armor_info = self.db.execute_query("SELECT armor_class, name FROM armor WHERE id = %s", (equipment['id'],))
+                        armor_info = reference_cache.lookup('armor', equipment['id'])
                         if armor_info:
                             armor_base = armor_info[0]['armor_class']
                             armor_name = armor_info[0]['name']
@@ -212,10 +209,7 @@ class CharacterGenerator:
                 if char_data.get('step') == 'finalized':
                     for equipment in char_data.get('equipment', []):
                         if equipment['type'] == 'weapon':
-                            weapon_info = self.db.execute_query(
-                                "SELECT name, damage, damage_type, properties FROM weapons WHERE id = %s", 
-                                (equipment['id'],)
-                            )
+                            weapon_info = reference_cache.lookup('weapons', equipment['id'])
                             if weapon_info:
                                 weapon = weapon_info[0]
                                 # Проверяем свойства оружия
@@ -245,7 +239,7 @@ class CharacterGenerator:
                                 info_text += f"⚔️ **Атака ({weapon['name']}):** {attack_bonus:+d} к атаке, {damage_str}{damage_mod:+d} {damage_type_str}\n"
                     
                     # Заклинания для заклинателей
-                    class_info = self.db.execute_query("SELECT is_spellcaster FROM classes WHERE id = %s", (char_data['class_id'],))
+                    class_info = reference_cache.lookup('classes', char_data['class_id'])
                     if class_info and class_info[0]['is_spellcaster']:
                         # Получаем заклинания персонажа из базы данных
                         if 'character_id' in char_data:
@@ -276,12 +270,8 @@ class CharacterGenerator:
                                 slots = spell_slot_manager.get_available_slots(char_data['character_id'])
                             else:
                                 # Получаем слоты из таблицы class_spell_slots
-                                slots_info = self.db.execute_query(
-                                    "SELECT slot_level_1, slot_level_2, slot_level_3 FROM class_spell_slots WHERE class_id = %s AND level = 1",
-                                    (char_data['class_id'],)
-                                )
-                                if slots_info:
-                                    slot_data = slots_info[0]
+                                slot_data = reference_cache.class_spell_slots(char_data['class_id'], 1)
+                                if slot_data:
                                     slots = {}
                                     for i in range(1, 4):
                                         slot_count = slot_data.get(f'slot_level_{i}', 0)
@@ -434,7 +424,7 @@ class CharacterGenerator:
         if not self.db.connection or not self.db.connection.is_connected():
             self.db.connect()
         
-        races = self.db.execute_query("SELECT id, name FROM races ORDER BY name")
+        races = reference_cache.all('races')
         logger.info(f"Found {len(races)} races in database")
         
         keyboard = []
@@ -489,7 +479,7 @@ class CharacterGenerator:
         if not self.db.connection or not self.db.connection.is_connected():
             self.db.connect()
         
-        race_info = self.db.execute_query("SELECT name FROM races WHERE id = %s", (race_id,))
+        race_info = reference_cache.lookup('races', race_id)
         race_name = race_info[0]['name'] if race_info else "Неизвестная раса"
         logger.info(f"User selected race: {race_name} (ID: {race_id})")
 
@@ -506,7 +496,7 @@ class CharacterGenerator:
         if not self.db.connection or not self.db.connection.is_connected():
             self.db.connect()
         
-        origins = self.db.execute_query("SELECT id, name, stat_bonuses FROM origins ORDER BY name")
+        origins = reference_cache.all('origins')
         
         # Мэппинг для кратких обозначений
         stat_short_names = {
@@ -565,7 +555,7 @@ class CharacterGenerator:
         if not self.db.connection or not self.db.connection.is_connected():
             self.db.connect()
         
-        origin_info = self.db.execute_query("SELECT name, stat_bonuses FROM origins WHERE id = %s", (origin_id,))
+        origin_info = reference_cache.lookup('origins', origin_id)
         origin_name = origin_info[0]['name'] if origin_info else "Неизвестное происхождение"
         logger.info(f"User selected origin: {origin_name} (ID: {origin_id})")
         
@@ -585,7 +575,7 @@ class CharacterGenerator:
         if not self.db.connection or not self.db.connection.is_connected():
             self.db.connect()
         
-        origin_info = self.db.execute_query("SELECT stat_bonuses FROM origins WHERE id = %s", (char_data['origin_id'],))
+        origin_info = reference_cache.lookup('origins', char_data['origin_id'])
         stat_bonuses = json.loads(origin_info[0]['stat_bonuses']) if origin_info else {}
         
         # Показываем варианты распределения бонусов
@@ -626,7 +616,7 @@ class CharacterGenerator:
         if not self.db.connection or not self.db.connection.is_connected():
             self.db.connect()
         
-        origin_info = self.db.execute_query("SELECT stat_bonuses FROM origins WHERE id = %s", (char_data['origin_id'],))
+        origin_info = reference_cache.lookup('origins', char_data['origin_id'])
         stat_bonuses = json.loads(origin_info[0]['stat_bonuses']) if origin_info else {}
         available_stats = list(stat_bonuses.keys())
         
@@ -696,7 +686,7 @@ class CharacterGenerator:
         
         await self.update_character_info_display(update, context)
 
-        classes = self.db.execute_query("SELECT id, name FROM classes ORDER BY name")
+        classes = reference_cache.all('classes')
         
         keyboard = []
         for i in range(0, len(classes), 2):
@@ -733,7 +723,7 @@ class CharacterGenerator:
         if not self.db.connection or not self.db.connection.is_connected():
             self.db.connect()
         
-        class_info = self.db.execute_query("SELECT name FROM classes WHERE id = %s", (class_id,))
+        class_info = reference_cache.lookup('classes', class_id)
         class_name = class_info[0]['name'] if class_info else "Неизвестный класс"
         logger.info(f"User selected class: {class_name} (ID: {class_id})")
         
@@ -752,10 +742,7 @@ class CharacterGenerator:
         if not self.db.connection or not self.db.connection.is_connected():
             self.db.connect()
         
-        class_info = self.db.execute_query(
-            "SELECT skills_available, skills_count FROM classes WHERE id = %s", 
-            (char_data['class_id'],)
-        )
+        class_info = reference_cache.lookup('classes', char_data['class_id'])
         
         if not class_info:
             return
@@ -832,8 +819,8 @@ class CharacterGenerator:
             self.db.connect()
         
         # Получаем стартовые деньги из класса и происхождения
-        class_info = self.db.execute_query("SELECT starting_money FROM classes WHERE id = %s", (char_data['class_id'],))
-        origin_info = self.db.execute_query("SELECT starting_money FROM origins WHERE id = %s", (char_data['origin_id'],))
+        class_info = reference_cache.lookup('classes', char_data['class_id'])
+        origin_info = reference_cache.lookup('origins', char_data['origin_id'])
         
         starting_money = (class_info[0]['starting_money'] if class_info else 0) + \
                         (origin_info[0]['starting_money'] if origin_info else 0)
@@ -866,12 +853,11 @@ class CharacterGenerator:
             self.db.connect()
         
         # Получаем владение доспехами класса
-        class_info = self.db.execute_query("SELECT armor_proficiency FROM classes WHERE id = %s", (char_data['class_id'],))
+        class_info = reference_cache.lookup('classes', char_data['class_id'])
         armor_prof = json.loads(class_info[0]['armor_proficiency']) if class_info else []
         
         # Получаем доступные доспехи
-        armor_query = "SELECT id, name, price, armor_class, armor_type FROM armor WHERE price <= %s"
-        available_armor = self.db.execute_query(armor_query, (char_data['money'],))
+        available_armor = [armor for armor in reference_cache.all('armor') if armor['price'] <= char_data['money']]
         
         keyboard = []
         keyboard.append([InlineKeyboardButton("Не покупать доспехи", callback_data="armor_none")])
@@ -916,7 +902,7 @@ class CharacterGenerator:
             if not self.db.connection or not self.db.connection.is_connected():
                 self.db.connect()
             
-            armor_info = self.db.execute_query("SELECT name, price FROM armor WHERE id = %s", (armor_id,))
+            armor_info = reference_cache.lookup('armor', armor_id)
             if armor_info:
                 armor = armor_info[0]
                 char_data['money'] -= armor['price']
@@ -969,12 +955,11 @@ class CharacterGenerator:
             self.db.connect()
         
         # Получаем владение оружием класса
-        class_info = self.db.execute_query("SELECT weapon_proficiency FROM classes WHERE id = %s", (char_data['class_id'],))
+        class_info = reference_cache.lookup('classes', char_data['class_id'])
         weapon_prof = json.loads(class_info[0]['weapon_proficiency']) if class_info else []
         
         # Получаем доступное оружие
-        weapon_query = "SELECT id, name, price, damage, damage_type, weapon_type, properties FROM weapons WHERE price <= %s"
-        available_weapons = self.db.execute_query(weapon_query, (char_data['money'],))
+        available_weapons = [weapon for weapon in reference_cache.all('weapons') if weapon['price'] <= char_data['money']]
         
         keyboard = []
         keyboard.append([InlineKeyboardButton("Закончить покупки", callback_data="weapon_done")])
@@ -1019,7 +1004,7 @@ class CharacterGenerator:
             if not self.db.connection or not self.db.connection.is_connected():
                 self.db.connect()
             
-            class_info = self.db.execute_query("SELECT is_spellcaster FROM classes WHERE id = %s", (char_data['class_id'],))
+            class_info = reference_cache.lookup('classes', char_data['class_id'])
             if class_info and class_info[0]['is_spellcaster']:
                 # Переходим к выбору заклинаний
                 await self.show_spell_selection(update, context)
@@ -1032,7 +1017,7 @@ class CharacterGenerator:
             if not self.db.connection or not self.db.connection.is_connected():
                 self.db.connect()
             
-            weapon_info = self.db.execute_query("SELECT name, price FROM weapons WHERE id = %s", (weapon_id,))
+            weapon_info = reference_cache.lookup('weapons', weapon_id)
             if weapon_info:
                 weapon = weapon_info[0]
                 if char_data['money'] >= weapon['price']:
@@ -1057,17 +1042,13 @@ class CharacterGenerator:
             self.db.connect()
         
         # Получаем информацию о заговорах и заклинаниях
-        slots_query = """SELECT known_cantrips, known_spells, slot_level_1 
-                        FROM class_spell_slots 
-                        WHERE class_id = %s AND level = 1"""
-        slots_info = self.db.execute_query(slots_query, (class_id,))
+        slots = reference_cache.class_spell_slots(class_id, 1)
         
-        if not slots_info:
+        if not slots:
             # Нет информации о слотах, завершаем создание
             await self.finalize_character(update, context)
             return
         
-        slots = slots_info[0]
         known_cantrips = slots['known_cantrips'] or 0
         known_spells = slots['known_spells'] or 0
         has_spell_slots = (slots['slot_level_1'] or 0) > 0
@@ -1097,7 +1078,7 @@ class CharacterGenerator:
             self.db.connect()
         
         # Получаем имя класса
-        class_info = self.db.execute_query("SELECT name FROM classes WHERE id = %s", (class_id,))
+        class_info = reference_cache.lookup('classes', class_id)
         if not class_info:
             await self.finalize_character(update, context)
             return
@@ -1105,20 +1086,7 @@ class CharacterGenerator:
         class_name = class_info[0]['name']
         
         # Получаем доступные заговоры для класса
-        cantrips_query = """SELECT id, name, description 
-                           FROM spells 
-                           WHERE level = 0 AND JSON_CONTAINS(available_classes, %s)
-                           ORDER BY name"""
-        
-        available_cantrips = self.db.execute_query(cantrips_query, (f'"{class_name}"',))
-        
-        if not available_cantrips:
-            # Пробуем альтернативный запрос для старой структуры
-            cantrips_query = """SELECT id, name, description 
-                               FROM spells 
-                               WHERE level = 0 AND available_classes LIKE %s
-                               ORDER BY name"""
-            available_cantrips = self.db.execute_query(cantrips_query, (f'%"{class_name}"%',))
+        available_cantrips = reference_cache.spells_for_class(class_name, 0)
         
         if not available_cantrips:
             # Нет доступных заговоров, переходим к заклинаниям
@@ -1200,7 +1168,7 @@ class CharacterGenerator:
             self.db.connect()
         
         # Получаем имя класса
-        class_info = self.db.execute_query("SELECT name FROM classes WHERE id = %s", (class_id,))
+        class_info = reference_cache.lookup('classes', class_id)
         if not class_info:
             await self.finalize_character(update, context)
             return
@@ -1208,20 +1176,7 @@ class CharacterGenerator:
         class_name = class_info[0]['name']
         
         # Получаем доступные заклинания 1 уровня для класса
-        spells_query = """SELECT id, name, description 
-                         FROM spells 
-                         WHERE level = 1 AND JSON_CONTAINS(available_classes, %s)
-                         ORDER BY name"""
-        
-        available_spells = self.db.execute_query(spells_query, (f'"{class_name}"',))
-        
-        if not available_spells:
-            # Пробуем альтернативный запрос
-            spells_query = """SELECT id, name, description 
-                             FROM spells 
-                             WHERE level = 1 AND available_classes LIKE %s
-                             ORDER BY name"""
-            available_spells = self.db.execute_query(spells_query, (f'%"{class_name}"%',))
+        available_spells = reference_cache.spells_for_class(class_name, 1)
         
         if not available_spells:
             # Нет доступных заклинаний
@@ -1312,13 +1267,13 @@ class CharacterGenerator:
                 final_stats[stat_mapping[stat_code]] += bonus
         
         # Вычисляем хиты
-        class_info = self.db.execute_query("SELECT hit_die FROM classes WHERE id = %s", (char_data['class_id'],))
+        class_info = reference_cache.lookup('classes', char_data['class_id'])
         hit_die = class_info[0]['hit_die'] if class_info else 8
         con_modifier = self.get_modifier(final_stats['constitution'])
         max_hp = hit_die + con_modifier
         
         # Создаем персонажа в базе данных
-        character_id = self.db.execute_query("""
+        character_id = self.db.execute_insert("""
             INSERT INTO characters (user_id, name, race_id, origin_id, class_id, level, experience,
                                   strength, dexterity, constitution, intelligence, wisdom, charisma,
                                   current_hp, max_hp, money)
@@ -1329,76 +1284,71 @@ class CharacterGenerator:
               max_hp, max_hp, char_data['money']))
         
         if character_id:
-            # Получаем ID созданного персонажа
-            char_id_result = self.db.execute_query("SELECT LAST_INSERT_ID() as id")
-            if char_id_result:
-                character_id = char_id_result[0]['id']
+            # Добавляем экипировку
+            for equipment in char_data['equipment']:
+                self.db.execute_query(
+                    "INSERT INTO character_equipment (character_id, item_type, item_id, is_equipped) VALUES (%s, %s, %s, TRUE)",
+                    (character_id, equipment['type'], equipment['id'])
+                )
+            
+            # Добавляем навыки
+            selected_skills = char_data.get('selected_skills', [])
+            for skill in selected_skills:
+                self.db.execute_query(
+                    "INSERT INTO character_skills (character_id, skill_name) VALUES (%s, %s)",
+                    (character_id, skill)
+                )
+            
+            # Добавляем заклинания если класс заклинатель
+            class_info = reference_cache.lookup('classes', char_data['class_id'])
+            if class_info and class_info[0]['is_spellcaster']:
+                # Инициализируем слоты заклинаний для заклинателя
+                spell_slot_manager.initialize_character_slots(character_id)
+                logger.info(f"Initialized spell slots for character {character_id}")
+                
+                # Сохраняем выбранные заговоры и заклинания
+                selected_cantrips = char_data.get('selected_cantrips', [])
+                selected_spells = char_data.get('selected_spells', [])
                 
-                # Добавляем экипировку
-                for equipment in char_data['equipment']:
+                # Сохраняем заговоры
+                for cantrip_id in selected_cantrips:
                     self.db.execute_query(
-                        "INSERT INTO character_equipment (character_id, item_type, item_id, is_equipped) VALUES (%s, %s, %s, TRUE)",
-                        (character_id, equipment['type'], equipment['id'])
+                        "INSERT INTO character_spells (character_id, spell_id) VALUES (%s, %s)",
+                        (character_id, cantrip_id)
                     )
                 
-                # Добавляем навыки
-                selected_skills = char_data.get('selected_skills', [])
-                for skill in selected_skills:
+                # Сохраняем заклинания
+                for spell_id in selected_spells:
                     self.db.execute_query(
-                        "INSERT INTO character_skills (character_id, skill_name) VALUES (%s, %s)",
-                        (character_id, skill)
+                        "INSERT INTO character_spells (character_id, spell_id) VALUES (%s, %s)",
+                        (character_id, spell_id)
                     )
-                
-                # Добавляем заклинания если класс заклинатель
-                class_info = self.db.execute_query("SELECT is_spellcaster FROM classes WHERE id = %s", (char_data['class_id'],))
-                if class_info and class_info[0]['is_spellcaster']:
-                    # Инициализируем слоты заклинаний для заклинателя
-                    spell_slot_manager.initialize_character_slots(character_id)
-                    logger.info(f"Initialized spell slots for character {character_id}")
-                    
-                    # Сохраняем выбранные заговоры и заклинания
-                    selected_cantrips = char_data.get('selected_cantrips', [])
-                    selected_spells = char_data.get('selected_spells', [])
-                    
-                    # Сохраняем заговоры
-                    for cantrip_id in selected_cantrips:
-                        self.db.execute_query(
-                            "INSERT INTO character_spells (character_id, spell_id) VALUES (%s, %s)",
-                            (character_id, cantrip_id)
-                        )
-                    
-                    # Сохраняем заклинания
-                    for spell_id in selected_spells:
-                        self.db.execute_query(
-                            "INSERT INTO character_spells (character_id, spell_id) VALUES (%s, %s)",
-                            (character_id, spell_id)
-                        )
-                
-                # Обновляем AC персонажа с учетом доспехов и ловкости
-                update_character_ac(character_id)
-                
-                # Проверяем достижения
-                achievements_text = ""
-                
-                # Достижение за первого персонажа
-                existing_chars = self.db.execute_query(
-                    "SELECT COUNT(*) as count FROM characters WHERE user_id = %s AND id != %s",
-                    (user_id, character_id)
-                )
-                if existing_chars and existing_chars[0]['count'] == 0:
-                    ach = achievement_manager.grant_achievement(user_id, 'first_character', char_data['name'])
-                    if ach:
-                        achievements_text += achievement_manager.format_achievement_notification(ach)
-                
-                # Проверяем достижения за характеристики
-                for stat_name in stat_names:
-                    stat_value = final_stats[stat_name]
-                    ach = achievement_manager.check_stat_achievement(user_id, stat_name, stat_value, char_data['name'])
-                    if ach:
-                        achievements_text += achievement_manager.format_achievement_notification(ach)
-                
-                # Сохраняем текст о достижениях для отображения позже
-                char_data['achievements_text'] = achievements_text
+            
+            # Обновляем AC персонажа с учетом доспехов и ловкости
+            update_character_ac(character_id)
+            
+            # Проверяем достижения
+            achievements_text = ""
+            
+            # Достижение за первого персонажа
+            existing_chars = self.db.execute_query(
+                "SELECT COUNT(*) as count FROM characters WHERE user_id = %s AND id != %s",
+                (user_id, character_id)
+            )
+            if existing_chars and existing_chars[0]['count'] == 0:
+                ach = achievement_manager.grant_achievement(user_id, 'first_character', char_data['name'])
+                if ach:
+                    achievements_text += achievement_manager.format_achievement_notification(ach)
+            
+            # Проверяем достижения за характеристики
+            for stat_name in stat_names:
+                stat_value = final_stats[stat_name]
+                ach = achievement_manager.check_stat_achievement(user_id, stat_name, stat_value, char_data['name'])
+                if ach:
+                    achievements_text += achievement_manager.format_achievement_notification(ach)
+            
+            # Сохраняем текст о достижениях для отображения позже
+            char_data['achievements_text'] = achievements_text
         
         # Устанавливаем финальное состояние для отображения полной информации
         char_data['step'] = 'finalized'
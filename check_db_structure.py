@@ -17,8 +17,7 @@ def check_and_update_structure():
     # Check characters table structure
     print("\n=== Characters table structure ===")
     try:
-        result = db.execute_query("DESCRIBE characters")
-        for row in result:
+        for row in db.stream("DESCRIBE characters"):
             print(f"{row['Field']}: {row['Type']} ({row['Null']}, {row['Key']}, {row['Default']})")
     except Exception as e:
         print(f"Error checking characters table: {e}")
@@ -62,8 +61,7 @@ def check_and_update_structure():
     # Check enemies table structure
     print("\n=== Enemies table structure ===")
     try:
-        result = db.execute_query("DESCRIBE enemies")
-        for row in result:
+        for row in db.stream("DESCRIBE enemies"):
             print(f"{row['Field']}: {row['Type']} ({row['Null']}, {row['Key']}, {row['Default']})")
     except Exception as e:
         print(f"Error checking enemies table: {e}")
@@ -1,43 +1,33 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
-import mysql.connector
-from config import DB_HOST, DB_USER, DB_PASSWORD, DB_NAME
+from database import get_db
 
-conn = mysql.connector.connect(
-    host=DB_HOST, 
-    user=DB_USER, 
-    password=DB_PASSWORD, 
-    database=DB_NAME, 
-    charset='utf8mb4'
-)
-cursor = conn.cursor()
+db = get_db()
+db.connect()
 
 # Проверяем количество заклинаний
-cursor.execute('SELECT COUNT(*) FROM spells WHERE level = 1')
-print(f'Заклинаний 1-го уровня: {cursor.fetchone()[0]}')
+result = db.execute_query('SELECT COUNT(*) as count FROM spells WHERE level = 1')
+print(f'Заклинаний 1-го уровня: {result[0]["count"]}')
 
-cursor.execute('SELECT COUNT(*) FROM spells WHERE level = 0')
-print(f'Заговоров (0-й уровень): {cursor.fetchone()[0]}')
+result = db.execute_query('SELECT COUNT(*) as count FROM spells WHERE level = 0')
+print(f'Заговоров (0-й уровень): {result[0]["count"]}')
 
 # Примеры заклинаний 1-го уровня
-cursor.execute('SELECT name, damage, damage_type, scaling_type FROM spells WHERE level = 1 LIMIT 10')
 print('\nПримеры заклинаний 1-го уровня:')
-for row in cursor.fetchall():
-    print(f'  - {row[0]}: урон {row[1]} ({row[2]}), скалирование: {row[3]}')
+for row in db.stream('SELECT name, damage, damage_type, scaling_type FROM spells WHERE level = 1 LIMIT 10'):
+    print(f'  - {row["name"]}: урон {row["damage"]} ({row["damage_type"]}), скалирование: {row["scaling_type"]}')
 
 # Проверяем скалирование
-cursor.execute("""
+print('\nСкалирование заклинания "Волшебная стрела":')
+for row in db.stream("""
     SELECT s.name, ss.slot_level, ss.damage_bonus 
     FROM spells s 
     JOIN spell_slot_scaling ss ON s.id = ss.spell_id 
     WHERE s.name = 'Волшебная стрела' 
     ORDER BY ss.slot_level 
     LIMIT 5
-""")
-print('\nСкалирование заклинания "Волшебная стрела":')
-for row in cursor.fetchall():
-    print(f'  Слот {row[1]}: бонус урона {row[2]}')
+"""):
+    print(f'  Слот {row["slot_level"]}: бонус урона {row["damage_bonus"]}')
 
-cursor.close()
-conn.close()
+db.disconnect()
@@ -2,6 +2,5 @@ from database import get_db
 
 db = get_db()
 db.connect()
-result = db.execute_query('DESCRIBE spells')
-for r in result:
+for r in db.stream('DESCRIBE spells'):
     print(f"{r['Field']}: {r['Type']}")
@@ -4,6 +4,7 @@
 Учет боевых метрик и выдача достижений по итогам боя.
 """
 import logging
+import threading
 from typing import Optional, List, Dict
 from database import get_db
 from achievement_manager import achievement_manager
@@ -12,33 +13,7 @@ logger = logging.getLogger(__name__)
 
 db = get_db()
 
-def ensure_tables():
-    """Создает служебные таблицы для учета боя (если отсутствуют)."""
-    queries = [
-        """
-        CREATE TABLE IF NOT EXISTS combat_state (
-            adventure_id INT PRIMARY KEY,
-            round INT NOT NULL DEFAULT 1,
-            started_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
-        """,
-        """
-        CREATE TABLE IF NOT EXISTS combat_metrics (
-            adventure_id INT NOT NULL,
-            character_id INT NOT NULL,
-            damage_dealt INT NOT NULL DEFAULT 0,
-            damage_taken INT NOT NULL DEFAULT 0,
-            kills INT NOT NULL DEFAULT 0,
-            PRIMARY KEY (adventure_id, character_id)
-        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
-        """
-    ]
-    for q in queries:
-        db.execute_query(q)
-
-
 def init_combat(adventure_id: int):
-    ensure_tables()
     db.execute_query(
         "INSERT IGNORE INTO combat_state (adventure_id, round) VALUES (%s, 1)",
         (adventure_id,)
@@ -53,14 +28,15 @@ def init_combat(adventure_id: int):
         """,
         (adventure_id,)
     )
-    for p in participants:
-        db.execute_query(
+    if participants:
+        db.execute_many(
             "INSERT IGNORE INTO combat_metrics (adventure_id, character_id) VALUES (%s, %s)",
-            (adventure_id, p['character_id'])
+            [(adventure_id, p['character_id']) for p in participants]
         )
 
 
 def increment_round(adventure_id: int):
+    flush_metrics(adventure_id)
     db.execute_query(
         "UPDATE combat_state SET round = round + 1 WHERE adventure_id = %s",
         (adventure_id,)
@@ -72,58 +48,82 @@ def get_round(adventure_id: int) -> int:
     return row[0]['round'] if row else 1
 
 
+# Метрики копятся в памяти и сбрасываются в БД одним пакетом за раунд
+# (increment_round) и в конце боя, а не отдельным запросом на каждый удар.
+# Вызовы приходят из потоков пула БД, поэтому доступ под блокировкой.
+_pending: Dict[int, Dict[int, List[int]]] = {}
+_pending_lock = threading.Lock()
+
+# Индексы счетчиков в _pending
+_DEALT, _TAKEN, _KILLS = 0, 1, 2
+
+
+def _accumulate(adventure_id: int, character_id: int, field: int, amount: int):
+    with _pending_lock:
+        counters = _pending.setdefault(adventure_id, {}).setdefault(character_id, [0, 0, 0])
+        counters[field] += amount
+
+
 def record_damage_dealt(adventure_id: int, character_id: int, amount: int):
     if amount <= 0:
         return
-    ensure_tables()
-    db.execute_query(
-        """
-        INSERT INTO combat_metrics (adventure_id, character_id, damage_dealt)
-        VALUES (%s, %s, %s)
-        ON DUPLICATE KEY UPDATE damage_dealt = damage_dealt + VALUES(damage_dealt)
-        """,
-        (adventure_id, character_id, amount)
-    )
+    _accumulate(adventure_id, character_id, _DEALT, amount)
 
 
 def record_damage_taken(adventure_id: int, character_id: int, amount: int):
     if amount <= 0:
         return
-    ensure_tables()
-    db.execute_query(
-        """
-        INSERT INTO combat_metrics (adventure_id, character_id, damage_taken)
-        VALUES (%s, %s, %s)
-        ON DUPLICATE KEY UPDATE damage_taken = damage_taken + VALUES(damage_taken)
-        """,
-        (adventure_id, character_id, amount)
-    )
+    _accumulate(adventure_id, character_id, _TAKEN, amount)
 
 
 def record_kill(adventure_id: int, character_id: int, kills: int = 1):
     if kills <= 0:
         return
-    ensure_tables()
-    db.execute_query(
+    _accumulate(adventure_id, character_id, _KILLS, kills)
+
+
+def flush_metrics(adventure_id: int) -> bool:
+    """Записывает накопленные метрики боя одним пакетным upsert."""
+    with _pending_lock:
+        counters = _pending.pop(adventure_id, None)
+    if not counters:
+        return True
+
+    result = db.execute_many(
         """
-        INSERT INTO combat_metrics (adventure_id, character_id, kills)
-        VALUES (%s, %s, %s)
-        ON DUPLICATE KEY UPDATE kills = kills + VALUES(kills)
+        INSERT INTO combat_metrics (adventure_id, character_id, damage_dealt, damage_taken, kills)
+        VALUES (%s, %s, %s, %s, %s)
+        ON DUPLICATE KEY UPDATE
+            damage_dealt = damage_dealt + VALUES(damage_dealt),
+            damage_taken = damage_taken + VALUES(damage_taken),
+            kills = kills + VALUES(kills)
         """,
-        (adventure_id, character_id, kills)
+        [(adventure_id, character_id, dealt, taken, kills)
+         for character_id, (dealt, taken, kills) in counters.items()]
     )
+    if result is None:
+        # Не теряем метрики при сбое БД - вернем их в очередь до следующего сброса
+        with _pending_lock:
+            pending = _pending.setdefault(adventure_id, {})
+            for character_id, values in counters.items():
+                current = pending.setdefault(character_id, [0, 0, 0])
+                for field, value in enumerate(values):
+                    current[field] += value
+        logger.warning(f"COMBAT METRICS WARNING: flush failed for adventure {adventure_id}, will retry")
+        return False
+    return True
 
 
 def get_metrics_for_adventure(adventure_id: int) -> List[Dict]:
+    flush_metrics(adventure_id)
     return db.execute_query(
         "SELECT * FROM combat_metrics WHERE adventure_id = %s",
         (adventure_id,)
-    )
+    ) or []
 
 
 def award_end_combat_achievements(adventure_id: int, victory: Optional[str] = None):
     """Выдает достижения по итогам боя."""
-    ensure_tables()
     round_num = get_round(adventure_id)
 
     # Получаем участников и их метрики
@@ -136,14 +136,15 @@ def award_end_combat_achievements(adventure_id: int, victory: Optional[str] = No
         WHERE ap.adventure_id = %s
         """,
         (adventure_id,)
-    )
+    ) or []
     metrics_map = {(m['character_id']): m for m in metrics}
+    grants = []
 
     # Победа за 1 раунд
     if victory == 'players' and round_num == 1:
         for p in participants:
             if p['user_id']:
-                achievement_manager.grant_achievement(p['user_id'], 'speedrun', p['name'])
+                grants.append((p['user_id'], 'speedrun', p['name']))
 
     for p in participants:
         user_id = p['user_id']
@@ -154,15 +155,19 @@ def award_end_combat_achievements(adventure_id: int, victory: Optional[str] = No
 
         # Пацифист: завершить бой без нанесения урона
         if m.get('damage_dealt', 0) == 0 and victory == 'players':
-            achievement_manager.grant_achievement(user_id, 'pacifist', p['name'])
+            grants.append((user_id, 'pacifist', p['name']))
 
         # Выживший: завершить бой с 1 HP
         if p.get('current_hp', 0) == 1 and victory == 'players':
-            achievement_manager.grant_achievement(user_id, 'survivor', p['name'])
+            grants.append((user_id, 'survivor', p['name']))
 
         # Танк: 100+ полученного урона за одно приключение
         if m.get('damage_taken', 0) >= 100:
-            achievement_manager.grant_achievement(user_id, 'tank', p['name'])
+            grants.append((user_id, 'tank', p['name']))
+
+    # Все достижения боя выдаются одной транзакцией
+    if grants:
+        achievement_manager.grant_achievements(grants)
 
     # Очистка состояния боя (не метрик приключения, они накапливаются)
     db.execute_query("DELETE FROM combat_state WHERE adventure_id = %s", (adventure_id,))
@@ -0,0 +1,307 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Правила боя без Telegram и базы данных.
+
+Участники боя (Combatant), очередь ходов и HP (CombatState), инициатива,
+разрешение атак и спасбросков. Их используют бот (combat_state.py,
+combat_manager.py, callback_handler.py) и симулятор боев
+combat_simulator.py, поэтому модуль не импортирует ни telegram, ни database
+и не пишет в лог на горячем пути.
+"""
+
+import random
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
+
+from dice_utils import calculate_modifier, damage_distribution, format_rolls, roll_expression
+
+CHARACTER = 'character'
+ENEMY = 'enemy'
+
+DEFAULT_ENEMY_AC = 12  # как в атаках игроков, если КД врага не указан
+DEFAULT_ATTACK = ('Удар', '1d4', 0)
+
+PROFICIENCY_BONUS = 2  # упрощенно для 1-5 уровня
+PLAYER_WEAPON_DICE = '1d8'  # атака игрока: 1d8 + модификатор Силы
+ENEMY_FINISH_CHANCE = 0.5  # враг добивает цель, если выводит ее из строя с такой вероятностью
+
+ABILITIES = ('strength', 'dexterity', 'constitution', 'intelligence', 'wisdom', 'charisma')
+
+# Названия характеристик в спасбросках и классах -> поля characters/enemies
+SPELL_ABILITIES = {
+    'Сила': 'strength',
+    'Ловкость': 'dexterity',
+    'Телосложение': 'constitution',
+    'Интеллект': 'intelligence',
+    'Мудрость': 'wisdom',
+    'Харизма': 'charisma',
+}
+
+
+@dataclass
+class Combatant:
+    """Участник боя: персонаж или враг."""
+    kind: str  # CHARACTER или ENEMY
+    id: int
+    name: str
+    initiative: int
+    hp: int
+    max_hp: int
+    ac: int
+    dexterity: int = 10
+    user_id: Optional[int] = None
+    # (название, кости урона, бонус атаки) - только у врагов
+    attacks: List[Tuple[str, str, int]] = field(default_factory=list)
+    # Персонаж без сознания выбывает из очереди ходов
+    removed: bool = False
+    # Значения характеристик (strength...charisma), если известны
+    stats: Dict[str, int] = field(default_factory=dict)
+
+    @property
+    def active(self) -> bool:
+        return not self.removed and self.hp > 0
+
+    def modifier(self, ability: str) -> int:
+        return calculate_modifier(self.stats.get(ability) or 10)
+
+
+class CombatState:
+    """Бой одного приключения: очередь ходов, раунд и HP участников."""
+
+    def __init__(self, adventure_id: int, chat_id: Optional[int], combatants: List[Combatant], round_num: int = 1):
+        self.adventure_id = adventure_id
+        self.chat_id = chat_id
+        self.combatants = combatants  # в порядке инициативы; индекс - turn_index
+        self.round = round_num
+        self.finished = False
+        self._by_key = {(c.kind, c.id): c for c in combatants}
+        self._dirty: Dict[Tuple[str, int], int] = {}  # HP, еще не записанные в базу
+
+    def get(self, kind: str, participant_id: int) -> Optional[Combatant]:
+        return self._by_key.get((kind, participant_id))
+
+    def at(self, turn_index: int) -> Optional[Combatant]:
+        if 0 <= turn_index < len(self.combatants):
+            return self.combatants[turn_index]
+        return None
+
+    def alive(self, kind: str) -> List[Combatant]:
+        return [c for c in self.combatants if c.kind == kind and c.active]
+
+    def outcome(self) -> Optional[str]:
+        """'players' или 'enemies', если одна из сторон повержена, иначе None."""
+        if not self.alive(ENEMY):
+            return 'players'
+        if not self.alive(CHARACTER):
+            return 'enemies'
+        return None
+
+    def next_index(self, turn_index: int) -> Tuple[Optional[int], bool]:
+        """Следующий ход после turn_index: (индекс, начался ли новый раунд).
+
+        Выбывшие и поверженные участники пропускаются; индекс None - ходить некому.
+        """
+        count = len(self.combatants)
+        wrapped = False
+        for step in range(1, count + 1):
+            index = turn_index + step
+            if index >= count:
+                wrapped = True
+                index %= count
+            if self.combatants[index].active:
+                return index, wrapped
+        return None, wrapped
+
+    def set_hp(self, kind: str, participant_id: int, hp: int) -> Optional[Combatant]:
+        combatant = self.get(kind, participant_id)
+        if combatant is None:
+            return None
+        combatant.hp = max(0, hp)
+        self._dirty[(kind, participant_id)] = combatant.hp
+        return combatant
+
+    def damage(self, kind: str, participant_id: int, amount: int) -> Tuple[int, int]:
+        """Наносит урон; возвращает (HP до, HP после)."""
+        combatant = self.get(kind, participant_id)
+        if combatant is None:
+            return 0, 0
+        old_hp = combatant.hp
+        self.set_hp(kind, participant_id, old_hp - max(0, amount))
+        return old_hp, combatant.hp
+
+    def take_dirty(self) -> Dict[Tuple[str, int], int]:
+        dirty, self._dirty = self._dirty, {}
+        return dirty
+
+    def restore_dirty(self, dirty: Dict[Tuple[str, int], int]):
+        # Более свежие значения, записанные за время сбоя, важнее
+        for key, hp in dirty.items():
+            self._dirty.setdefault(key, hp)
+
+
+def character_combatant(character: Dict, initiative: int, removed: bool = False) -> Combatant:
+    """Участник боя из строки characters (id, name, current_hp, max_hp, armor_class, dexterity, user_id)."""
+    dexterity = character.get('dexterity') or 10
+    ac = character.get('armor_class')
+    if ac is None:
+        ac = 10 + (dexterity - 10) // 2
+    hp = character.get('current_hp') or 0
+    return Combatant(
+        kind=CHARACTER, id=character['id'], name=character['name'], initiative=initiative,
+        hp=hp, max_hp=character.get('max_hp') or hp, ac=ac, dexterity=dexterity,
+        user_id=character.get('user_id'), removed=removed,
+        stats={ability: character[ability] for ability in ABILITIES if character.get(ability) is not None},
+    )
+
+
+def enemy_combatant(enemy: Dict, initiative: int) -> Combatant:
+    """Участник боя из врага, разобранного response_parser и сохраненного grok.save_enemies."""
+    attacks = []
+    for attack_name, attack_damage, attack_bonus in enemy.get('attacks') or []:
+        # Как в save_enemies: кости урона - первое слово ("1d8+2 slashing")
+        damage_parts = (attack_damage or "").split()
+        attacks.append((attack_name, damage_parts[0] if damage_parts else '1d4', int(attack_bonus or 0)))
+    if not attacks and enemy.get('attack_damage'):
+        attacks.append((enemy.get('attack_name') or DEFAULT_ATTACK[0], enemy['attack_damage'],
+                        int(enemy.get('attack_bonus') or 0)))
+    return Combatant(
+        kind=ENEMY, id=enemy['id'], name=enemy['name'], initiative=initiative,
+        hp=enemy['hit_points'], max_hp=enemy.get('max_hit_points') or enemy['hit_points'],
+        ac=enemy.get('armor_class') or DEFAULT_ENEMY_AC, dexterity=enemy.get('dexterity') or 10,
+        attacks=attacks or [DEFAULT_ATTACK],
+        stats={ability: enemy[ability] for ability in ABILITIES if enemy.get(ability) is not None},
+    )
+
+
+# --- Броски ------------------------------------------------------------------
+
+def roll_initiative(dexterity: int) -> int:
+    """d20 + модификатор Ловкости."""
+    return random.randint(1, 20) + calculate_modifier(dexterity or 10)
+
+
+@dataclass
+class AttackResult:
+    """Итог броска атаки и урона."""
+    natural: int  # выпавшее на d20
+    bonus: int
+    critical: bool
+    fumble: bool
+    hit: bool
+    damage: int = 0
+    rolls: List[int] = field(default_factory=list)
+    modifier: int = 0
+
+    @property
+    def total(self) -> int:
+        return self.natural + self.bonus
+
+    @property
+    def roll_text(self) -> str:
+        """Бросок атаки в формате dice_utils.roll_d20."""
+        if self.bonus > 0:
+            return f"{self.natural}+{self.bonus} = {self.total}"
+        if self.bonus < 0:
+            return f"{self.natural}{self.bonus} = {self.total}"
+        return f"{self.natural}"
+
+    @property
+    def damage_text(self) -> str:
+        return format_rolls(self.rolls, self.modifier, self.damage)
+
+
+def roll_damage(damage_dice: str, critical: bool = False, bonus: int = 0) -> Tuple[int, List[int], int]:
+    """Урон (итог, кубики, модификатор); при критическом попадании кубики удваиваются, модификатор - нет."""
+    result = roll_expression(damage_dice, critical)
+    modifier = result.modifier + bonus
+    return max(0, result.total + bonus), result.rolls, modifier
+
+
+def resolve_attack(attack_bonus: int, target_ac: int, damage_dice: str, damage_bonus: int = 0) -> AttackResult:
+    """Бросок атаки против КД: натуральная 20 - критическое попадание, 1 - промах."""
+    natural = random.randint(1, 20)
+    critical = natural == 20
+    fumble = natural == 1
+    hit = critical or (not fumble and natural + attack_bonus >= target_ac)
+    result = AttackResult(natural, attack_bonus, critical, fumble, hit)
+    if hit:
+        result.damage, result.rolls, result.modifier = roll_damage(damage_dice, critical, damage_bonus)
+    return result
+
+
+def hit_chance(attack_bonus: int, target_ac: int) -> Tuple[float, float]:
+    """Вероятности (обычного попадания, критического): 1 - всегда промах, 20 - всегда крит."""
+    # Натуральные 2-19, которым хватает бонуса до КД
+    normal = min(18, max(0, 20 - max(2, target_ac - attack_bonus)))
+    return normal / 20, 1 / 20
+
+
+@lru_cache(maxsize=4096)
+def knockout_chance(attack_bonus: int, target_ac: int, damage_dice: str, hp: int) -> float:
+    """Точная вероятность, что одна атака снимет с цели все hp (без бросков, по распределению урона)."""
+    distribution = damage_distribution(damage_dice)
+    if distribution is None:
+        return 0.0
+    normal, critical = hit_chance(attack_bonus, target_ac)
+    chance = normal * distribution.chance_at_least(hp)
+    critical_distribution = damage_distribution(damage_dice, True)
+    if critical_distribution is not None:
+        chance += critical * critical_distribution.chance_at_least(hp)
+    return chance
+
+
+def choose_enemy_attack(enemy: Combatant, state: CombatState) -> Optional[Tuple[Combatant, Tuple[str, str, int]]]:
+    """Ход врага: цель и атака.
+
+    Если какую-то цель можно вывести из строя с вероятностью ENEMY_FINISH_CHANCE
+    и выше, враг добивает ее самой надежной атакой; иначе - случайная живая
+    цель и случайная атака из списка.
+    """
+    targets = state.alive(CHARACTER)
+    if not targets:
+        return None
+    attacks = enemy.attacks or [DEFAULT_ATTACK]
+    best, best_chance = None, ENEMY_FINISH_CHANCE
+    for target in targets:
+        for attack in attacks:
+            chance = knockout_chance(attack[2], target.ac, attack[1], target.hp)
+            if chance >= best_chance:
+                best, best_chance = (target, attack), chance
+    if best is not None:
+        return best
+    return random.choice(targets), random.choice(attacks)
+
+
+def player_attack(strength: int, target_ac: int) -> AttackResult:
+    """Атака игрока оружием: d20 + Сила + мастерство, урон 1d8 + Сила."""
+    strength_mod = calculate_modifier(strength or 10)
+    return resolve_attack(strength_mod + PROFICIENCY_BONUS, target_ac, PLAYER_WEAPON_DICE, strength_mod)
+
+
+def spellcasting_modifier(spellcasting_ability: Optional[str], stats: Dict) -> int:
+    """Модификатор заклинательной характеристики класса ("Интеллект", ...); не заклинатель - 0."""
+    ability = SPELL_ABILITIES.get(spellcasting_ability or '')
+    return calculate_modifier(stats.get(ability) or 10) if ability else 0
+
+
+def spell_attack(spell_modifier: int, target_ac: int, damage_dice: str) -> AttackResult:
+    """Атака заклинанием: d20 + модификатор заклинательной характеристики + мастерство."""
+    return resolve_attack(spell_modifier + PROFICIENCY_BONUS, target_ac, damage_dice)
+
+
+def spell_save_dc(spell_modifier: int) -> int:
+    """8 + мастерство + модификатор заклинательной характеристики."""
+    return 8 + PROFICIENCY_BONUS + spell_modifier
+
+
+def saving_throw(modifier: int, dc: int) -> Tuple[bool, int]:
+    """Спасбросок (успех, выпавшее на d20): натуральная 20 - всегда успех, 1 - всегда провал."""
+    natural = random.randint(1, 20)
+    if natural == 20:
+        return True, natural
+    if natural == 1:
+        return False, natural
+    return natural + modifier >= dc, natural
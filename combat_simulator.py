@@ -0,0 +1,359 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Безголовый симулятор боев по правилам бота (combat_rules.py), без Telegram и MySQL.
+
+Отряд - словари в форме строк characters (id, name, current_hp, max_hp,
+armor_class, strength...charisma), по желанию со списком боевых заклинаний
+spells (name, level, damage, saving_throw, is_area_of_effect), заклинательной
+характеристикой spellcasting_ability ("Интеллект", ...) и ячейками
+spell_slots {уровень: количество}. Враги - словари в том виде, в каком их
+отдают response_parser.parse_response(...).enemies и grok.parse_enemies.
+
+run_fight() проводит один бой, simulate() - тысячи боев в пуле процессов и
+сводит доли побед, число раундов и распределения урона. Так можно проверить
+сгенерированную Grok встречу до начала боя и измерить горячий путь боя.
+
+Тактика отряда: заклинание по площади, если живы два врага и больше, иначе
+самый сильный в среднем вариант (оружие или заклинание) по самому раненому
+врагу. Враги ходят так же, как в combat_manager.enemy_action.
+
+Запуск: python combat_simulator.py [--party party.json] [--enemies enemies.json | --response ответ.txt]
+        [--fights N] [--workers N] [--seed S]
+Без аргументов - демонстрационный бой как бенчмарк.
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from typing import Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+from combat_rules import (CHARACTER, ENEMY, PLAYER_WEAPON_DICE, SPELL_ABILITIES, CombatState, Combatant,
+                          character_combatant, enemy_combatant, roll_initiative, choose_enemy_attack,
+                          resolve_attack, roll_damage, player_attack, spellcasting_modifier, spell_attack,
+                          spell_save_dc, saving_throw)
+from dice_utils import compile_dice, seed_dice
+
+MAX_ROUNDS = 50  # бой дольше считается ничьей
+CHUNKS_PER_WORKER = 4
+
+# Демонстрационная встреча: отряд 3 уровня против банды из ответа Grok
+DEMO_PARTY = [
+    {'id': 1, 'name': 'Воин', 'current_hp': 28, 'max_hp': 28, 'armor_class': 18,
+     'strength': 16, 'dexterity': 12, 'constitution': 15, 'intelligence': 10, 'wisdom': 12, 'charisma': 8},
+    {'id': 2, 'name': 'Волшебник', 'current_hp': 17, 'max_hp': 17, 'armor_class': 12,
+     'strength': 8, 'dexterity': 14, 'constitution': 13, 'intelligence': 16, 'wisdom': 12, 'charisma': 10,
+     'spellcasting_ability': 'Интеллект', 'spell_slots': {1: 4, 2: 2},
+     'spells': [
+         {'name': 'Огненный снаряд', 'level': 0, 'damage': '1d10', 'saving_throw': None, 'is_area_of_effect': False},
+         {'name': 'Волшебная стрела', 'level': 1, 'damage': '3d4+3', 'saving_throw': 'Ловкость',
+          'is_area_of_effect': False},
+         {'name': 'Громовая волна', 'level': 1, 'damage': '2d8', 'saving_throw': 'Телосложение',
+          'is_area_of_effect': True},
+     ]},
+    {'id': 3, 'name': 'Жрец', 'current_hp': 24, 'max_hp': 24, 'armor_class': 16,
+     'strength': 14, 'dexterity': 10, 'constitution': 14, 'intelligence': 10, 'wisdom': 16, 'charisma': 12,
+     'spellcasting_ability': 'Мудрость', 'spell_slots': {1: 4, 2: 2},
+     'spells': [
+         {'name': 'Священное пламя', 'level': 0, 'damage': '1d8', 'saving_throw': 'Ловкость',
+          'is_area_of_effect': False},
+     ]},
+]
+
+DEMO_ENEMIES = [
+    {'name': f'Разбойник {i}', 'hit_points': 11, 'max_hit_points': 11, 'armor_class': 13, 'experience_reward': 25,
+     'attacks': [('Скимитар', '1d6+1 slashing', 3), ('Легкий арбалет', '1d8+1 piercing', 3)],
+     'strength': 12, 'dexterity': 12, 'constitution': 12, 'intelligence': 10, 'wisdom': 10, 'charisma': 10}
+    for i in range(1, 4)
+] + [
+    {'name': 'Главарь', 'hit_points': 32, 'max_hit_points': 32, 'armor_class': 15, 'experience_reward': 200,
+     'attacks': [('Ржавый меч', '1d8+2 slashing', 4), ('Грязная драка', '1d4+2 bludgeoning', 4)],
+     'strength': 15, 'dexterity': 12, 'constitution': 14, 'intelligence': 10, 'wisdom': 11, 'charisma': 8},
+]
+
+
+def average_damage(damage_dice: str) -> float:
+    """Средний урон выражения вида "2d6+3"."""
+    expression = compile_dice(damage_dice)
+    return expression.mean if expression else 0.0
+
+
+@dataclass
+class Caster:
+    """Боевые заклинания персонажа и оставшиеся ячейки в одном бою."""
+    modifier: int
+    spells: List[Dict]
+    slots: Dict[int, int]
+
+    def usable(self) -> List[Dict]:
+        return [s for s in self.spells if s['level'] == 0 or self.slots.get(s['level'], 0) > 0]
+
+    def spend(self, spell: Dict):
+        if spell['level'] > 0:
+            self.slots[spell['level']] -= 1
+
+
+class FightResult(NamedTuple):
+    """Итог одного боя."""
+    winner: str  # 'players', 'enemies' или 'draw'
+    rounds: int
+    damage_dealt: int  # урон отряда по врагам
+    damage_taken: int  # урон врагов по отряду
+    deaths: Tuple[int, ...]  # id павших персонажей
+
+
+def _prepare(party: Sequence[Dict], enemies: Sequence[Dict]) -> Tuple[List[Dict], List[Dict]]:
+    """Копии с id, если их нет, и только боевые заклинания с уроном."""
+    prepared_party = []
+    for index, character in enumerate(party, 1):
+        character = dict(character)
+        character.setdefault('id', index)
+        spells = []
+        for spell in character.get('spells') or []:
+            if spell.get('damage') and average_damage(spell['damage']) > 0:
+                spells.append({
+                    'name': spell.get('name', '?'),
+                    'level': int(spell.get('level') or 0),
+                    'damage': spell['damage'],
+                    'saving_throw': spell.get('saving_throw') or None,
+                    'is_area_of_effect': bool(spell.get('is_area_of_effect')),
+                    'average': average_damage(spell['damage']),
+                })
+        character['spells'] = spells
+        character['spell_slots'] = {int(level): int(count)
+                                    for level, count in (character.get('spell_slots') or {}).items()}
+        prepared_party.append(character)
+    prepared_enemies = []
+    for index, enemy in enumerate(enemies, 1):
+        enemy = dict(enemy)
+        if not enemy.get('id'):
+            enemy['id'] = index
+        prepared_enemies.append(enemy)
+    return prepared_party, prepared_enemies
+
+
+def _cast(state: CombatState, caster: Caster, spell: Dict, target: Combatant) -> int:
+    """Заклинание по правилам spell_combat; возвращает нанесенный урон."""
+    caster.spend(spell)
+    if spell['is_area_of_effect']:
+        # Один бросок урона на всех; успешный спасбросок - половина
+        damage = roll_damage(spell['damage'])[0]
+        dc = spell_save_dc(caster.modifier)
+        save_ability = SPELL_ABILITIES.get(spell['saving_throw'] or '')
+        dealt = 0
+        for enemy in state.alive(ENEMY):
+            amount = damage
+            if save_ability and saving_throw(enemy.modifier(save_ability), dc)[0]:
+                amount //= 2
+            old_hp, new_hp = state.damage(ENEMY, enemy.id, amount)
+            dealt += old_hp - new_hp
+        return dealt
+    if spell['saving_throw']:
+        # Одиночное заклинание со спасброском в боте попадает всегда
+        amount = roll_damage(spell['damage'])[0]
+    else:
+        amount = spell_attack(caster.modifier, target.ac, spell['damage']).damage
+    old_hp, new_hp = state.damage(ENEMY, target.id, amount)
+    return old_hp - new_hp
+
+
+def _character_turn(state: CombatState, character: Combatant, caster: Optional[Caster]) -> int:
+    """Ход персонажа по тактике отряда; возвращает нанесенный урон."""
+    enemies = state.alive(ENEMY)
+    target = min(enemies, key=lambda enemy: enemy.hp)
+    if caster is not None:
+        spells = caster.usable()
+        if len(enemies) > 1:
+            area = [s for s in spells if s['is_area_of_effect']]
+            if area:
+                return _cast(state, caster, max(area, key=lambda s: s['average']), target)
+        single = [s for s in spells if not s['is_area_of_effect']]
+        if single:
+            spell = max(single, key=lambda s: s['average'])
+            weapon = average_damage(PLAYER_WEAPON_DICE) + character.modifier('strength')
+            if spell['average'] > weapon:
+                return _cast(state, caster, spell, target)
+    attack = player_attack(character.stats.get('strength', 10), target.ac)
+    if not attack.hit:
+        return 0
+    old_hp, new_hp = state.damage(ENEMY, target.id, attack.damage)
+    return old_hp - new_hp
+
+
+def run_fight(party: Sequence[Dict], enemies: Sequence[Dict], max_rounds: int = MAX_ROUNDS,
+              prepared: bool = False) -> FightResult:
+    """Один бой от броска инициативы до поражения одной из сторон или max_rounds."""
+    if not prepared:
+        party, enemies = _prepare(party, enemies)
+    combatants = [character_combatant(c, roll_initiative(c.get('dexterity'))) for c in party]
+    combatants += [enemy_combatant(e, roll_initiative(e.get('dexterity'))) for e in enemies]
+    combatants.sort(key=lambda c: c.initiative, reverse=True)
+    state = CombatState(0, None, combatants)
+    casters = {c['id']: Caster(spellcasting_modifier(c.get('spellcasting_ability'), c), c['spells'],
+                               dict(c['spell_slots']))
+               for c in party if c['spells']}
+
+    dealt = taken = 0
+    turn: Optional[int] = 0 if combatants[0].active else state.next_index(0)[0]
+    winner = state.outcome()
+    while winner is None and turn is not None:
+        combatant = combatants[turn]
+        if combatant.kind == CHARACTER:
+            dealt += _character_turn(state, combatant, casters.get(combatant.id))
+        else:
+            choice = choose_enemy_attack(combatant, state)
+            if choice is not None:
+                target, (_, damage_dice, attack_bonus) = choice
+                attack = resolve_attack(attack_bonus, target.ac, damage_dice)
+                if attack.hit:
+                    old_hp, new_hp = state.damage(CHARACTER, target.id, attack.damage)
+                    taken += old_hp - new_hp
+        winner = state.outcome()
+        if winner is not None:
+            break
+        turn, new_round = state.next_index(turn)
+        if new_round:
+            state.round += 1
+            if state.round > max_rounds:
+                winner = 'draw'
+    deaths = tuple(c.id for c in combatants if c.kind == CHARACTER and c.hp <= 0)
+    return FightResult(winner or 'draw', min(state.round, max_rounds), dealt, taken, deaths)
+
+
+def _run_chunk(party: List[Dict], enemies: List[Dict], fights: int, seed: Optional[int],
+               max_rounds: int) -> List[FightResult]:
+    if seed is not None:
+        seed_dice(seed)
+    return [run_fight(party, enemies, max_rounds, prepared=True) for _ in range(fights)]
+
+
+def _percentile(values: List[float], share: float) -> float:
+    """Перцентиль отсортированного списка."""
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(len(values) * share))]
+
+
+def _distribution(values: List[float]) -> Dict[str, float]:
+    values = sorted(values)
+    return {
+        'mean': round(sum(values) / len(values), 2) if values else 0.0,
+        'p5': _percentile(values, 0.05),
+        'p50': _percentile(values, 0.5),
+        'p95': _percentile(values, 0.95),
+        'max': values[-1] if values else 0,
+    }
+
+
+@dataclass
+class SimulationReport:
+    """Сводка серии боев."""
+    fights: int
+    win_rate: float
+    loss_rate: float
+    draw_rate: float
+    rounds: Dict[str, float]  # до победы отряда
+    damage_dealt: Dict[str, float]
+    damage_taken: Dict[str, float]
+    death_rates: Dict[str, float]  # имя персонажа -> доля боев, где он пал
+    elapsed: float
+    workers: int
+    fights_per_second: float = field(init=False)
+
+    def __post_init__(self):
+        self.fights_per_second = round(self.fights / self.elapsed) if self.elapsed > 0 else 0.0
+
+    def summary(self) -> str:
+        deaths = ", ".join(f"{name} {rate:.0%}" for name, rate in self.death_rates.items())
+        return (f"{self.fights} fights in {self.elapsed:.2f}s ({self.fights_per_second:.0f}/s, "
+                f"{self.workers} workers)\n"
+                f"party wins {self.win_rate:.1%}, loses {self.loss_rate:.1%}, draws {self.draw_rate:.1%}\n"
+                f"rounds to win: mean {self.rounds['mean']}, p50 {self.rounds['p50']}, p95 {self.rounds['p95']}\n"
+                f"damage dealt: mean {self.damage_dealt['mean']}, p5 {self.damage_dealt['p5']}, "
+                f"p50 {self.damage_dealt['p50']}, p95 {self.damage_dealt['p95']}\n"
+                f"damage taken: mean {self.damage_taken['mean']}, p5 {self.damage_taken['p5']}, "
+                f"p50 {self.damage_taken['p50']}, p95 {self.damage_taken['p95']}\n"
+                f"deaths: {deaths}")
+
+
+def simulate(party: Sequence[Dict], enemies: Sequence[Dict], fights: int = 1000, workers: Optional[int] = None,
+             seed: Optional[int] = None, max_rounds: int = MAX_ROUNDS) -> SimulationReport:
+    """Серия боев; workers > 1 - параллельно в пуле процессов, seed - воспроизводимый результат."""
+    if fights < 1:
+        raise ValueError("fights must be at least 1")
+    party, enemies = _prepare(party, enemies)
+    if not party or not enemies:
+        raise ValueError("both the party and the enemies must be non-empty")
+    workers = max(1, min(workers or os.cpu_count() or 1, fights))
+    started = time.perf_counter()
+    if workers == 1:
+        results = _run_chunk(party, enemies, fights, seed, max_rounds)
+    else:
+        chunks = min(fights, workers * CHUNKS_PER_WORKER)
+        sizes = [fights // chunks + (1 if i < fights % chunks else 0) for i in range(chunks)]
+        results = []
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(_run_chunk, party, enemies, size, None if seed is None else seed + i, max_rounds)
+                       for i, size in enumerate(sizes)]
+            for future in futures:
+                results.extend(future.result())
+    elapsed = time.perf_counter() - started
+
+    outcomes = {'players': 0, 'enemies': 0, 'draw': 0}
+    deaths = {c['id']: 0 for c in party}
+    for result in results:
+        outcomes[result.winner] += 1
+        for character_id in result.deaths:
+            deaths[character_id] += 1
+    return SimulationReport(
+        fights=fights,
+        win_rate=outcomes['players'] / fights,
+        loss_rate=outcomes['enemies'] / fights,
+        draw_rate=outcomes['draw'] / fights,
+        rounds=_distribution([r.rounds for r in results if r.winner == 'players']),
+        damage_dealt=_distribution([r.damage_dealt for r in results]),
+        damage_taken=_distribution([r.damage_taken for r in results]),
+        death_rates={c['name']: deaths[c['id']] / fights for c in party},
+        elapsed=elapsed,
+        workers=workers,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Headless combat simulator")
+    parser.add_argument('--party', help="JSON file with a list of characters")
+    parser.add_argument('--enemies', help="JSON file with a list of enemies")
+    parser.add_argument('--response', help="Grok response text with a ***COMBAT_START*** block")
+    parser.add_argument('--fights', type=int, default=10000)
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--max-rounds', type=int, default=MAX_ROUNDS)
+    args = parser.parse_args()
+
+    party = DEMO_PARTY
+    enemies = DEMO_ENEMIES
+    if args.party:
+        with open(args.party, encoding='utf-8') as f:
+            party = json.load(f)
+    if args.enemies:
+        with open(args.enemies, encoding='utf-8') as f:
+            enemies = json.load(f)
+    elif args.response:
+        from response_parser import parse_response
+        with open(args.response, encoding='utf-8') as f:
+            enemies = parse_response(f.read()).enemies
+        if not enemies:
+            sys.exit(f"{args.response}: no enemies found")
+
+    print(f"{len(party)} characters vs {len(enemies)} enemies: "
+          f"{', '.join(e['name'] for e in enemies)}")
+    print(simulate(party, enemies, args.fights, args.workers, args.seed, args.max_rounds).summary())
+
+
+if __name__ == "__main__":
+    main()
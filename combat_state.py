@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Состояние идущего боя в памяти.
+
+CombatState (combat_rules.py) - порядок инициативы, HP, КД и атаки всех участников боя одного
+приключения. Оно собирается один раз в start_combat (один запрос персонажей,
+враги приходят уже разобранными из ответа Grok) и дальше считается
+авторитетным: ходы, атаки и заклинания меняют HP в памяти, а в characters и
+enemies изменения попадают пачкой (write-behind) в конце каждого раунда, при
+падении персонажа и в конце боя. Поэтому ход врага или игрока не читает
+базу, а раунд стоит O(1) запросов вместо O(участников × 4).
+
+Если бот перезапустился посреди боя, состояние лениво восстанавливается из
+combat_participants при первом обращении; HP, измененные после последней
+записи, при аварийной остановке теряются (не больше одного раунда).
+"""
+
+import logging
+from typing import Dict, List, Optional, Tuple
+
+from combat_rules import (CHARACTER, ENEMY, ABILITIES, DEFAULT_ENEMY_AC, DEFAULT_ATTACK, Combatant, CombatState,
+                          character_combatant)
+from database import get_db
+
+logger = logging.getLogger(__name__)
+
+
+class CombatStates:
+    """Бои всех приключений в памяти с отложенной записью HP."""
+
+    def __init__(self):
+        self.db = get_db()
+        self._states: Dict[int, CombatState] = {}
+        self.loads = 0
+        self.flushes = 0
+
+    # --- Создание и восстановление ----------------------------------------
+
+    def start(self, adventure_id: int, chat_id: Optional[int], combatants: List[Combatant]) -> CombatState:
+        state = CombatState(adventure_id, chat_id, combatants)
+        self._states[adventure_id] = state
+        return state
+
+    async def get(self, adventure_id: int) -> Optional[CombatState]:
+        """Состояние боя; после перезапуска бота собирается из базы. None - боя нет."""
+        state = self._states.get(adventure_id)
+        if state is not None:
+            return state
+        try:
+            state = await self.db.run(self._load, adventure_id)
+        except Exception as e:
+            logger.error(f"COMBAT STATE: failed to load combat for adventure {adventure_id}: {e}")
+            return None
+        if state is None:
+            return None
+        # Пока читали, другая корутина могла уже загрузить бой
+        return self._states.setdefault(adventure_id, state)
+
+    def peek(self, adventure_id: int) -> Optional[CombatState]:
+        """Состояние боя, только если оно уже в памяти."""
+        return self._states.get(adventure_id)
+
+    def _load(self, adventure_id: int) -> Optional[CombatState]:
+        rows = self.db.execute_query("""
+            SELECT cp.participant_type, cp.participant_id, cp.initiative,
+                   c.name AS character_name, c.current_hp, c.max_hp, c.armor_class AS character_ac,
+                   c.dexterity AS character_dexterity, c.user_id, c.is_active,
+                   e.name AS enemy_name, e.hit_points, e.max_hit_points, e.armor_class AS enemy_ac,
+                   e.strength AS enemy_strength, e.dexterity AS enemy_dexterity,
+                   e.constitution AS enemy_constitution, e.intelligence AS enemy_intelligence,
+                   e.wisdom AS enemy_wisdom, e.charisma AS enemy_charisma
+            FROM combat_participants cp
+            LEFT JOIN characters c ON cp.participant_id = c.id AND cp.participant_type = 'character'
+            LEFT JOIN enemies e ON cp.participant_id = e.id AND cp.participant_type = 'enemy'
+            WHERE cp.adventure_id = %s
+            ORDER BY cp.turn_order
+        """, (adventure_id,))
+        if not rows:
+            return None
+
+        enemy_ids = [row['participant_id'] for row in rows if row['participant_type'] == ENEMY]
+        attacks: Dict[int, List[Tuple[str, str, int]]] = {}
+        if enemy_ids:
+            placeholders = ", ".join(["%s"] * len(enemy_ids))
+            for attack in self.db.execute_query(
+                f"SELECT enemy_id, name, damage, attack_bonus FROM enemy_attacks WHERE enemy_id IN ({placeholders})",
+                tuple(enemy_ids)
+            ) or []:
+                attacks.setdefault(attack['enemy_id'], []).append(
+                    (attack['name'], attack['damage'], int(attack['attack_bonus'] or 0)))
+
+        combatants = []
+        for row in rows:
+            if row['participant_type'] == CHARACTER:
+                if row['character_name'] is None:
+                    # Персонаж удален - держим место, чтобы индексы ходов совпадали с turn_order
+                    combatants.append(Combatant(CHARACTER, row['participant_id'], "?", row['initiative'], 0, 0, 10,
+                                                removed=True))
+                    continue
+                combatants.append(character_combatant({
+                    'id': row['participant_id'], 'name': row['character_name'],
+                    'current_hp': row['current_hp'], 'max_hp': row['max_hp'],
+                    'armor_class': row['character_ac'], 'dexterity': row['character_dexterity'],
+                    'user_id': row['user_id'],
+                }, row['initiative'], removed=not row['is_active']))
+            else:
+                if row['enemy_name'] is None:
+                    combatants.append(Combatant(ENEMY, row['participant_id'], "?", row['initiative'], 0, 0,
+                                                DEFAULT_ENEMY_AC, removed=True))
+                    continue
+                combatants.append(Combatant(
+                    kind=ENEMY, id=row['participant_id'], name=row['enemy_name'], initiative=row['initiative'],
+                    hp=row['hit_points'] or 0, max_hp=row['max_hit_points'] or row['hit_points'] or 0,
+                    ac=row['enemy_ac'] or DEFAULT_ENEMY_AC, dexterity=row['enemy_dexterity'] or 10,
+                    attacks=attacks.get(row['participant_id']) or [DEFAULT_ATTACK],
+                    stats={ability: row[f'enemy_{ability}'] for ability in ABILITIES
+                           if row[f'enemy_{ability}'] is not None},
+                ))
+
+        adventure = self.db.execute_query("SELECT chat_id FROM adventures WHERE id = %s", (adventure_id,))
+        round_row = self.db.execute_query("SELECT round FROM combat_state WHERE adventure_id = %s", (adventure_id,))
+        self.loads += 1
+        logger.info(f"COMBAT STATE: restored combat for adventure {adventure_id} from the database "
+                    f"({len(combatants)} combatants)")
+        return CombatState(adventure_id, adventure[0]['chat_id'] if adventure else None, combatants,
+                           round_row[0]['round'] if round_row else 1)
+
+    # --- Запись ------------------------------------------------------------
+
+    def _write(self, dirty: Dict[Tuple[str, int], int]):
+        characters = [(hp, pid) for (kind, pid), hp in dirty.items() if kind == CHARACTER]
+        enemies = [(hp, pid) for (kind, pid), hp in dirty.items() if kind == ENEMY]
+        with self.db.transaction():
+            if characters:
+                self.db.execute_many("UPDATE characters SET current_hp = %s WHERE id = %s", characters)
+            if enemies:
+                self.db.execute_many("UPDATE enemies SET hit_points = %s WHERE id = %s", enemies)
+
+    async def flush(self, adventure_id: int) -> bool:
+        """Записывает накопленные изменения HP боя одной транзакцией."""
+        state = self._states.get(adventure_id)
+        if state is None:
+            return True
+        dirty = state.take_dirty()
+        if not dirty:
+            return True
+        try:
+            await self.db.run(self._write, dirty)
+        except Exception as e:
+            # Не теряем изменения - попробуем при следующей записи
+            state.restore_dirty(dirty)
+            logger.warning(f"COMBAT STATE WARNING: flush failed for adventure {adventure_id}, will retry: {e}")
+            return False
+        self.flushes += 1
+        return True
+
+    async def end(self, adventure_id: int):
+        """Конец боя: дописывает HP и забывает состояние."""
+        state = self._states.get(adventure_id)
+        if state is None:
+            return
+        state.finished = True
+        await self.flush(adventure_id)
+        self._states.pop(adventure_id, None)
+
+    def discard(self, adventure_id: int):
+        """Забывает бой без записи (приключение завершено)."""
+        state = self._states.pop(adventure_id, None)
+        if state is not None:
+            state.finished = True
+
+    async def close(self):
+        """Дописывает HP всех идущих боев (при остановке бота)."""
+        for adventure_id in list(self._states):
+            await self.flush(adventure_id)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            'active_combats': len(self._states),
+            'restored_from_db': self.loads,
+            'flushes': self.flushes,
+        }
+
+
+# Глобальный экземпляр состояния боев
+combat_states = CombatStates()
@@ -9,6 +9,31 @@ ALLOWED_CHAT_ID =   # Chat ID where bot should work
 GROK_API_TOKEN = ""
 GROK_API_URL = "https://api.x.ai/v1/chat/completions"
 GROK_MODEL = "grok-beta"
+GROK_MAX_CONNECTIONS = 10   # simultaneous HTTP connections to the Grok API
+GROK_KEEPALIVE_EXPIRY = 120 # seconds an idle connection is kept open
+GROK_HTTP2 = True           # use HTTP/2 when the h2 package is installed
+GROK_STREAMING = True       # show narration in Telegram while it is being generated
+GROK_PREVIEW_INTERVAL = 0.5 # seconds between re-parses of the streamed text for the preview
+GROK_COMBAT_FORMAT = "text" # enemy stat blocks: "text" (ENEMY: lines) or "json" (schema-checked, text fallback)
+GROK_MAX_CONCURRENT_REQUESTS = 4  # Grok requests in flight at once across all chats
+GROK_RATE_LIMIT = 2.0             # requests per second to the Grok API (0 = unlimited)
+GROK_RATE_BURST = 4               # requests allowed back to back before the rate limit applies
+GROK_MAX_RETRIES = 3              # retries for 5xx, 429, timeouts and dropped connections
+GROK_RETRY_BASE_DELAY = 1.0       # seconds; jittered exponential backoff between retries
+GROK_RETRY_MAX_DELAY = 20.0
+GROK_REQUEST_DEADLINE = 240.0     # seconds per request including queueing and all retries
+GROK_CONNECT_TIMEOUT = 10.0
+GROK_BREAKER_THRESHOLD = 5        # consecutive failures before the circuit breaker opens
+GROK_BREAKER_RESET_SECONDS = 60.0 # how long to fail fast before probing the provider again
+GROK_TRAFFIC_MODE = "off"         # "record" Grok responses to the archive or "replay" them offline
+GROK_TRAFFIC_ARCHIVE = "llm_traffic.jsonl"  # use a .zst suffix for a zstd-compressed archive (needs zstandard)
+GROK_REPLAY_LATENCY_SCALE = 1.0   # replay delay = recorded latency x this (0 = instant)
+GROK_REPLAY_ON_MISS = "fail"      # "fail" or "live" (ask the real API) when a request was not recorded
+STREAM_EDIT_INTERVAL = 1.5  # seconds between edits of a streamed message
+HISTORY_TOKEN_BUDGET = 12000  # max tokens of chat history sent with one request
+HISTORY_KEEP_EXCHANGES = 6    # latest player/narrator exchanges always sent verbatim
+HISTORY_CACHE_SIZE = 64       # adventures whose chat history is kept in memory
+HISTORY_FLUSH_INTERVAL = 5    # seconds between batched writes of new messages to chat_history
 
 # Database Configuration
 DB_HOST = ""
@@ -16,9 +41,13 @@ DB_PORT = 3306
 DB_USER = ""
 DB_PASSWORD = ""
 DB_NAME = ""
+DB_POOL_SIZE = 10     # max simultaneous MySQL connections (1-32)
+DB_POOL_TIMEOUT = 10  # seconds to wait for a free connection before failing
+DB_STREAM_BATCH_SIZE = 500  # rows fetched per round trip by db.stream()
 
 # Game Configuration
 ACTION_TIMEOUT = 30  # seconds for player action in combat
+COMBAT_PREVIEW_FIGHTS = 0  # simulated fights logged as a win-rate forecast when combat starts (0 = off)
 DICE_SIDES = 20
 STAT_DICE_COUNT = 4
 STAT_DICE_SIDES = 6
@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Контекст разговора с Grok в пределах бюджета токенов.
+
+В запрос попадают системный промпт, сжатое содержание старых ходов
+(adventure_summaries) и последние HISTORY_KEEP_EXCHANGES обменов дословно.
+Ходы старше окна, еще не вошедшие в содержание, отправляются дословно, пока
+помещаются в бюджет; когда их набирается больше HISTORY_SUMMARY_TRIGGER_TOKENS,
+содержание пересчитывается в фоне одним запросом к модели. Поэтому размер
+запроса не растет с длиной приключения.
+"""
+
+import asyncio
+import logging
+import math
+import threading
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+import config
+from database import get_db
+
+logger = logging.getLogger(__name__)
+
+# Настройки необязательны в config.py
+HISTORY_TOKEN_BUDGET = getattr(config, 'HISTORY_TOKEN_BUDGET', 12000)  # токенов истории в одном запросе
+HISTORY_KEEP_EXCHANGES = getattr(config, 'HISTORY_KEEP_EXCHANGES', 6)  # последних пар user/assistant дословно
+HISTORY_SUMMARY_TRIGGER_TOKENS = getattr(config, 'HISTORY_SUMMARY_TRIGGER_TOKENS', 2000)
+
+# Без tiktoken считаем приблизительно: русский текст ~3 символа на токен
+CHARS_PER_TOKEN = 3
+MESSAGE_OVERHEAD_TOKENS = 4  # роль и разметка сообщения
+
+SUMMARY_PREFIX = "Краткое содержание предыдущих событий приключения:\n"
+
+try:
+    import tiktoken
+    _encoding = tiktoken.get_encoding("cl100k_base")
+except ImportError:
+    _encoding = None
+
+
+def count_tokens(text: str) -> int:
+    """Число токенов в тексте (точно с tiktoken, иначе оценка)."""
+    if not text:
+        return 0
+    if _encoding is not None:
+        return len(_encoding.encode(text))
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+def count_message_tokens(messages: List[Dict[str, str]]) -> int:
+    return sum(count_tokens(message['content']) + MESSAGE_OVERHEAD_TOKENS for message in messages)
+
+
+class RequestMetrics:
+    """Размер запросов к модели: байты тела и токены сообщений."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.bytes_total = 0
+        self.tokens_total = 0
+        self.max_bytes = 0
+        self.max_tokens = 0
+
+    def record(self, payload_bytes: int, tokens: int):
+        with self._lock:
+            self.requests += 1
+            self.bytes_total += payload_bytes
+            self.tokens_total += tokens
+            self.max_bytes = max(self.max_bytes, payload_bytes)
+            self.max_tokens = max(self.max_tokens, tokens)
+            average_tokens = self.tokens_total // self.requests
+        logger.info(f"REQUEST METRICS: {payload_bytes} bytes, ~{tokens} tokens "
+                    f"(avg ~{average_tokens} tokens over {self.requests} requests)")
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                'requests': self.requests,
+                'bytes_total': self.bytes_total,
+                'tokens_total': self.tokens_total,
+                'avg_bytes': self.bytes_total // self.requests if self.requests else 0,
+                'avg_tokens': self.tokens_total // self.requests if self.requests else 0,
+                'max_bytes': self.max_bytes,
+                'max_tokens': self.max_tokens,
+            }
+
+
+# Глобальный экземпляр метрик
+request_metrics = RequestMetrics()
+
+
+class ConversationContext:
+    """Собирает ограниченный по токенам контекст и поддерживает скользящее содержание."""
+
+    def __init__(self, summarize: Callable[[str, List[Dict[str, str]]], Awaitable[Optional[str]]],
+                 token_budget: int = HISTORY_TOKEN_BUDGET, keep_exchanges: int = HISTORY_KEEP_EXCHANGES):
+        self.db = get_db()
+        # summarize(previous_summary, turns) -> новое содержание или None
+        self._summarize = summarize
+        self.token_budget = token_budget
+        self.keep_exchanges = keep_exchanges
+        # adventure_id -> (summary, сколько сообщений после system в нем свернуто)
+        self._summaries: Dict[int, Tuple[str, int]] = {}
+        self._tasks: Dict[int, asyncio.Task] = {}
+
+    # --- Хранение содержания -------------------------------------------------
+
+    def _load_summary(self, adventure_id: int) -> Tuple[str, int]:
+        rows = self.db.execute_query(
+            "SELECT summary, summarized_messages FROM adventure_summaries WHERE adventure_id = %s",
+            (adventure_id,)
+        )
+        if rows:
+            return rows[0]['summary'], rows[0]['summarized_messages']
+        return "", 0
+
+    def _save_summary(self, adventure_id: int, summary: str, summarized_messages: int):
+        self.db.execute_query("""
+            INSERT INTO adventure_summaries (adventure_id, summary, summarized_messages)
+            VALUES (%s, %s, %s)
+            ON DUPLICATE KEY UPDATE summary = VALUES(summary), summarized_messages = VALUES(summarized_messages)
+        """, (adventure_id, summary, summarized_messages))
+
+    async def _get_summary(self, adventure_id: int) -> Tuple[str, int]:
+        if adventure_id not in self._summaries:
+            self._summaries[adventure_id] = await self.db.run(self._load_summary, adventure_id)
+        return self._summaries[adventure_id]
+
+    def forget(self, adventure_id: int):
+        """Убирает содержание приключения из памяти (после завершения приключения)."""
+        self._summaries.pop(adventure_id, None)
+
+    # --- Сборка запроса -------------------------------------------------------
+
+    async def build(self, adventure_id: int, history: List[Dict[str, str]],
+                    new_messages: List[Dict[str, str]]) -> List[Dict[str, str]]:
+        """Сообщения для запроса: history (вся история из chat_history) плюс new_messages, в пределах бюджета."""
+        head = 0
+        while head < len(history) and history[head]['role'] == 'system':
+            head += 1
+        system, turns = history[:head], history[head:]
+
+        keep = self.keep_exchanges * 2
+        recent = turns[-keep:] if keep else []
+        older = turns[:len(turns) - len(recent)]
+
+        summary, summarized = await self._get_summary(adventure_id)
+        summarized = min(summarized, len(older))
+        backlog = older[summarized:]
+
+        summary_messages = [{"role": "system", "content": SUMMARY_PREFIX + summary}] if summary else []
+
+        # Обязательная часть; если она сама не влезает - жертвуем самыми старыми из окна
+        fixed = system + summary_messages + new_messages
+        fixed_tokens = count_message_tokens(fixed)
+        while recent and fixed_tokens + count_message_tokens(recent) > self.token_budget and len(recent) > 2:
+            backlog.append(recent.pop(0))
+
+        # Несвернутые старые ходы - сколько влезет, начиная с самых новых
+        available = self.token_budget - fixed_tokens - count_message_tokens(recent)
+        included = []
+        for message in reversed(backlog):
+            tokens = count_message_tokens([message])
+            if tokens > available:
+                break
+            included.insert(0, message)
+            available -= tokens
+
+        backlog_tokens = count_message_tokens(backlog)
+        if len(included) < len(backlog) or backlog_tokens >= HISTORY_SUMMARY_TRIGGER_TOKENS:
+            if len(included) < len(backlog):
+                logger.info(f"CONTEXT: adventure {adventure_id} - {len(backlog) - len(included)} old messages "
+                            f"left out until the summary catches up")
+            self._schedule_summary(adventure_id, summary, backlog, summarized + len(backlog))
+
+        messages = system + summary_messages + included + recent + new_messages
+        logger.info(f"CONTEXT: adventure {adventure_id} - {len(messages)} of {len(history) + len(new_messages)} "
+                    f"messages, ~{count_message_tokens(messages)} tokens (budget {self.token_budget})")
+        return messages
+
+    # --- Фоновое обновление содержания ---------------------------------------
+
+    def _schedule_summary(self, adventure_id: int, summary: str, turns: List[Dict[str, str]], summarized_total: int):
+        task = self._tasks.get(adventure_id)
+        if task is not None and not task.done():
+            return  # уже считается; следующий ход подхватит остаток
+        self._tasks[adventure_id] = asyncio.create_task(
+            self._refresh_summary(adventure_id, summary, list(turns), summarized_total)
+        )
+
+    async def _refresh_summary(self, adventure_id: int, summary: str, turns: List[Dict[str, str]], summarized_total: int):
+        try:
+            new_summary = await self._summarize(summary, turns)
+            if not new_summary:
+                logger.warning(f"CONTEXT: summary refresh for adventure {adventure_id} returned nothing")
+                return
+            await self.db.run(self._save_summary, adventure_id, new_summary, summarized_total)
+            self._summaries[adventure_id] = (new_summary, summarized_total)
+            logger.info(f"CONTEXT: adventure {adventure_id} summary now covers {summarized_total} messages "
+                        f"(~{count_tokens(new_summary)} tokens)")
+        except Exception as e:
+            logger.error(f"CONTEXT: failed to refresh summary for adventure {adventure_id}: {e}")
+        finally:
+            self._tasks.pop(adventure_id, None)
@@ -1,80 +1,358 @@
-import mysql.connector
-from mysql.connector import Error
+from mysql.connector import Error, pooling
+from mysql.connector.errors import PoolError
+import asyncio
+import functools
 import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+import config
 from config import DB_HOST, DB_PORT, DB_USER, DB_PASSWORD, DB_NAME
 
+# Pool settings are optional in config.py, fall back to sane defaults
+DB_POOL_NAME = getattr(config, 'DB_POOL_NAME', 'dnd_bot_pool')
+DB_POOL_SIZE = getattr(config, 'DB_POOL_SIZE', 10)
+DB_POOL_TIMEOUT = getattr(config, 'DB_POOL_TIMEOUT', 10)  # seconds to wait for a free connection
+DB_STREAM_BATCH_SIZE = getattr(config, 'DB_STREAM_BATCH_SIZE', 500)  # rows per fetchmany in stream()
+
+# mysql.connector refuses pools larger than this
+MAX_POOL_SIZE = pooling.CNX_POOL_MAXSIZE
+
 # Set up logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+class ConnectionPool:
+    """Bounded pool of MySQL connections with health checks on checkout.
+
+    mysql.connector's own pool raises PoolError as soon as it is exhausted,
+    so checkouts are additionally gated by a semaphore: callers wait up to
+    ``timeout`` seconds for a connection instead of failing immediately.
+    Each checkout pings the server and transparently reconnects connections
+    that were dropped while idle (``wait_timeout``, server restarts).
+    """
+
+    def __init__(self, pool_name: str = DB_POOL_NAME, pool_size: int = DB_POOL_SIZE,
+                 timeout: float = DB_POOL_TIMEOUT):
+        self.pool_size = max(1, min(pool_size, MAX_POOL_SIZE))
+        if self.pool_size != pool_size:
+            logger.warning(f"DB_POOL_SIZE={pool_size} is out of range, using {self.pool_size}")
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(self.pool_size)
+        self._pool = pooling.MySQLConnectionPool(
+            pool_name=pool_name,
+            pool_size=self.pool_size,
+            pool_reset_session=True,
+            host=DB_HOST,
+            port=DB_PORT,
+            user=DB_USER,
+            password=DB_PASSWORD,
+            database=DB_NAME,
+            charset='utf8mb4',
+            collation='utf8mb4_unicode_ci'
+        )
+
+    def is_connected(self) -> bool:
+        """The pool is usable as long as it has not been closed"""
+        return self._pool is not None
+
+    def get_connection(self):
+        """Check out a healthy connection, waiting for a free slot if needed"""
+        if self._pool is None:
+            raise Error(msg="Connection pool is closed")
+        if not self._slots.acquire(timeout=self.timeout):
+            raise PoolError(msg=f"No free database connection after {self.timeout}s")
+        try:
+            # The pool pings the connection and reconnects it if it went stale
+            return self._pool.get_connection()
+        except Exception:
+            self._slots.release()
+            raise
+
+    def release(self, connection):
+        """Return a connection to the pool"""
+        try:
+            connection.close()
+        except Error as e:
+            logger.warning(f"Error returning connection to pool: {e}")
+        finally:
+            self._slots.release()
+
+    def close(self):
+        """Close all idle connections and disable the pool"""
+        if self._pool is not None:
+            self._pool._remove_connections()
+            self._pool = None
+
+
 class DatabaseManager:
-    def __init__(self):
-        self.connection = None
-        self.cursor = None
+    def __init__(self, pool_size: int = DB_POOL_SIZE):
+        self.pool_size = pool_size
+        self.connection = None  # ConnectionPool once connected
+        self._connect_lock = threading.Lock()
+        self._executor = None  # dedicated threads for the awaitable API
+        self._local = threading.local()  # per-thread open transaction
+        self._auto_increment_step = None  # @@auto_increment_increment, for multi-row inserts
         
     def connect(self):
-        """Establish connection to MySQL database"""
-        try:
-            self.connection = mysql.connector.connect(
-                host=DB_HOST,
-                port=DB_PORT,
-                user=DB_USER,
-                password=DB_PASSWORD,
-                database=DB_NAME,
-                charset='utf8mb4',
-                collation='utf8mb4_unicode_ci'
-            )
-            self.cursor = self.connection.cursor(dictionary=True)
-            logger.info("Successfully connected to database")
-            return True
-        except Error as e:
-            logger.error(f"Error connecting to database: {e}")
-            return False
+        """Create the connection pool (no-op if it already exists)"""
+        with self._connect_lock:
+            if self.connection and self.connection.is_connected():
+                return True
+            try:
+                self.connection = ConnectionPool(pool_size=self.pool_size)
+                logger.info(f"Successfully connected to database (pool size {self.connection.pool_size})")
+                return True
+            except Error as e:
+                logger.error(f"Error connecting to database: {e}")
+                self.connection = None
+                return False
     
     def disconnect(self):
-        """Close database connection"""
-        if self.cursor:
-            self.cursor.close()
-        if self.connection and self.connection.is_connected():
-            self.connection.close()
-            logger.info("Database connection closed")
+        """Close all pooled database connections"""
+        with self._connect_lock:
+            if self.connection:
+                self.connection.close()
+                self.connection = None
+                logger.info("Database connection pool closed")
+
+    @contextmanager
+    def _checkout(self):
+        """Borrow a connection and a fresh dictionary cursor for a single call"""
+        transaction = getattr(self._local, 'transaction', None)
+        if transaction is not None:
+            # Inside transaction(): every call on this thread shares its connection
+            yield transaction
+            return
+        if not self.connection or not self.connection.is_connected():
+            if not self.connect():
+                raise Error(msg="Database is not available")
+        pool = self.connection
+        connection = pool.get_connection()
+        cursor = connection.cursor(dictionary=True)
+        try:
+            yield connection, cursor
+        finally:
+            cursor.close()
+            pool.release(connection)
     
+    def in_transaction(self) -> bool:
+        """True if the current thread is inside a transaction() block"""
+        return getattr(self._local, 'transaction', None) is not None
+
+    @contextmanager
+    def transaction(self):
+        """Unit of work: all queries in the block share one connection and one commit.
+
+        Commits when the block exits normally and rolls everything back if it
+        raises. Inside the block database errors propagate instead of being
+        logged and turned into ``None``, so a failed write aborts the whole unit.
+        Nested blocks join the outer transaction. The transaction is bound to
+        the current thread - async code should put the block in a sync function
+        and ``await db.run(...)`` it.
+        """
+        if self.in_transaction():
+            yield self
+            return
+        
+        with self._checkout() as (connection, cursor):
+            self._local.transaction = (connection, cursor)
+            try:
+                yield self
+                connection.commit()
+            except BaseException:
+                try:
+                    connection.rollback()
+                except Error as e:
+                    logger.error(f"Error rolling back transaction: {e}")
+                raise
+            finally:
+                self._local.transaction = None
+
+    def _commit(self, connection):
+        if not self.in_transaction():
+            connection.commit()
+
+    def _rollback(self, connection):
+        # Inside transaction() the rollback happens once, when the block exits
+        if not self.in_transaction():
+            connection.rollback()
+
     def execute_query(self, query, params=None):
         """Execute a query and return results"""
         try:
-            if not self.connection or not self.connection.is_connected():
-                self.connect()
-            
-            self.cursor.execute(query, params or ())
-            
-            if query.strip().upper().startswith(('INSERT', 'UPDATE', 'DELETE')):
-                self.connection.commit()
-                return self.cursor.rowcount
-            else:
-                return self.cursor.fetchall()
+            with self._checkout() as (connection, cursor):
+                try:
+                    cursor.execute(query, params or ())
+                    
+                    if query.strip().upper().startswith(('INSERT', 'UPDATE', 'DELETE')):
+                        self._commit(connection)
+                        return cursor.rowcount
+                    else:
+                        return cursor.fetchall()
+                except Error:
+                    self._rollback(connection)
+                    raise
                 
         except Error as e:
+            if self.in_transaction():
+                raise
             logger.error(f"Error executing query: {e}")
-            if self.connection:
-                self.connection.rollback()
             return None
     
+    def execute_insert(self, query, params=None):
+        """Execute an INSERT and return the id of the created row.
+
+        Pooled calls do not share a session, so ``SELECT LAST_INSERT_ID()`` in a
+        follow-up call would read another connection - use this instead.
+        """
+        try:
+            with self._checkout() as (connection, cursor):
+                try:
+                    cursor.execute(query, params or ())
+                    self._commit(connection)
+                    return cursor.lastrowid
+                except Error:
+                    self._rollback(connection)
+                    raise
+                
+        except Error as e:
+            if self.in_transaction():
+                raise
+            logger.error(f"Error executing insert: {e}")
+            return None
+
+    def execute_insert_rows(self, table, columns, rows):
+        """Insert many rows with one multi-row INSERT and return their ids in order.
+
+        MySQL reports the id of the first row of the statement, and InnoDB
+        hands out consecutive ids to a single INSERT ... VALUES whose row count
+        is known up front, so the rest follow with the server's
+        ``auto_increment_increment`` step (read once and cached). Returns an
+        empty list for no rows and None on error (raises inside transaction()).
+        """
+        if not rows:
+            return []
+        placeholders = "(" + ", ".join(["%s"] * len(columns)) + ")"
+        query = (f"INSERT INTO {table} ({', '.join(columns)}) VALUES "
+                 + ", ".join([placeholders] * len(rows)))
+        params = [value for row in rows for value in row]
+        try:
+            with self._checkout() as (connection, cursor):
+                try:
+                    if self._auto_increment_step is None:
+                        cursor.execute("SELECT @@auto_increment_increment AS step")
+                        self._auto_increment_step = int(cursor.fetchall()[0]['step'])
+                    cursor.execute(query, params)
+                    self._commit(connection)
+                    first_id = cursor.lastrowid
+                    return [first_id + i * self._auto_increment_step for i in range(len(rows))]
+                except Error:
+                    self._rollback(connection)
+                    raise
+
+        except Error as e:
+            if self.in_transaction():
+                raise
+            logger.error(f"Error executing multi-row insert into {table}: {e}")
+            return None
+
     def execute_many(self, query, params_list):
         """Execute a query with multiple parameter sets"""
         try:
-            if not self.connection or not self.connection.is_connected():
-                self.connect()
-            
-            self.cursor.executemany(query, params_list)
-            self.connection.commit()
-            return self.cursor.rowcount
+            with self._checkout() as (connection, cursor):
+                try:
+                    cursor.executemany(query, params_list)
+                    self._commit(connection)
+                    return cursor.rowcount
+                except Error:
+                    self._rollback(connection)
+                    raise
             
         except Error as e:
+            if self.in_transaction():
+                raise
             logger.error(f"Error executing many queries: {e}")
-            if self.connection:
-                self.connection.rollback()
             return None
 
+    def stream(self, query, params=None, batch_size: int = DB_STREAM_BATCH_SIZE):
+        """Iterate over a large SELECT without loading it into memory.
+
+        Rows are read from an unbuffered cursor ``batch_size`` at a time with
+        ``fetchmany``, so memory stays flat however big the table is. The
+        generator holds a pooled connection until it is exhausted or closed -
+        consume it in a ``for`` loop and do not issue other queries from the
+        same transaction while iterating. Database errors are logged and raised:
+        a silently truncated scan would look like a complete one.
+        """
+        try:
+            with self._checkout() as (connection, _):
+                cursor = connection.cursor(dictionary=True, buffered=False)
+                try:
+                    cursor.execute(query, params or ())
+                    while True:
+                        rows = cursor.fetchmany(batch_size)
+                        if not rows:
+                            break
+                        yield from rows
+                finally:
+                    # Stopped early: drop the rest of the result set so the
+                    # connection can go back to the pool
+                    if connection.unread_result:
+                        connection.consume_results()
+                    cursor.close()
+        except Error as e:
+            logger.error(f"Error streaming query: {e}")
+            raise
+
+    # --- Awaitable API for async handlers -------------------------------------
+    #
+    # mysql.connector is blocking, so the coroutines below hand the work to a
+    # dedicated executor sized like the pool: the event loop never waits on a
+    # socket and DB calls do not compete with asyncio.to_thread() users.
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        with self._connect_lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=max(1, min(self.pool_size, MAX_POOL_SIZE)),
+                    thread_name_prefix='db'
+                )
+            return self._executor
+
+    async def run(self, func, *args, **kwargs):
+        """Run a blocking database helper on the database executor"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._get_executor(), functools.partial(func, *args, **kwargs))
+
+    async def fetch(self, query, params=None):
+        """Awaitable SELECT: list of row dicts, or None on error"""
+        return await self.run(self.execute_query, query, params)
+
+    async def fetch_one(self, query, params=None):
+        """Awaitable SELECT returning only the first row (or None)"""
+        rows = await self.fetch(query, params)
+        return rows[0] if rows else None
+
+    async def execute(self, query, params=None):
+        """Awaitable INSERT/UPDATE/DELETE: affected row count, or None on error"""
+        return await self.run(self.execute_query, query, params)
+
+    async def insert(self, query, params=None):
+        """Awaitable INSERT returning the id of the created row"""
+        return await self.run(self.execute_insert, query, params)
+
+    async def execute_batch(self, query, params_list):
+        """Awaitable executemany in a single transaction"""
+        return await self.run(self.execute_many, query, params_list)
+
+    async def run_in_transaction(self, func, *args, **kwargs):
+        """Run a blocking helper inside transaction() on the database executor"""
+        def unit_of_work():
+            with self.transaction():
+                return func(*args, **kwargs)
+        return await self.run(unit_of_work)
+
     def init_database(self):
         """Initialize database schema"""
         
@@ -87,6 +365,7 @@ class DatabaseManager:
             "DROP TABLE IF EXISTS combat_participants",
             "DROP TABLE IF EXISTS enemy_attacks",
             "DROP TABLE IF EXISTS enemies",
+            "DROP TABLE IF EXISTS adventure_summaries",
             "DROP TABLE IF EXISTS chat_history",
             "DROP TABLE IF EXISTS characters",
             "DROP TABLE IF EXISTS adventures",
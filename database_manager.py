@@ -15,11 +15,26 @@ import mysql.connector
 from mysql.connector import Error
 import logging
 from config import DB_HOST, DB_PORT, DB_USER, DB_PASSWORD, DB_NAME
+from migrations import apply_migrations
 
 # Set up logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+# Горячие запросы бота, которые обязаны идти по индексу (проверяются через EXPLAIN)
+HOT_QUERIES = [
+    ("chat history",
+     "SELECT role, content FROM chat_history WHERE adventure_id = %s ORDER BY timestamp, id", (1,)),
+    ("combat turn order",
+     "SELECT * FROM combat_participants WHERE adventure_id = %s ORDER BY turn_order", (1,)),
+    ("alive enemies",
+     "SELECT COUNT(*) AS count FROM enemies WHERE adventure_id = %s AND hit_points > 0", (1,)),
+    ("player characters",
+     "SELECT id, name FROM characters WHERE user_id = %s AND is_active = TRUE", (1,)),
+    ("active adventure",
+     "SELECT id FROM adventures WHERE chat_id = %s AND status = 'active'", (1,)),
+]
+
 class DatabaseSetupManager:
     def __init__(self):
         self.connection = None
@@ -133,6 +148,7 @@ class DatabaseSetupManager:
             "DROP TABLE IF EXISTS enemy_attacks",
             "DROP TABLE IF EXISTS enemies",
             "DROP TABLE IF EXISTS adventure_messages",
+            "DROP TABLE IF EXISTS adventure_summaries",
             "DROP TABLE IF EXISTS chat_history",
             "DROP TABLE IF EXISTS characters",
             "DROP TABLE IF EXISTS adventures",
@@ -142,7 +158,9 @@ class DatabaseSetupManager:
             "DROP TABLE IF EXISTS classes",
             "DROP TABLE IF EXISTS races",
             "DROP TABLE IF EXISTS origins",
-            "DROP TABLE IF EXISTS levels"
+            "DROP TABLE IF EXISTS levels",
+            # Схема пересоздается с нуля - миграции должны примениться заново
+            "DROP TABLE IF EXISTS schema_version"
         ]
         
         for drop_query in drop_tables:
@@ -850,6 +868,9 @@ class DatabaseSetupManager:
             # Step 6: Initialize spell slots for existing spellcaster characters
             self.initialize_character_spell_slots()
             
+            # Step 7: Apply versioned schema migrations (indexes etc.)
+            apply_migrations(self)
+            
             logger.info("Complete database setup finished successfully!")
             return True
             
@@ -931,6 +952,10 @@ class DatabaseSetupManager:
                 logger.error(f"Error verifying table {table_name}: {e}")
                 all_good = False
         
+        # Горячие запросы не должны делать полный просмотр таблицы
+        if not self.verify_hot_query_plans():
+            all_good = False
+        
         # Check some specific data
         try:
             spellcaster_classes = self.execute_query("SELECT name FROM classes WHERE is_spellcaster = TRUE")
@@ -952,6 +977,34 @@ class DatabaseSetupManager:
         
         return all_good
 
+    def verify_hot_query_plans(self):
+        """Run EXPLAIN on the hot queries and fail on full table scans"""
+        
+        all_good = True
+        
+        for name, query, params in HOT_QUERIES:
+            plan = self.execute_query(f"EXPLAIN {query}", params)
+            if plan is None:
+                logger.error(f"Failed to EXPLAIN hot query '{name}'")
+                all_good = False
+                continue
+            
+            for row in plan:
+                if row.get('type') != 'ALL':
+                    continue
+                if row.get('possible_keys'):
+                    # Индекс есть, но на маленькой таблице оптимизатор предпочел скан
+                    logger.warning(f"Hot query '{name}': full scan of {row.get('table')} "
+                                   f"despite usable keys {row['possible_keys']} (table is probably small)")
+                else:
+                    logger.error(f"Hot query '{name}': full scan of {row.get('table')} - no usable index")
+                    all_good = False
+        
+        if all_good:
+            logger.info("Hot query plans use indexes")
+        
+        return all_good
+
 def main():
     """Main function to run complete database setup"""
     
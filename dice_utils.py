@@ -1,92 +1,266 @@
 import random
 import re
 import logging
+from functools import lru_cache
+from typing import List, Optional, Sequence, Tuple
+
+try:
+    import numpy
+    NUMPY_AVAILABLE = True
+except ImportError:
+    NUMPY_AVAILABLE = False
 
 logger = logging.getLogger(__name__)
 
-def roll_dice(dice_notation: str) -> tuple[int, str]:
+# One term of a dice expression: "2d6", "-1d4", "+3"
+TERM_RE = re.compile(r'([+-]?)(?:(\d*)d(\d+)|(\d+))')
+MAX_DICE_PER_TERM = 1000
+DICE_CACHE_SIZE = 1024
+MAX_DISTRIBUTION_SPAN = 10000  # distinct totals; wider expressions get no exact distribution
+
+_random = random.random
+_numpy_rng = numpy.random.default_rng() if NUMPY_AVAILABLE else None
+
+
+def format_rolls(rolls: Sequence[int], modifier: int, total: int) -> str:
+    """Breakdown text like "3 + 5 + 2 = 10" (the format of roll_dice)"""
+    text = str(rolls[0]) if rolls else "0"
+    for value in rolls[1:]:
+        text += f" + {value}" if value >= 0 else f" - {-value}"
+    if modifier > 0:
+        text += f" + {modifier}"
+    elif modifier < 0:
+        text += f" {modifier}"
+    return f"{text} = {total}"
+
+
+class DiceRoll:
     """
-    Roll dice based on D&D dice notation (e.g., '1d6+3', '2d8', '1d20')
-    Returns tuple of (total_result, detailed_breakdown)
+    Result of one roll: total, individual dice (negative for subtracted dice) and modifier.
+    The breakdown text is built only when somebody reads it.
+    """
+    __slots__ = ('total', 'rolls', 'modifier', '_breakdown')
+
+    def __init__(self, total: int, rolls: List[int], modifier: int, breakdown: Optional[str] = None):
+        self.total = total
+        self.rolls = rolls
+        self.modifier = modifier
+        self._breakdown = breakdown
+
+    @property
+    def breakdown(self) -> str:
+        if self._breakdown is None:
+            self._breakdown = format_rolls(self.rolls, self.modifier, self.total)
+        return self._breakdown
+
+
+class DamageDistribution:
+    """
+    Exact probability distribution of a dice expression:
+    P(total == minimum + i) == probabilities[i]
+    """
+    __slots__ = ('minimum', 'probabilities', 'mean', 'variance', '_tail')
+
+    def __init__(self, minimum: int, probabilities: List[float]):
+        self.minimum = minimum
+        self.probabilities = probabilities
+        self.mean = sum((minimum + i) * p for i, p in enumerate(probabilities))
+        self.variance = sum((minimum + i - self.mean) ** 2 * p for i, p in enumerate(probabilities))
+        # _tail[i] = P(total >= minimum + i)
+        tail = [0.0] * (len(probabilities) + 1)
+        for i in range(len(probabilities) - 1, -1, -1):
+            tail[i] = tail[i + 1] + probabilities[i]
+        self._tail = tail
+
+    @property
+    def maximum(self) -> int:
+        return self.minimum + len(self.probabilities) - 1
+
+    @property
+    def std(self) -> float:
+        return self.variance ** 0.5
+
+    def chance_at_least(self, value: int) -> float:
+        """P(total >= value), e.g. the chance that damage drops a target with value HP"""
+        index = value - self.minimum
+        if index <= 0:
+            return 1.0
+        if index >= len(self.probabilities):
+            return 0.0
+        return min(1.0, self._tail[index])
+
+    def percentile(self, share: float) -> int:
+        """Smallest total t with P(total <= t) >= share"""
+        cumulative = 0.0
+        for i, p in enumerate(self.probabilities):
+            cumulative += p
+            if cumulative >= share - 1e-12:
+                return self.minimum + i
+        return self.maximum
+
+
+def _add_die(probabilities: List[float], sides: int) -> List[float]:
+    """Convolve with one uniform die (prefix sums: O(len + sides) instead of O(len * sides))"""
+    prefix = [0.0]
+    for p in probabilities:
+        prefix.append(prefix[-1] + p)
+    size = len(probabilities)
+    return [(prefix[min(k + 1, size)] - prefix[max(0, k - sides + 1)]) / sides
+            for k in range(size + sides - 1)]
+
+
+class DiceExpression:
+    """
+    Compiled dice notation: dice groups (count, sides) plus a flat modifier.
+    Subtracted dice have a negative count ("1d8-1d4" -> ((1, 8), (-1, 4))).
+    """
+    __slots__ = ('notation', 'dice', 'modifier', 'min', 'max', 'mean')
+
+    def __init__(self, notation: str, dice: Tuple[Tuple[int, int], ...], modifier: int):
+        self.notation = notation
+        self.dice = dice
+        self.modifier = modifier
+        self.min = modifier + sum(count if count > 0 else count * sides for count, sides in dice)
+        self.max = modifier + sum(count * sides if count > 0 else count for count, sides in dice)
+        self.mean = modifier + sum(count * (sides + 1) / 2 for count, sides in dice)
+
+    def __repr__(self) -> str:
+        return f"DiceExpression({self.notation!r})"
+
+    def roll(self, critical: bool = False) -> DiceRoll:
+        """Roll once; a critical hit doubles the dice but not the modifier"""
+        rolls = []
+        for count, sides in self.dice:
+            sign = 1 if count > 0 else -1
+            for _ in range(abs(count) * (2 if critical else 1)):
+                rolls.append(sign * (int(_random() * sides) + 1))
+        return DiceRoll(sum(rolls) + self.modifier, rolls, self.modifier)
+
+    def roll_total(self, critical: bool = False) -> int:
+        """Roll once and return only the total (no per-die list)"""
+        total = self.modifier
+        for count, sides in self.dice:
+            subtotal = 0
+            for _ in range(abs(count) * (2 if critical else 1)):
+                subtotal += int(_random() * sides) + 1
+            total += subtotal if count > 0 else -subtotal
+        return total
+
+    def roll_many(self, n: int, critical: bool = False):
+        """
+        Roll the expression n times and return the totals:
+        a NumPy int array when NumPy is installed, otherwise a list
+        """
+        if not NUMPY_AVAILABLE:
+            return [self.roll_total(critical) for _ in range(n)]
+        totals = numpy.full(n, self.modifier, dtype=numpy.int64)
+        for count, sides in self.dice:
+            dice = _numpy_rng.integers(1, sides + 1, size=(n, abs(count) * (2 if critical else 1))).sum(axis=1)
+            if count > 0:
+                totals += dice
+            else:
+                totals -= dice
+        return totals
+
+    def distribution(self, critical: bool = False) -> Optional[DamageDistribution]:
+        """Exact distribution by convolution; None if the expression has too many distinct totals"""
+        factor = 2 if critical else 1
+        span = sum(abs(count) * factor * (sides - 1) for count, sides in self.dice)
+        if span > MAX_DISTRIBUTION_SPAN:
+            return None
+        probabilities = [1.0]
+        minimum = self.modifier
+        for count, sides in self.dice:
+            for _ in range(abs(count) * factor):
+                probabilities = _add_die(probabilities, sides)
+            # Uniform die is symmetric: subtracted dice only shift the range down
+            minimum += abs(count) * factor if count > 0 else -abs(count) * factor * sides
+        return DamageDistribution(minimum, probabilities)
+
+
+@lru_cache(maxsize=DICE_CACHE_SIZE)
+def compile_dice(dice_notation: str) -> Optional[DiceExpression]:
+    """
+    Parse notation like "1d6+3", "2d6+1d4+3", "d20" or "1d8+2 slashing" once and cache it.
+    Parsing stops at the first text that is not a dice term; None if there are no dice.
     """
     if not dice_notation:
-        return 0, "No dice specified"
-    
-    # Clean the notation
-    dice_notation = dice_notation.strip().lower().replace(' ', '')
-    
-    # Parse dice notation like "1d6+3", "2d8", "1d20-1"
-    pattern = r'(\d*)d(\d+)([+-]\d+)?'
-    match = re.match(pattern, dice_notation)
-    
-    if not match:
-        logger.error(f"Invalid dice notation: {dice_notation}")
-        return 0, f"Invalid dice: {dice_notation}"
-    
-    num_dice = int(match.group(1)) if match.group(1) else 1
-    die_size = int(match.group(2))
-    modifier = int(match.group(3)) if match.group(3) else 0
-    
-    # Roll the dice
-    rolls = [random.randint(1, die_size) for _ in range(num_dice)]
-    total = sum(rolls) + modifier
-    
-    # Create breakdown string
-    if len(rolls) == 1:
-        if modifier != 0:
-            breakdown = f"{rolls[0]} + {modifier} = {total}" if modifier > 0 else f"{rolls[0]} {modifier} = {total}"
+        return None
+    notation = dice_notation.strip().lower().replace(' ', '')
+    dice = []
+    modifier = 0
+    position = 0
+    while position < len(notation):
+        match = TERM_RE.match(notation, position)
+        if not match or (position > 0 and not match.group(1)):
+            break
+        sign = -1 if match.group(1) == '-' else 1
+        if match.group(3) is not None:
+            count = int(match.group(2)) if match.group(2) else 1
+            sides = int(match.group(3))
+            if sides < 1 or count > MAX_DICE_PER_TERM:
+                logger.error(f"Invalid dice notation: {dice_notation}")
+                return None
+            if count:
+                dice.append((sign * count, sides))
         else:
-            breakdown = f"{rolls[0]} = {total}"
-    else:
-        rolls_str = " + ".join(map(str, rolls))
-        if modifier != 0:
-            breakdown = f"{rolls_str} + {modifier} = {total}" if modifier > 0 else f"{rolls_str} {modifier} = {total}"
-        else:
-            breakdown = f"{rolls_str} = {total}"
-    
-    return total, breakdown
+            modifier += sign * int(match.group(4))
+        position = match.end()
+    if not dice:
+        logger.error(f"Invalid dice notation: {dice_notation}")
+        return None
+    return DiceExpression(notation[:position], tuple(dice), modifier)
+
+
+def roll_expression(dice_notation: str, critical: bool = False) -> DiceRoll:
+    """Roll a notation; invalid notation gives a zero roll with the reason as its breakdown"""
+    expression = compile_dice(dice_notation)
+    if expression is None:
+        return DiceRoll(0, [], 0, f"Invalid dice: {dice_notation}" if dice_notation else "No dice specified")
+    return expression.roll(critical)
+
+
+def roll_many(dice_notation: str, n: int, critical: bool = False):
+    """n totals of a notation (NumPy array when available); zeros for invalid notation"""
+    expression = compile_dice(dice_notation)
+    if expression is None:
+        return numpy.zeros(n, dtype=numpy.int64) if NUMPY_AVAILABLE else [0] * n
+    return expression.roll_many(n, critical)
+
+
+@lru_cache(maxsize=DICE_CACHE_SIZE)
+def damage_distribution(dice_notation: str, critical: bool = False) -> Optional[DamageDistribution]:
+    """
+    Cached exact distribution of a notation (mean, variance, percentiles, chance to reach an HP value);
+    None for invalid notation
+    """
+    expression = compile_dice(dice_notation)
+    return expression.distribution(critical) if expression else None
+
+
+def seed_dice(seed: Optional[int]):
+    """Seed both the Python and the NumPy generators (reproducible simulations)"""
+    global _numpy_rng
+    random.seed(seed)
+    if NUMPY_AVAILABLE:
+        _numpy_rng = numpy.random.default_rng(seed)
+
+
+def roll_dice(dice_notation: str) -> tuple[int, str]:
+    """
+    Roll dice based on D&D dice notation (e.g., '1d6+3', '2d8', '1d20', '2d6+1d4')
+    Returns tuple of (total_result, detailed_breakdown)
+    """
+    result = roll_expression(dice_notation)
+    return result.total, result.breakdown
 
 def roll_dice_detailed(dice_notation: str) -> tuple[int, list[int], int, str]:
     """
     Roll dice and return detailed information for damage calculations
     Returns tuple of (total_result, individual_rolls, modifier, detailed_breakdown)
     """
-    if not dice_notation:
-        return 0, [], 0, "No dice specified"
-    
-    # Clean the notation
-    dice_notation = dice_notation.strip().lower().replace(' ', '')
-    
-    # Parse dice notation like "1d6+3", "2d8", "1d20-1"
-    pattern = r'(\d*)d(\d+)([+-]\d+)?'
-    match = re.match(pattern, dice_notation)
-    
-    if not match:
-        logger.error(f"Invalid dice notation: {dice_notation}")
-        return 0, [], 0, f"Invalid dice: {dice_notation}"
-    
-    num_dice = int(match.group(1)) if match.group(1) else 1
-    die_size = int(match.group(2))
-    modifier = int(match.group(3)) if match.group(3) else 0
-    
-    # Roll the dice
-    rolls = [random.randint(1, die_size) for _ in range(num_dice)]
-    total = sum(rolls) + modifier
-    
-    # Create breakdown string
-    if len(rolls) == 1:
-        if modifier != 0:
-            breakdown = f"{rolls[0]} + {modifier} = {total}" if modifier > 0 else f"{rolls[0]} {modifier} = {total}"
-        else:
-            breakdown = f"{rolls[0]} = {total}"
-    else:
-        rolls_str = " + ".join(map(str, rolls))
-        if modifier != 0:
-            breakdown = f"{rolls_str} + {modifier} = {total}" if modifier > 0 else f"{rolls_str} {modifier} = {total}"
-        else:
-            breakdown = f"{rolls_str} = {total}"
-    
-    return total, rolls, modifier, breakdown
+    result = roll_expression(dice_notation)
+    return result.total, result.rolls, result.modifier, result.breakdown
 
 def roll_d20(modifier: int = 0) -> tuple[int, str]:
     """
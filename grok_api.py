@@ -1,13 +1,68 @@
-import requests
+import functools
+import httpx
 import json
 import logging
-import re
-from typing import List, Dict, Any, Tuple
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+import config
 from config import GROK_API_TOKEN, GROK_API_URL, GROK_MODEL
 from database import get_db
+from conversation_context import ConversationContext, count_message_tokens, request_metrics
+from history_cache import HistoryCache
+from llm_retry import (GROK_CONNECT_TIMEOUT, GROK_REQUEST_DEADLINE, CircuitBreaker, PermanentError,
+                       RetryableError, call_with_retries, parse_retry_after)
+from llm_recorder import TrafficRecorder
+from llm_scheduler import LLMScheduler, PRIORITY_ACTION, PRIORITY_BACKGROUND, PRIORITY_COMBAT_END, PRIORITY_INTRO
+from response_parser import COMBAT_JSON_SCHEMA, ParsedResponse, parse_metrics, parse_response
 
 logger = logging.getLogger(__name__)
 
+# Колонки таблицы enemies в порядке значений save_enemies
+ENEMY_COLUMNS = ("adventure_id", "name", "hit_points", "max_hit_points",
+                 "strength", "dexterity", "constitution", "intelligence", "wisdom", "charisma",
+                 "xp", "armor_class")
+
+# HTTP client settings are optional in config.py
+GROK_MAX_CONNECTIONS = getattr(config, 'GROK_MAX_CONNECTIONS', 10)  # simultaneous requests to the API
+GROK_KEEPALIVE_EXPIRY = getattr(config, 'GROK_KEEPALIVE_EXPIRY', 120)  # seconds an idle connection is kept
+GROK_HTTP2 = getattr(config, 'GROK_HTTP2', True)
+GROK_STREAMING = getattr(config, 'GROK_STREAMING', True)  # stream narration into Telegram as it is generated
+GROK_PREVIEW_INTERVAL = getattr(config, 'GROK_PREVIEW_INTERVAL', 0.5)  # seconds between preview re-parses
+GROK_COMBAT_FORMAT = getattr(config, 'GROK_COMBAT_FORMAT', 'text')  # 'text' (ENEMY: blocks) or 'json'
+
+# Правило начала боя для system prompt в каждом из режимов GROK_COMBAT_FORMAT
+COMBAT_RULE_TEXT = """1. НАЧАЛО СРАЖЕНИЯ: Если в ходе приключения начинается сражение, обязательно включи в свой ответ фразу "***COMBAT_START***". После этой фразы добавь блок с параметрами каждого противника в следующем формате:
+        ```
+        ENEMY: [Имя противника]
+        HP: [Максимальные хиты]
+        STR: [Сила] (мод: [модификатор])
+        DEX: [Ловкость] (мод: [модификатор])
+        CON: [Телосложение] (мод: [модификатор])
+        INT: [Интеллект] (мод: [модификатор])
+        WIS: [Мудрость] (мод: [модификатор])
+        CHA: [Харизма] (мод: [модификатор])
+        ATTACK: [Название атаки] ([урон], бонус к атаке: [бонус])
+        XP: [Очки опыта за победу]
+        ```"""
+
+COMBAT_RULE_JSON = """1. НАЧАЛО СРАЖЕНИЯ: Если в ходе приключения начинается сражение, обязательно включи в свой ответ фразу "***COMBAT_START***". После этой фразы добавь один JSON-объект с параметрами всех противников (только JSON, без комментариев) по схеме:
+        ```json
+        """ + json.dumps(COMBAT_JSON_SCHEMA, ensure_ascii=False) + """
+        ```
+        Пример:
+        ```json
+        {"enemies": [{"name": "Гоблин", "hp": 7, "str": 8, "dex": 14, "con": 10, "int": 10, "wis": 8, "cha": 8, "attacks": [{"name": "Скимитар", "damage": "1d6+2 slashing", "attack_bonus": 4}], "xp": 50}]}
+        ```"""
+
+# Скрытые от игроков маркеры: все после COMBAT_START и блоки характеристик врагов
+HIDDEN_MARKERS = ("***COMBAT_START***", "ENEMY:")
+
+try:
+    import h2  # noqa: F401 - httpx needs it for HTTP/2
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
 class GrokAPI:
     def __init__(self):
         self.api_token = GROK_API_TOKEN
@@ -18,26 +73,30 @@ class GrokAPI:
             "Authorization": f"Bearer {self.api_token}",
             "Content-Type": "application/json"
         }
+        # Long-lived HTTP client, created on first request inside the bot's event loop
+        self._client = None
+        # Ограничение истории по токенам со скользящим кратким содержанием
+        self.context = ConversationContext(self.summarize_history)
+        # История приключений в памяти с отложенной записью в chat_history
+        self.history = HistoryCache(on_evict=self.context.forget)
+        # Очередь запросов: по одному ходу на приключение, глобальный лимит и приоритеты
+        self.scheduler = LLMScheduler()
+        # Быстрый отказ, пока провайдер недоступен
+        self.breaker = CircuitBreaker()
+        # Запись/воспроизведение ответов модели (GROK_TRAFFIC_MODE)
+        self.traffic = TrafficRecorder()
+        
+        # Формат боевых данных в ответе: текстовые блоки ENEMY: или JSON по схеме
+        self.combat_format = GROK_COMBAT_FORMAT if GROK_COMBAT_FORMAT in ("text", "json") else "text"
+        combat_rule = COMBAT_RULE_JSON if self.combat_format == "json" else COMBAT_RULE_TEXT
         
         # System prompt для Grok
-        self.system_prompt = """
+        self.system_prompt = f"""
         Ты - Данжен Мастер для игры в D&D 5e редакции 2024 года. Твоя задача - вести увлекательную игру для группы игроков.
         
         ВАЖНЫЕ ПРАВИЛА:
         
-        1. НАЧАЛО СРАЖЕНИЯ: Если в ходе приключения начинается сражение, обязательно включи в свой ответ фразу "***COMBAT_START***". После этой фразы добавь блок с параметрами каждого противника в следующем формате:
-        ```
-        ENEMY: [Имя противника]
-        HP: [Максимальные хиты]
-        STR: [Сила] (мод: [модификатор])
-        DEX: [Ловкость] (мод: [модификатор])
-        CON: [Телосложение] (мод: [модификатор])
-        INT: [Интеллект] (мод: [модификатор])
-        WIS: [Мудрость] (мод: [модификатор])
-        CHA: [Харизма] (мод: [модификатор])
-        ATTACK: [Название атаки] ([урон], бонус к атаке: [бонус])
-        XP: [Очки опыта за победу]
-        ```
+        {combat_rule}
         
         2. НАГРАЖДЕНИЕ ОПЫТОМ: Если персонажи совершают важные свершения вне боя, включи в ответ фразу "***XP_REWARD: [количество опыта]***"
         
@@ -57,110 +116,267 @@ class GrokAPI:
         Не заканчивай ответы предложением вариантов действий.
         """
     
-    def send_request(self, messages: List[Dict[str, str]]) -> Dict[str, Any]:
-        """Отправляет запрос к Grok API"""
-        try:
-            payload = {
-                "model": self.model,
-                "messages": messages,
-                "temperature": 0.7,  # Slightly more focused responses
-                "max_tokens": 2000,  # Increased token limit to reduce truncation
-                "stream": False
-            }
-            
-            logger.info(f"Sending request to Grok API: {self.api_url}")
-            logger.info(f"Model: {self.model}")
-            logger.info(f"Messages count: {len(messages)}")
-            logger.info(f"Total characters in messages: {sum(len(msg['content']) for msg in messages)}")
-            
-            # Log full request content
-            logger.info("=== FULL GROK REQUEST ===")
-            for i, message in enumerate(messages):
-                logger.info(f"Message {i+1} ({message['role']}):")
-                logger.info(f"{message['content']}")
-                logger.info("---")
-            logger.info("=== END GROK REQUEST ===")
-            
-            # Try with longer timeout and session for connection reuse
-            with requests.Session() as session:
-                session.headers.update(self.headers)
-                
-                response = session.post(
-                    self.api_url, 
-                    json=payload,
-                    timeout=(30, 180),  # connection timeout 30s, read timeout 3 minutes
-                    stream=False
+    def _get_client(self) -> httpx.AsyncClient:
+        """Shared async HTTP client: keeps TLS connections alive between narrations"""
+        if self._client is None or self._client.is_closed:
+            http2 = GROK_HTTP2 and HTTP2_AVAILABLE
+            self._client = httpx.AsyncClient(
+                headers=self.headers,
+                http2=http2,
+                # Таймауты задаются для каждой попытки из оставшегося бюджета запроса (_timeout)
+                timeout=httpx.Timeout(GROK_REQUEST_DEADLINE, connect=GROK_CONNECT_TIMEOUT),
+                limits=httpx.Limits(
+                    max_connections=GROK_MAX_CONNECTIONS,
+                    max_keepalive_connections=GROK_MAX_CONNECTIONS,
+                    keepalive_expiry=GROK_KEEPALIVE_EXPIRY
                 )
-                
-                logger.info(f"Response status code: {response.status_code}")
-                logger.info(f"Response headers: {dict(response.headers)}")
-            
-            if response.status_code == 200:
-                result = response.json()
-                logger.info(f"Successfully received response from Grok API")
-                if 'choices' in result and len(result['choices']) > 0:
-                    full_response = result['choices'][0]['message']['content']
-                    content_length = len(full_response)
-                    logger.info(f"Response content length: {content_length} characters")
-                    logger.info(f"Full Grok response: {full_response}")
-                return result
-            else:
-                logger.error(f"Grok API error: {response.status_code} - {response.text}")
+            )
+            logger.info(f"Created Grok HTTP client (HTTP/2: {http2}, max connections: {GROK_MAX_CONNECTIONS})")
+        return self._client
+    
+    async def close(self):
+        """Дописывает историю и закрывает HTTP-клиент (при остановке бота)"""
+        await self.history.close()
+        if self._client is not None and not self._client.is_closed:
+            await self._client.aclose()
+        self._client = None
+    
+    def _build_payload(self, messages: List[Dict[str, str]], stream: bool) -> Dict[str, Any]:
+        return {
+            "model": self.model,
+            "messages": messages,
+            "temperature": 0.7,  # Slightly more focused responses
+            "max_tokens": 2000,  # Increased token limit to reduce truncation
+            "stream": stream
+        }
+    
+    def _encode_payload(self, payload: Dict[str, Any]) -> bytes:
+        """Тело запроса: UTF-8 без \\u-экранирования, кириллица занимает 2 байта вместо 6"""
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        request_metrics.record(len(body), count_message_tokens(payload['messages']))
+        return body
+    
+    def _log_request(self, messages: List[Dict[str, str]]):
+        logger.info(f"Sending request to Grok API: {self.api_url}")
+        logger.info(f"Model: {self.model}")
+        logger.info(f"Messages count: {len(messages)}")
+        logger.info(f"Total characters in messages: {sum(len(msg['content']) for msg in messages)}")
+        
+        # Log full request content
+        logger.info("=== FULL GROK REQUEST ===")
+        for i, message in enumerate(messages):
+            logger.info(f"Message {i+1} ({message['role']}):")
+            logger.info(f"{message['content']}")
+            logger.info("---")
+        logger.info("=== END GROK REQUEST ===")
+    
+    def _timeout(self, remaining: float) -> httpx.Timeout:
+        """Таймауты попытки в пределах оставшегося бюджета запроса"""
+        return httpx.Timeout(remaining, connect=min(GROK_CONNECT_TIMEOUT, remaining))
+    
+    def _check_status(self, status_code: int, headers: httpx.Headers, body: str):
+        """Переводит неуспешный HTTP-статус в RetryableError/PermanentError"""
+        logger.error(f"Grok API error: {status_code} - {body[:1000]}")
+        if status_code == 429:
+            raise RetryableError('rate_limited', "HTTP 429", parse_retry_after(headers.get('retry-after')))
+        if status_code >= 500:
+            raise RetryableError('server_error', f"HTTP {status_code}", parse_retry_after(headers.get('retry-after')))
+        raise PermanentError('client_error', f"HTTP {status_code}")
+    
+    @staticmethod
+    def _transport_error(e: Exception) -> RetryableError:
+        if isinstance(e, httpx.TimeoutException):
+            return RetryableError('timeout', f"{type(e).__name__}: {e}")
+        return RetryableError('connect_error', f"{type(e).__name__}: {e}")
+    
+    async def _post_once(self, body: bytes, remaining: float) -> Dict[str, Any]:
+        """Одна попытка обычного запроса"""
+        try:
+            response = await self._get_client().post(self.api_url, content=body, timeout=self._timeout(remaining))
+        except httpx.TransportError as e:
+            raise self._transport_error(e) from e
+        
+        logger.info(f"Response status code: {response.status_code} ({response.http_version})")
+        logger.info(f"Response headers: {dict(response.headers)}")
+        if response.status_code != 200:
+            self._check_status(response.status_code, response.headers, response.text)
+        
+        try:
+            result = response.json()
+        except ValueError as e:
+            raise RetryableError('bad_response', f"invalid JSON in response: {e}") from e
+        logger.info(f"Successfully received response from Grok API")
+        if 'choices' in result and len(result['choices']) > 0:
+            full_response = result['choices'][0]['message']['content']
+            logger.info(f"Response content length: {len(full_response)} characters")
+            logger.info(f"Full Grok response: {full_response}")
+        return result
+    
+    async def send_request(self, messages: List[Dict[str, str]], deadline: Optional[float] = None) -> Dict[str, Any]:
+        """Отправляет запрос к Grok API (с повторами при сбоях провайдера); None, если ответа нет"""
+        payload = self._build_payload(messages, stream=False)
+        self._log_request(messages)
+        body = self._encode_payload(payload)
+        if self.traffic.replaying:
+            entry = self.traffic.lookup(payload)
+            if entry is not None:
+                return await self.traffic.replay(entry)
+            if self.traffic.on_miss != 'live':
                 return None
+        
+        started = time.monotonic()
+        result = await call_with_retries(functools.partial(self._post_once, body), self.breaker, deadline)
+        if result and self.traffic.recording:
+            await self.traffic.record(payload, result, time.monotonic() - started)
+        return result
+    
+    async def _stream_once(self, body: bytes, on_text: Callable[[str], Awaitable[None]], remaining: float) -> Dict[str, Any]:
+        """Одна попытка потокового запроса; при повторе on_text получает текст новой попытки с начала"""
+        full_response = ""
+        finish_reason = None
+        preview = self._previewer(on_text)
+        try:
+            async with self._get_client().stream("POST", self.api_url, content=body,
+                                                 timeout=self._timeout(remaining)) as response:
+                logger.info(f"Response status code: {response.status_code} ({response.http_version}), streaming")
+                if response.status_code != 200:
+                    error_body = await response.aread()
+                    self._check_status(response.status_code, response.headers, error_body.decode('utf-8', 'replace'))
                 
-        except requests.exceptions.Timeout as e:
-            logger.error(f"Timeout error calling Grok API: {e}")
-            logger.error(f"This might indicate the model is taking too long to respond")
-            return None
-        except requests.exceptions.ConnectionError as e:
-            logger.error(f"Connection error calling Grok API: {e}")
-            logger.error(f"Check your internet connection and API URL: {self.api_url}")
-            return None
-        except requests.exceptions.RequestException as e:
-            logger.error(f"Request error calling Grok API: {e}")
-            return None
-        except Exception as e:
-            logger.error(f"Unexpected error calling Grok API: {e}")
-            logger.error(f"Error type: {type(e).__name__}")
-            return None
+                async for line in response.aiter_lines():
+                    if not line.startswith("data:"):
+                        continue
+                    data = line[5:].strip()
+                    if data == "[DONE]":
+                        break
+                    try:
+                        chunk = json.loads(data)
+                    except ValueError:
+                        logger.warning(f"Skipping malformed stream chunk: {data[:200]}")
+                        continue
+                    
+                    choices = chunk.get('choices') or []
+                    if not choices:
+                        continue
+                    finish_reason = choices[0].get('finish_reason') or finish_reason
+                    delta = (choices[0].get('delta') or {}).get('content')
+                    if not delta:
+                        continue
+                    
+                    full_response += delta
+                    await preview(full_response)
+        except httpx.TransportError as e:
+            if full_response:
+                logger.warning(f"Stream interrupted after {len(full_response)} characters, restarting")
+            raise self._transport_error(e) from e
+        
+        logger.info(f"Successfully received streamed response from Grok API")
+        logger.info(f"Response content length: {len(full_response)} characters")
+        logger.info(f"Full Grok response: {full_response}")
+        return {
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": full_response},
+                "finish_reason": finish_reason
+            }]
+        }
     
-    def get_conversation_history(self, adventure_id: int) -> List[Dict[str, str]]:
-        """Получает историю разговора из базы данных"""
-        if not self.db.connection or not self.db.connection.is_connected():
-            self.db.connect()
-            
-        history = self.db.execute_query(
-            "SELECT role, content FROM chat_history WHERE adventure_id = %s ORDER BY timestamp",
-            (adventure_id,)
-        )
+    def _previewer(self, on_text: Callable[[str], Awaitable[None]]) -> Callable[[str], Awaitable[None]]:
+        """Передает on_text видимую часть растущего ответа, разбирая его не чаще GROK_PREVIEW_INTERVAL секунд.
+
+        Разбор всего буфера на каждую дельту SSE стоил бы O(n²) на ответ; первая
+        дельта показывается сразу, а итоговый текст все равно показывает finish.
+        """
+        next_preview = 0.0
+        
+        async def preview(text: str):
+            nonlocal next_preview
+            now = time.monotonic()
+            if now < next_preview:
+                return
+            next_preview = now + GROK_PREVIEW_INTERVAL
+            try:
+                await on_text(self.preview_for_players(text))
+            except Exception as e:
+                # Ошибка отображения не должна обрывать генерацию
+                logger.warning(f"Stream preview callback failed: {e}")
+        
+        return preview
+    
+    async def stream_request(self, messages: List[Dict[str, str]], on_text: Callable[[str], Awaitable[None]],
+                             deadline: Optional[float] = None) -> Dict[str, Any]:
+        """Отправляет запрос в режиме SSE и передает on_text видимую игрокам часть ответа по мере генерации.
+
+        Возвращает ответ в том же формате, что и send_request, с полным текстом,
+        поэтому разбор врагов и опыта работает как раньше. Сбои провайдера
+        повторяются так же, как в send_request.
+        """
+        payload = self._build_payload(messages, stream=True)
+        self._log_request(messages)
+        body = self._encode_payload(payload)
+        if self.traffic.replaying:
+            entry = self.traffic.lookup(payload)
+            if entry is not None:
+                return await self.traffic.replay(entry, self._previewer(on_text))
+            if self.traffic.on_miss != 'live':
+                return None
         
-        if not history:
-            return []
+        started = time.monotonic()
+        first_token_at = None
         
-        messages = []
-        for entry in history:
-            messages.append({
-                "role": entry['role'],
-                "content": entry['content']
-            })
+        async def on_preview(text: str):
+            nonlocal first_token_at
+            if first_token_at is None:
+                first_token_at = time.monotonic()
+            await on_text(text)
         
-        return messages
+        result = await call_with_retries(functools.partial(self._stream_once, body, on_preview), self.breaker, deadline)
+        if result and self.traffic.recording:
+            await self.traffic.record(payload, result, time.monotonic() - started,
+                                      first_token_at - started if first_token_at else None)
+        return result
     
-    def save_message(self, adventure_id: int, role: str, content: str):
-        """Сохраняет сообщение в историю разговора"""
-        if not self.db.connection or not self.db.connection.is_connected():
-            self.db.connect()
-            
-        logger.info(f"Saving message to database - Adventure ID: {adventure_id}, Role: {role}, Content length: {len(content)} characters")
-        logger.debug(f"Message content being saved: {content[:500]}{'...' if len(content) > 500 else ''}")
-        
-        self.db.execute_query(
-            "INSERT INTO chat_history (adventure_id, role, content) VALUES (%s, %s, %s)",
-            (adventure_id, role, content)
+    async def complete(self, messages: List[Dict[str, str]],
+                       on_text: Optional[Callable[[str], Awaitable[None]]] = None,
+                       priority: int = PRIORITY_ACTION) -> Dict[str, Any]:
+        """Запрос к модели через очередь планировщика: потоковый, если передан on_text и включен GROK_STREAMING
+
+        Бюджет GROK_REQUEST_DEADLINE отсчитывается с момента вызова, включая ожидание в очереди.
+        """
+        deadline = time.monotonic() + GROK_REQUEST_DEADLINE
+        async with self.scheduler.request(priority):
+            if on_text is not None and GROK_STREAMING:
+                return await self.stream_request(messages, on_text, deadline)
+            return await self.send_request(messages, deadline)
+    
+    async def summarize_history(self, previous_summary: str, turns: List[Dict[str, str]]) -> Optional[str]:
+        """Сворачивает старые ходы приключения (и прежнее содержание) в новое краткое содержание"""
+        transcript = "\n\n".join(
+            f"{'Игроки' if turn['role'] == 'user' else 'Мастер'}: {turn['content']}" for turn in turns
+        )
+        prompt = (
+            "Ниже краткое содержание приключения D&D и следующие за ним ходы. "
+            "Составь новое краткое содержание всего произошедшего (не больше 400 слов): "
+            "ключевые события, места, имена NPC, найденные предметы, незавершенные цели, "
+            "погибших персонажей. Пиши сжато, без художественных описаний и без триггеров вида ***...***.\n\n"
+            f"Прежнее содержание:\n{previous_summary or '(нет)'}\n\n"
+            f"Новые ходы:\n{transcript}"
         )
+        response = await self.complete([{"role": "user", "content": prompt}], priority=PRIORITY_BACKGROUND)
+        if response and response.get('choices'):
+            return response['choices'][0]['message']['content'].strip()
+        return None
     
-    def generate_adventure_intro(self, adventure_id: int, characters: List[Dict]) -> str:
-        """Генерирует вступление к приключению"""
+    async def save_messages(self, adventure_id: int, messages: List[Tuple[str, str]]):
+        """Сохраняет сообщения в историю разговора (в chat_history они пишутся пачками в фоне)"""
+        for role, content in messages:
+            logger.info(f"Saving message to history - Adventure ID: {adventure_id}, Role: {role}, Content length: {len(content)} characters")
+            logger.debug(f"Message content being saved: {content[:500]}{'...' if len(content) > 500 else ''}")
+            await self.history.append(adventure_id, role, content)
+    
+    async def generate_adventure_intro(self, adventure_id: int, characters: List[Dict],
+                                       on_text: Optional[Callable[[str], Awaitable[None]]] = None) -> str:
+        """Генерирует вступление к приключению (on_text получает текст по мере генерации)"""
         logger.info(f"Starting adventure intro generation for adventure_id: {adventure_id}")
         character_info = []
         for char in characters:
@@ -211,279 +427,234 @@ class GrokAPI:
         Опиши начальную локацию и ситуацию, в которой оказались персонажи.
         """
         
-        # Создаем новую историю разговора
-        messages = [
-            {"role": "system", "content": self.system_prompt},
-            {"role": "user", "content": user_prompt}
-        ]
+        # Один ход приключения за раз: история не перемешивается между параллельными колбэками
+        async with self.scheduler.adventure(adventure_id):
+            # Создаем новую историю разговора
+            messages = [
+                {"role": "system", "content": self.system_prompt},
+                {"role": "user", "content": user_prompt}
+            ]
         
-        response = self.send_request(messages)
+            response = await self.complete(messages, on_text, PRIORITY_INTRO)
         
-        if response and 'choices' in response:
-            intro_text = response['choices'][0]['message']['content']
+            if response and 'choices' in response:
+                intro_text = response['choices'][0]['message']['content']
             
-            logger.info(f"Generated intro text length: {len(intro_text)} characters")
-            logger.info("FLOW: About to save messages to database in order: system, user, assistant")
+                logger.info(f"Generated intro text length: {len(intro_text)} characters")
+                logger.info("FLOW: About to save messages to database in order: system, user, assistant")
             
-            # Сохраняем в историю
-            self.save_message(adventure_id, "system", self.system_prompt)
-            self.save_message(adventure_id, "user", user_prompt)
-            self.save_message(adventure_id, "assistant", intro_text)
+                # Сохраняем в историю
+                await self.save_messages(adventure_id, [
+                    ("system", self.system_prompt),
+                    ("user", user_prompt),
+                    ("assistant", intro_text)
+                ])
             
-            logger.info("FLOW: Finished saving messages to database, returning intro_text")
-            return intro_text
-        else:
-            return "Произошла ошибка при генерации приключения. Попробуйте еще раз."
+                logger.info("FLOW: Finished saving messages to database, returning intro_text")
+                return intro_text
+            else:
+                return "Произошла ошибка при генерации приключения. Попробуйте еще раз."
     
-    def continue_adventure(self, adventure_id: int, player_actions: List[Dict[str, str]], 
-                          additional_info: str = "") -> Tuple[str, List[Dict], int]:
+    async def continue_adventure(self, adventure_id: int, player_actions: List[Dict[str, str]], 
+                                 additional_info: str = "",
+                                 on_text: Optional[Callable[[str], Awaitable[None]]] = None) -> Optional[ParsedResponse]:
         """
         Продолжает приключение на основе действий игроков
-        Возвращает: (response_text, enemies_data, xp_reward)
+        Возвращает ParsedResponse: текст для игроков, сохраненные враги (с id), опыт, конец приключения;
+        None, если модель так и не ответила (история при этом не меняется)
+        Если передан on_text, видимая игрокам часть ответа отдается ему по мере генерации
         """
-        # Получаем историю разговора
-        messages = self.get_conversation_history(adventure_id)
-        
-        # Формируем текст с действиями игроков
-        actions_text = "Действия игроков:\n"
-        for action in player_actions:
-            actions_text += f"- {action['character_name']}: {action['action']}\n"
-        
-        if additional_info:
-            actions_text += f"\nДополнительная информация: {additional_info}"
-        
-        # Добавляем действия игроков к разговору
-        messages.append({
-            "role": "user", 
-            "content": actions_text
-        })
-        
-        # Отправляем запрос
-        response = self.send_request(messages)
-        
-        if not response or 'choices' not in response:
-            return "Произошла ошибка при обработке действий. Попробуйте еще раз.", [], 0
-        
-        response_text = response['choices'][0]['message']['content']
-        
-        logger.info(f"Generated continue adventure response length: {len(response_text)} characters")
-        logger.info("FLOW: About to save messages to database in order: user, assistant")
-        
-        # Сохраняем в историю
-        self.save_message(adventure_id, "user", actions_text)
-        self.save_message(adventure_id, "assistant", response_text)
-        
-        logger.info("FLOW: Finished saving messages to database, returning response_text")
-        
-        # Анализируем ответ на предмет боя и опыта
-        logger.info(f"COMBAT DEBUG: Checking response for combat triggers...")
-        logger.info(f"COMBAT DEBUG: Response contains COMBAT_START: {'***COMBAT_START***' in response_text}")
-        if "***COMBAT_START***" in response_text:
-            logger.info(f"COMBAT DEBUG: Found COMBAT_START trigger in response!")
-            combat_start_pos = response_text.find("***COMBAT_START***")
-            logger.info(f"COMBAT DEBUG: COMBAT_START position: {combat_start_pos}")
-            # Показываем часть текста вокруг триггера
-            start_pos = max(0, combat_start_pos - 100)
-            end_pos = min(len(response_text), combat_start_pos + 500)
-            logger.info(f"COMBAT DEBUG: Text around COMBAT_START: ...{response_text[start_pos:end_pos]}...")
-        else:
-            logger.info(f"COMBAT DEBUG: No COMBAT_START trigger found in response")
-        
-        enemies_data = self.parse_enemies(response_text, adventure_id)
-        xp_reward = self.parse_xp_reward(response_text)
-        
-        logger.info(f"COMBAT DEBUG: Parsed {len(enemies_data)} enemies from response")
-        if enemies_data:
-            for i, enemy in enumerate(enemies_data):
-                logger.info(f"COMBAT DEBUG: Enemy {i+1}: {enemy['name']} (HP: {enemy['hit_points']})")
-        
-        return response_text, enemies_data, xp_reward
+        # Один ход приключения за раз: история не перемешивается между параллельными колбэками
+        async with self.scheduler.adventure(adventure_id):
+            # Получаем историю разговора
+            history = await self.history.get(adventure_id)
+        
+            # Формируем текст с действиями игроков
+            actions_text = "Действия игроков:\n"
+            for action in player_actions:
+                actions_text += f"- {action['character_name']}: {action['action']}\n"
+        
+            if additional_info:
+                actions_text += f"\nДополнительная информация: {additional_info}"
+        
+            # Добавляем действия игроков к разговору; старые ходы сворачиваются в краткое содержание
+            messages = await self.context.build(adventure_id, history, [{
+                "role": "user", 
+                "content": actions_text
+            }])
+        
+            # Отправляем запрос
+            response = await self.complete(messages, on_text, PRIORITY_ACTION)
+        
+            if not response or 'choices' not in response:
+                # Ход не состоялся - вызывающий сохранит действия игроков для повтора
+                return None
+        
+            response_text = response['choices'][0]['message']['content']
+        
+            logger.info(f"Generated continue adventure response length: {len(response_text)} characters")
+            logger.info("FLOW: About to save messages to database in order: user, assistant")
+        
+            # Сохраняем в историю
+            await self.save_messages(adventure_id, [("user", actions_text), ("assistant", response_text)])
+        
+            logger.info("FLOW: Finished saving messages to database, returning response_text")
+        
+            # Разбираем ответ один раз: текст для игроков, враги, опыт, конец приключения
+            parsed = parse_response(response_text)
+            logger.info(f"COMBAT DEBUG: COMBAT_START: {parsed.combat_started}, enemies: {len(parsed.enemies)}, "
+                        f"XP: {parsed.xp_reward}, ADVENTURE_END: {parsed.adventure_ended}")
+            parse_metrics.record(self.combat_format, parsed)
+        
+            if parsed.enemies:
+                enemies_data = await self.db.run(self.save_enemies, adventure_id, parsed.enemies)
+                for i, enemy in enumerate(enemies_data):
+                    logger.info(f"COMBAT DEBUG: Enemy {i+1}: {enemy['name']} (HP: {enemy['hit_points']})")
+                parsed = parsed._replace(enemies=enemies_data)
+            elif parsed.combat_started:
+                logger.warning(f"COMBAT DEBUG: COMBAT_START without parsable enemies: {response_text[-500:]}")
+        
+            return parsed
     
     def clean_response_for_players(self, text: str) -> str:
         """Убирает из ответа информацию о врагах и триггеры, которые игроки не должны видеть"""
-        clean_text = text
+        return parse_response(text).clean_text
+    
+    def preview_for_players(self, partial_text: str) -> str:
+        """Видимая часть еще не дописанного ответа для потокового показа.
+
+        Кроме того, что убирает clean_response_for_players, придерживает хвост,
+        который может оказаться началом скрытого маркера: незаконченное слово
+        и незакрытый блок ***...***.
+        """
+        text = partial_text
+        for marker in HIDDEN_MARKERS:
+            pos = text.find(marker)
+            if pos != -1:
+                text = text[:pos]
         
-        # Убираем триггеры опыта и окончания приключения
-        import re
-        clean_text = re.sub(r'\*\*\*XP_REWARD: \d+\*\*\*', '', clean_text)
-        clean_text = re.sub(r'\*\*\*ADVENTURE_END\*\*\*', '', clean_text)
+        # Последнее слово может быть началом "***COMBAT_ST..." или "ENEM..."
+        last_space = max(text.rfind(' '), text.rfind('\n'))
+        text = text[:last_space + 1] if last_space != -1 else ""
         
-        # Убираем боевые блоки, если есть
-        if "***COMBAT_START***" in clean_text:
-            combat_start_index = clean_text.find("***COMBAT_START***")
-            clean_text = clean_text[:combat_start_index].strip()
+        # Нечетное число *** - маркер открыт, но еще не закрыт
+        if text.count("***") % 2 == 1:
+            text = text[:text.rfind("***")]
         
-        return clean_text.strip()
+        return self.clean_response_for_players(text)
     
     def parse_enemies(self, text: str, adventure_id: int) -> List[Dict]:
-        """Парсит данные о врагах из ответа Grok"""
-        logger.info(f"PARSE DEBUG: Starting enemy parsing...")
-        if "***COMBAT_START***" not in text:
-            logger.info(f"PARSE DEBUG: No COMBAT_START found, returning empty list")
-            return []
-        
-        enemies = []
-        
-        # Получаем часть текста после COMBAT_START
-        combat_start_pos = text.find("***COMBAT_START***")
-        combat_text = text[combat_start_pos:]
-        logger.info(f"PARSE DEBUG: Combat text length: {len(combat_text)} characters")
-        logger.info(f"PARSE DEBUG: Combat text: {combat_text}")
-        
-        # Ищем блоки с противниками
-        # Новый подход: парсим каждый блок врага отдельно
-        enemy_blocks = re.split(r'(?=ENEMY:)', combat_text)[1:]  # Убираем первый пустой элемент
-        logger.info(f"PARSE DEBUG: Found {len(enemy_blocks)} enemy blocks")
-        
-        for i, block in enumerate(enemy_blocks):
-            logger.info(f"PARSE DEBUG: Processing enemy block {i+1}: {block[:200]}...")
-            
-            # Парсим основные характеристики врага
-            enemy_match = re.search(r"ENEMY: (.+?)\nHP: (\d+)\nSTR: (\d+) \(мод: ([+-]?\d+)\)\nDEX: (\d+) \(мод: ([+-]?\d+)\)\nCON: (\d+) \(мод: ([+-]?\d+)\)\nINT: (\d+) \(мод: ([+-]?\d+)\)\nWIS: (\d+) \(мод: ([+-]?\d+)\)\nCHA: (\d+) \(мод: ([+-]?\d+)\)", block, re.DOTALL)
-            
-            if not enemy_match:
-                logger.warning(f"PARSE DEBUG: Could not parse enemy stats from block {i+1}")
-                continue
-            
-            # Парсим все атаки
-            attack_matches = re.findall(r"ATTACK: (.+?) \((.+?), бонус к атаке: ([+-]?\d+)\)", block)
-            logger.info(f"PARSE DEBUG: Found {len(attack_matches)} attacks for enemy {i+1}")
-            
-            # Парсим опыт
-            xp_match = re.search(r"XP: (\d+)", block)
-            if not xp_match:
-                logger.warning(f"PARSE DEBUG: Could not parse XP from block {i+1}")
-                continue
-            
-            enemy_data = {
-                'name': enemy_match.group(1).strip(),
-                'hit_points': int(enemy_match.group(2)),
-                'max_hit_points': int(enemy_match.group(2)),
-                'strength': int(enemy_match.group(3)),
-                'dexterity': int(enemy_match.group(5)),
-                'constitution': int(enemy_match.group(7)),
-                'intelligence': int(enemy_match.group(9)),
-                'wisdom': int(enemy_match.group(11)),
-                'charisma': int(enemy_match.group(13)),
-                'experience_reward': int(xp_match.group(1)),
-                'armor_class': 12 + (int(enemy_match.group(6)) if int(enemy_match.group(6)) > 0 else 0)  # AC = 12 + DEX mod if positive
-            }
-            
-            # Используем первую атаку для совместимости со старой схемой
-            if attack_matches:
-                enemy_data['attack_name'] = attack_matches[0][0].strip()
-                enemy_data['attack_damage'] = attack_matches[0][1].strip()
-                enemy_data['attack_bonus'] = int(attack_matches[0][2])
-            else:
-                enemy_data['attack_name'] = "Удар"
-                enemy_data['attack_damage'] = "1d4"
-                enemy_data['attack_bonus'] = 0
-            
-            logger.info(f"PARSE DEBUG: Enemy data: {enemy_data['name']} with {len(attack_matches)} attacks")
-            
-            # Сохраняем врага в базу данных
-            if not self.db.connection or not self.db.connection.is_connected():
-                self.db.connect()
-                
-            self.db.execute_query("""
-                INSERT INTO enemies (adventure_id, name, hit_points, max_hit_points, 
-                                   strength, dexterity, constitution, intelligence, wisdom, charisma,
-                                   xp, armor_class)
-                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-            """, (adventure_id, enemy_data['name'], enemy_data['hit_points'], 
-                  enemy_data['max_hit_points'], enemy_data['strength'], enemy_data['dexterity'],
-                  enemy_data['constitution'], enemy_data['intelligence'], enemy_data['wisdom'],
-                  enemy_data['charisma'], enemy_data['experience_reward'], enemy_data['armor_class']))
-            
-            # Получаем ID созданного врага
-            enemy_id_result = self.db.execute_query("SELECT LAST_INSERT_ID() as id")
-            if enemy_id_result:
-                enemy_data['id'] = enemy_id_result[0]['id']
+        """Парсит данные о врагах из ответа Grok и сохраняет их в базу"""
+        return self.save_enemies(adventure_id, parse_response(text).enemies)
+    
+    def save_enemies(self, adventure_id: int, enemies: List[Dict]) -> List[Dict]:
+        """Сохраняет разобранных врагов (response_parser) и их атаки; заполняет enemy['id']
+
+        Одна транзакция: всех врагов вставляет один многострочный INSERT (id берутся
+        из диапазона lastrowid), все атаки - один executemany. При ошибке не
+        сохраняется ничего и возвращается пустой список: бой без врагов в базе
+        не начинается, а история продолжается.
+        """
+        if not enemies:
+            return enemies
+        
+        enemy_rows = [
+            (adventure_id, enemy['name'], enemy['hit_points'], enemy['max_hit_points'],
+             enemy['strength'], enemy['dexterity'], enemy['constitution'],
+             enemy['intelligence'], enemy['wisdom'], enemy['charisma'],
+             enemy['experience_reward'], enemy['armor_class'])
+            for enemy in enemies
+        ]
+        try:
+            with self.db.transaction():
+                enemy_ids = self.db.execute_insert_rows("enemies", ENEMY_COLUMNS, enemy_rows)
                 
-                # Сохраняем все атаки в отдельную таблицу
-                for attack_name, attack_damage, attack_bonus in attack_matches:
-                    # Парсим тип урона из строки damage
-                    damage_parts = attack_damage.strip().split()
-                    damage_dice = damage_parts[0] if damage_parts else "1d4"
-                    damage_type = damage_parts[1] if len(damage_parts) > 1 else "physical"
-                    
-                    self.db.execute_query(
+                attack_rows = []
+                for enemy_id, enemy in zip(enemy_ids, enemies):
+                    for attack_name, attack_damage, attack_bonus in enemy['attacks']:
+                        # Тип урона - второе слово строки damage ("1d8+2 slashing")
+                        damage_parts = attack_damage.split()
+                        damage_dice = damage_parts[0] if damage_parts else "1d4"
+                        damage_type = damage_parts[1] if len(damage_parts) > 1 else "physical"
+                        attack_rows.append((enemy_id, attack_name, damage_dice, damage_type, attack_bonus))
+                if attack_rows:
+                    self.db.execute_many(
                         "INSERT INTO enemy_attacks (enemy_id, name, damage, damage_type, attack_bonus) VALUES (%s, %s, %s, %s, %s)",
-                        (enemy_data['id'], attack_name.strip(), damage_dice, damage_type, int(attack_bonus))
+                        attack_rows
                     )
-                    logger.info(f"PARSE DEBUG: Saved attack: {attack_name} ({attack_damage}, +{attack_bonus})")
-            
-            enemies.append(enemy_data)
+        except Exception as e:
+            logger.error(f"PARSE DEBUG: Failed to save {len(enemies)} enemies for adventure {adventure_id}, "
+                         f"combat will not start: {e}")
+            return []
         
+        for enemy_id, enemy in zip(enemy_ids, enemies):
+            enemy['id'] = enemy_id
+        logger.info(f"PARSE DEBUG: Saved {len(enemies)} enemies with {len(attack_rows)} attacks in one transaction")
         return enemies
     
     def parse_xp_reward(self, text: str) -> int:
         """Парсит награду опытом из ответа Grok"""
-        xp_pattern = r"\*\*\*XP_REWARD: (\d+)\*\*\*"
-        match = re.search(xp_pattern, text)
-        
-        if match:
-            return int(match.group(1))
-        
-        return 0
+        return parse_response(text).xp_reward
     
     def is_adventure_ended(self, text: str) -> bool:
         """Проверяет, содержит ли текст триггер окончания приключения"""
-        return "***ADVENTURE_END***" in text
+        return parse_response(text).adventure_ended
     
-    def inform_combat_end(self, adventure_id: int, combat_result: str, dead_characters: List[str] = None):
-        """Информирует Grok об окончании боя"""
-        messages = self.get_conversation_history(adventure_id)
-        
-        # Формируем развернутое сообщение в зависимости от результата
-        if combat_result == "enemies":
-            # Враги победили
-            combat_info = (
-                "Сражение завершилось поражением всех игроков. Враги победили. "
-                "Опиши трагичное окончание приключения с поражением героев. "
-                "После описания обязательно добавь триггер ***ADVENTURE_END***, "
-                "чтобы официально завершить приключение."
-            )
-        elif combat_result == "players":
-            if dead_characters:
-                # Игроки победили, но есть потери
-                dead_list = ", ".join(dead_characters)
+    async def inform_combat_end(self, adventure_id: int, combat_result: str, dead_characters: List[str] = None,
+                                on_text: Optional[Callable[[str], Awaitable[None]]] = None):
+        """Информирует Grok об окончании боя (on_text получает текст по мере генерации)"""
+        # Один ход приключения за раз: история не перемешивается между параллельными колбэками
+        async with self.scheduler.adventure(adventure_id):
+            history = await self.history.get(adventure_id)
+        
+            # Формируем развернутое сообщение в зависимости от результата
+            if combat_result == "enemies":
+                # Враги победили
                 combat_info = (
-                    f"Сражение завершилось победой игроков, но не без потерь! "
-                    f"Погибшие персонажи (больше не упоминай их в дальнейшем повествовании): {dead_list}. "
-                    "Опиши победу с оттенком горечи от потери спутников, "
-                    "а затем продолжи приключение для оставшихся в живых персонажей."
+                    "Сражение завершилось поражением всех игроков. Враги победили. "
+                    "Опиши трагичное окончание приключения с поражением героев. "
+                    "После описания обязательно добавь триггер ***ADVENTURE_END***, "
+                    "чтобы официально завершить приключение."
                 )
+            elif combat_result == "players":
+                if dead_characters:
+                    # Игроки победили, но есть потери
+                    dead_list = ", ".join(dead_characters)
+                    combat_info = (
+                        f"Сражение завершилось победой игроков, но не без потерь! "
+                        f"Погибшие персонажи (больше не упоминай их в дальнейшем повествовании): {dead_list}. "
+                        "Опиши победу с оттенком горечи от потери спутников, "
+                        "а затем продолжи приключение для оставшихся в живых персонажей."
+                    )
+                else:
+                    # Полная победа без потерь
+                    combat_info = (
+                        "Сражение завершилось полной победой игроков! Все персонажи остались живы. "
+                        "Опиши их триумф и продолжи приключение."
+                    )
             else:
-                # Полная победа без потерь
+                # Неопределенный результат (например, ничья)
                 combat_info = (
-                    "Сражение завершилось полной победой игроков! Все персонажи остались живы. "
-                    "Опиши их триумф и продолжи приключение."
+                    f"Сражение завершилось с неопределенным результатом ({combat_result}). "
+                    "Опиши окончание боя и продолжи приключение."
                 )
-        else:
-            # Неопределенный результат (например, ничья)
-            combat_info = (
-                f"Сражение завершилось с неопределенным результатом ({combat_result}). "
-                "Опиши окончание боя и продолжи приключение."
-            )
         
-        messages.append({
-            "role": "user",
-            "content": combat_info
-        })
+            messages = await self.context.build(adventure_id, history, [{
+                "role": "user",
+                "content": combat_info
+            }])
         
-        response = self.send_request(messages)
+            response = await self.complete(messages, on_text, PRIORITY_COMBAT_END)
         
-        if response and 'choices' in response:
-            response_text = response['choices'][0]['message']['content']
+            if response and 'choices' in response:
+                response_text = response['choices'][0]['message']['content']
             
-            # Сохраняем в историю
-            self.save_message(adventure_id, "user", combat_info)
-            self.save_message(adventure_id, "assistant", response_text)
+                # Сохраняем в историю
+                await self.save_messages(adventure_id, [("user", combat_info), ("assistant", response_text)])
             
-            return response_text
+                return response_text
         
-        return "Приключение продолжается..."
+            return "Приключение продолжается..."
 
 # Глобальный экземпляр
 grok = GrokAPI()
@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Кэш истории разговора с Grok по приключениям.
+
+История приключения читается из chat_history один раз, при первом обращении,
+дальше новые сообщения дописываются в память. В базу они попадают пачками
+(write-behind): при накоплении HISTORY_FLUSH_BATCH сообщений или раз в
+HISTORY_FLUSH_INTERVAL секунд. Поэтому на горячем пути повествования нет ни
+SELECT истории, ни отдельных INSERT. Кэш ограничен HISTORY_CACHE_SIZE
+приключениями (LRU); приключения без обращений дольше HISTORY_CACHE_IDLE_SECONDS
+выгружаются.
+
+При аварийной остановке теряются только сообщения за последние
+HISTORY_FLUSH_INTERVAL секунд; при штатной остановке close() дописывает все.
+"""
+
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional, Tuple
+
+import config
+from database import get_db
+
+logger = logging.getLogger(__name__)
+
+# Настройки необязательны в config.py
+HISTORY_CACHE_SIZE = getattr(config, 'HISTORY_CACHE_SIZE', 64)  # приключений в памяти
+HISTORY_CACHE_IDLE_SECONDS = getattr(config, 'HISTORY_CACHE_IDLE_SECONDS', 1800)
+HISTORY_FLUSH_INTERVAL = getattr(config, 'HISTORY_FLUSH_INTERVAL', 5)  # секунд между записями в базу
+HISTORY_FLUSH_BATCH = getattr(config, 'HISTORY_FLUSH_BATCH', 20)  # сообщений, после которых пишем сразу
+
+# id - тай-брейкер: сообщения одной пачки получают одинаковый timestamp
+HISTORY_QUERY = "SELECT role, content FROM chat_history WHERE adventure_id = %s ORDER BY timestamp, id"
+INSERT_QUERY = "INSERT INTO chat_history (adventure_id, role, content) VALUES (%s, %s, %s)"
+
+
+class HistoryCache:
+    """LRU-кэш истории приключений с отложенной пакетной записью в chat_history."""
+
+    def __init__(self, capacity: int = HISTORY_CACHE_SIZE, idle_seconds: float = HISTORY_CACHE_IDLE_SECONDS,
+                 on_evict: Optional[Callable[[int], None]] = None):
+        self.db = get_db()
+        self.capacity = capacity
+        self.idle_seconds = idle_seconds
+        # Вызывается при выгрузке приключения (например, чтобы забыть его краткое содержание)
+        self.on_evict = on_evict
+        # adventure_id -> [messages, время последнего обращения]
+        self._entries: "OrderedDict[int, list]" = OrderedDict()
+        self._pending: List[Tuple[int, str, str]] = []
+        self._flush_lock: Optional[asyncio.Lock] = None  # создается в цикле событий бота
+        self._flusher: Optional[asyncio.Task] = None
+        self.hits = 0
+        self.misses = 0
+
+    # --- Чтение ---------------------------------------------------------------
+
+    def _load(self, adventure_id: int) -> List[Dict[str, str]]:
+        return [
+            {"role": entry['role'], "content": entry['content']}
+            for entry in self.db.stream(HISTORY_QUERY, (adventure_id,))
+        ]
+
+    async def get(self, adventure_id: int) -> List[Dict[str, str]]:
+        """История приключения (копия списка; сообщения добавляются через append)."""
+        entry = self._entries.get(adventure_id)
+        if entry is not None:
+            self.hits += 1
+        else:
+            self.misses += 1
+            # Неподтвержденные записи этого приключения должны попасть в базу до чтения
+            if any(row[0] == adventure_id for row in self._pending):
+                await self.flush()
+            try:
+                messages = await self.db.run(self._load, adventure_id)
+            except Exception as e:
+                # Неполную историю не кэшируем - следующий запрос попробует снова
+                logger.error(f"HISTORY CACHE: failed to load history for adventure {adventure_id}: {e}")
+                return []
+            # Пока читали, другая корутина могла уже загрузить и дополнить историю
+            entry = self._entries.get(adventure_id)
+            if entry is None:
+                entry = [messages, 0.0]
+                self._entries[adventure_id] = entry
+                self._evict_overflow()
+        entry[1] = time.monotonic()
+        self._entries.move_to_end(adventure_id)
+        return list(entry[0])
+
+    # --- Запись ----------------------------------------------------------------
+
+    async def append(self, adventure_id: int, role: str, content: str):
+        """Дописывает сообщение в историю; в chat_history оно попадет со следующей пачкой."""
+        entry = self._entries.get(adventure_id)
+        if entry is None:
+            await self.get(adventure_id)
+            entry = self._entries[adventure_id]
+        entry[0].append({"role": role, "content": content})
+        entry[1] = time.monotonic()
+        self._entries.move_to_end(adventure_id)
+
+        self._pending.append((adventure_id, role, content))
+        self._ensure_flusher()
+        if len(self._pending) >= HISTORY_FLUSH_BATCH:
+            asyncio.create_task(self.flush())
+
+    async def flush(self):
+        """Записывает накопленные сообщения в chat_history одной пачкой."""
+        if self._flush_lock is None:
+            self._flush_lock = asyncio.Lock()
+        async with self._flush_lock:
+            if not self._pending:
+                return
+            rows, self._pending = self._pending, []
+            result = await self.db.execute_batch(INSERT_QUERY, rows)
+            if result is None:
+                # Не удалось - вернем в начало очереди и попробуем в следующий раз
+                self._pending = rows + self._pending
+                logger.error(f"HISTORY CACHE: failed to write {len(rows)} messages, will retry")
+            else:
+                logger.info(f"HISTORY CACHE: wrote {len(rows)} messages to chat_history")
+
+    def _ensure_flusher(self):
+        if self._flusher is None or self._flusher.done():
+            self._flusher = asyncio.create_task(self._flush_loop())
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(HISTORY_FLUSH_INTERVAL)
+            try:
+                await self.flush()
+                self._evict_idle()
+            except Exception as e:
+                logger.error(f"HISTORY CACHE: background flush failed: {e}")
+            if not self._pending and not self._entries:
+                break
+
+    async def close(self):
+        """Дописывает все в базу и останавливает фоновую запись (при остановке бота)."""
+        if self._flusher is not None:
+            self._flusher.cancel()
+            self._flusher = None
+        await self.flush()
+
+    # --- Выгрузка ----------------------------------------------------------------
+
+    def _evict(self, adventure_id: int):
+        # Неподтвержденные записи остаются в очереди, get() допишет их перед чтением
+        self._entries.pop(adventure_id, None)
+        if self.on_evict:
+            self.on_evict(adventure_id)
+
+    def _evict_overflow(self):
+        while len(self._entries) > self.capacity:
+            adventure_id = next(iter(self._entries))
+            logger.info(f"HISTORY CACHE: evicting adventure {adventure_id} (cache full)")
+            self._evict(adventure_id)
+
+    def _evict_idle(self):
+        deadline = time.monotonic() - self.idle_seconds
+        idle = [adventure_id for adventure_id, entry in self._entries.items() if entry[1] < deadline]
+        for adventure_id in idle:
+            logger.info(f"HISTORY CACHE: evicting idle adventure {adventure_id}")
+            self._evict(adventure_id)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            'adventures': len(self._entries),
+            'messages': sum(len(entry[0]) for entry in self._entries.values()),
+            'pending_writes': len(self._pending),
+            'hits': self.hits,
+            'misses': self.misses,
+        }
@@ -13,6 +13,8 @@ import logging
 import re
 import os
 from config import DB_HOST, DB_USER, DB_PASSWORD, DB_NAME
+from database import get_db
+from migrations import apply_migrations
 
 # Настройка логирования
 logging.basicConfig(
@@ -459,55 +461,49 @@ def add_spell_scaling_data(cursor, spells, level):
         """, rules_data)
         logger.info(f"Добавлено {len(rules_data)} специальных правил скалирования")
 
-def verify_import(cursor):
+def verify_import():
     """Проверяет результаты импорта."""
+    # Отчет читается потоково через пул бота, а не через курсор импорта:
+    # таблицы могут быть большими, в память грузится только текущая пачка строк
+    db = get_db()
+    
     logger.info("\n" + "="*60)
     logger.info("ПРОВЕРКА РЕЗУЛЬТАТОВ ИМПОРТА")
     logger.info("="*60)
     
-    # Общая статистика
-    cursor.execute("SELECT COUNT(*) FROM spells")
-    total_spells = cursor.fetchone()[0]
-    logger.info(f"Всего заклинаний в базе: {total_spells}")
-    
-    # Статистика по уровням
-    cursor.execute("""
+    # Общая статистика и распределение по уровням за один проход
+    logger.info("\nРаспределение по уровням:")
+    total_spells = 0
+    for row in db.stream("""
         SELECT level, COUNT(*) as count 
         FROM spells 
         GROUP BY level 
         ORDER BY level
-    """)
-    
-    logger.info("\nРаспределение по уровням:")
-    for level, count in cursor.fetchall():
-        level_name = "Заговоры" if level == 0 else f"Уровень {level}"
-        logger.info(f"  {level_name}: {count} заклинаний")
+    """):
+        total_spells += row['count']
+        level_name = "Заговоры" if row['level'] == 0 else f"Уровень {row['level']}"
+        logger.info(f"  {level_name}: {row['count']} заклинаний")
+    logger.info(f"Всего заклинаний в базе: {total_spells}")
     
     # Статистика по скалированию
-    cursor.execute("SELECT COUNT(*) FROM cantrip_scaling")
-    cantrip_scaling = cursor.fetchone()[0]
-    logger.info(f"\nЗаписей о скалировании заговоров: {cantrip_scaling}")
-    
-    cursor.execute("SELECT COUNT(*) FROM spell_slot_scaling")
-    slot_scaling = cursor.fetchone()[0]
-    logger.info(f"Записей о скалировании через слоты: {slot_scaling}")
-    
-    cursor.execute("SELECT COUNT(*) FROM spell_scaling_rules")
-    rules_count = cursor.fetchone()[0]
-    logger.info(f"Специальных правил скалирования: {rules_count}")
+    for table, label in (
+        ('cantrip_scaling', "\nЗаписей о скалировании заговоров"),
+        ('spell_slot_scaling', "Записей о скалировании через слоты"),
+        ('spell_scaling_rules', "Специальных правил скалирования"),
+    ):
+        count = db.execute_query(f"SELECT COUNT(*) as count FROM {table}")
+        logger.info(f"{label}: {count[0]['count'] if count else 0}")
     
     # Примеры первых заклинаний с их ID
     logger.info("\nПервые 10 заклинаний с их ID (для проверки постоянства):")
-    cursor.execute("""
+    for row in db.stream("""
         SELECT id, level, name 
         FROM spells 
         ORDER BY id 
         LIMIT 10
-    """)
-    
-    for id, level, name in cursor.fetchall():
-        level_str = "Заговор" if level == 0 else f"Ур.{level}"
-        logger.info(f"  ID {id:3d}: [{level_str}] {name}")
+    """):
+        level_str = "Заговор" if row['level'] == 0 else f"Ур.{row['level']}"
+        logger.info(f"  ID {row['id']:3d}: [{level_str}] {row['name']}")
 
 def main():
     """Основная функция."""
@@ -519,6 +515,9 @@ def main():
         logger.info("НАЧАЛО ПОЛНОГО ИМПОРТА ЗАКЛИНАНИЙ")
         logger.info("="*60)
         
+        # Схема заклинаний (saving_throw, таблицы усиления) создается миграциями
+        apply_migrations()
+        
         logger.info("Подключение к базе данных...")
         conn = connect_to_db()
         cursor = conn.cursor()
@@ -566,7 +565,7 @@ def main():
         
         # Проверка результатов
         logger.info("\nЭТАП 4: Проверка результатов")
-        verify_import(cursor)
+        verify_import()
         
         logger.info("\n" + "="*60)
         logger.info("✅ ИМПОРТ УСПЕШНО ЗАВЕРШЕН!")
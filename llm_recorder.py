@@ -0,0 +1,228 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Запись и воспроизведение трафика к Grok для воспроизводимых нагрузочных тестов.
+
+GROK_TRAFFIC_MODE = 'record' - каждый успешный ответ модели дописывается в архив
+GROK_TRAFFIC_ARCHIVE (JSONL; с расширением .zst - сжатый zstd, нужен пакет
+zstandard) вместе с хэшем нормализованного запроса и временем ответа.
+
+GROK_TRAFFIC_MODE = 'replay' - ответы берутся из архива по хэшу запроса, с
+записанной задержкой, умноженной на GROK_REPLAY_LATENCY_SCALE (0 - мгновенно).
+Потоковые ответы отдаются частями, как настоящий SSE. Для одного хэша
+несколько записей выдаются по кругу. Если ответа нет, при
+GROK_REPLAY_ON_MISS = 'live' запрос уходит к провайдеру, иначе считается сбоем.
+
+Хэш не зависит от режима stream, поэтому потоковые и обычные запросы
+взаимозаменяемы. Сводка по архиву: python llm_recorder.py [архив]
+"""
+
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+import config
+
+try:
+    import zstandard
+    ZSTD_AVAILABLE = True
+except ImportError:
+    ZSTD_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+# Настройки необязательны в config.py
+GROK_TRAFFIC_MODE = getattr(config, 'GROK_TRAFFIC_MODE', 'off')  # 'off', 'record' или 'replay'
+GROK_TRAFFIC_ARCHIVE = getattr(config, 'GROK_TRAFFIC_ARCHIVE', 'llm_traffic.jsonl')
+GROK_REPLAY_LATENCY_SCALE = getattr(config, 'GROK_REPLAY_LATENCY_SCALE', 1.0)
+GROK_REPLAY_ON_MISS = getattr(config, 'GROK_REPLAY_ON_MISS', 'fail')  # 'fail' или 'live'
+
+REPLAY_CHUNK_WORDS = 5  # слов в одном чанке воспроизводимого потока
+
+
+def request_hash(payload: Dict[str, Any]) -> str:
+    """Хэш запроса без полей, не влияющих на ответ (stream), и без пробелов по краям сообщений."""
+    normalized = {
+        "model": payload.get("model"),
+        "temperature": payload.get("temperature"),
+        "max_tokens": payload.get("max_tokens"),
+        "messages": [[m["role"], m["content"].strip()] for m in payload.get("messages", [])],
+    }
+    encoded = json.dumps(normalized, ensure_ascii=False, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(encoded.encode('utf-8')).hexdigest()
+
+
+def _is_zstd(path: str) -> bool:
+    return path.endswith('.zst')
+
+
+def read_archive(path: str) -> List[Dict[str, Any]]:
+    """Все записи архива по порядку."""
+    if not os.path.exists(path):
+        return []
+    with open(path, 'rb') as f:
+        if _is_zstd(path):
+            if not ZSTD_AVAILABLE:
+                raise RuntimeError(f"{path} is zstd-compressed, install the zstandard package")
+            reader = zstandard.ZstdDecompressor().stream_reader(f, read_across_frames=True)
+            data = reader.read()
+        else:
+            data = f.read()
+    entries = []
+    for line in data.decode('utf-8').splitlines():
+        if line.strip():
+            try:
+                entries.append(json.loads(line))
+            except ValueError:
+                logger.warning(f"TRAFFIC: skipping malformed archive line: {line[:200]}")
+    return entries
+
+
+class TrafficRecorder:
+    """Запись ответов модели в архив и их воспроизведение по хэшу запроса."""
+
+    def __init__(self, mode: str = GROK_TRAFFIC_MODE, path: str = GROK_TRAFFIC_ARCHIVE,
+                 latency_scale: float = GROK_REPLAY_LATENCY_SCALE, on_miss: str = GROK_REPLAY_ON_MISS):
+        if mode not in ('off', 'record', 'replay'):
+            logger.warning(f"TRAFFIC: unknown GROK_TRAFFIC_MODE={mode!r}, recording is off")
+            mode = 'off'
+        if _is_zstd(path) and not ZSTD_AVAILABLE and mode != 'off':
+            logger.warning(f"TRAFFIC: zstandard is not installed, using {path[:-4]} instead of {path}")
+            path = path[:-4]
+        self.mode = mode
+        self.path = path
+        self.latency_scale = latency_scale
+        self.on_miss = on_miss
+        self._write_lock = threading.Lock()
+        self._compressor = zstandard.ZstdCompressor(level=10) if ZSTD_AVAILABLE and _is_zstd(path) else None
+        self._responses: Dict[str, List[Dict[str, Any]]] = {}
+        self._served: Dict[str, int] = {}
+        self.recorded = 0
+        self.hits = 0
+        self.misses = 0
+        if mode == 'replay':
+            self._load()
+
+    @property
+    def recording(self) -> bool:
+        return self.mode == 'record'
+
+    @property
+    def replaying(self) -> bool:
+        return self.mode == 'replay'
+
+    # --- Запись ----------------------------------------------------------------
+
+    def _append(self, line: str):
+        data = (line + "\n").encode('utf-8')
+        if self._compressor is not None:
+            # Каждая запись - отдельный кадр zstd: архив можно дописывать и читать после сбоя
+            data = self._compressor.compress(data)
+        with self._write_lock:
+            with open(self.path, 'ab') as f:
+                f.write(data)
+
+    async def record(self, payload: Dict[str, Any], result: Dict[str, Any], latency: float,
+                     first_token_latency: Optional[float] = None):
+        """Дописывает успешный ответ в архив."""
+        choice = result['choices'][0]
+        entry = {
+            "hash": request_hash(payload),
+            "recorded_at": round(time.time(), 3),
+            "model": payload.get("model"),
+            "messages": len(payload.get("messages", [])),
+            "stream": bool(payload.get("stream")),
+            "latency": round(latency, 3),
+            "first_token_latency": round(first_token_latency, 3) if first_token_latency is not None else None,
+            "content": choice['message']['content'],
+            "finish_reason": choice.get('finish_reason'),
+        }
+        try:
+            await asyncio.to_thread(self._append, json.dumps(entry, ensure_ascii=False, separators=(',', ':')))
+            self.recorded += 1
+        except OSError as e:
+            logger.error(f"TRAFFIC: failed to record response to {self.path}: {e}")
+
+    # --- Воспроизведение -----------------------------------------------------
+
+    def _load(self):
+        entries = read_archive(self.path)
+        for entry in entries:
+            self._responses.setdefault(entry['hash'], []).append(entry)
+        logger.info(f"TRAFFIC: replaying {len(entries)} responses ({len(self._responses)} distinct requests) "
+                    f"from {self.path}, latency x{self.latency_scale}")
+
+    def lookup(self, payload: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """Записанный ответ на запрос (по кругу, если их несколько) или None."""
+        key = request_hash(payload)
+        entries = self._responses.get(key)
+        if not entries:
+            self.misses += 1
+            logger.warning(f"TRAFFIC: no recorded response for request {key[:12]}")
+            return None
+        index = self._served.get(key, 0)
+        self._served[key] = index + 1
+        self.hits += 1
+        return entries[index % len(entries)]
+
+    async def replay(self, entry: Dict[str, Any],
+                     on_text: Optional[Callable[[str], Awaitable[None]]] = None) -> Dict[str, Any]:
+        """Отдает записанный ответ с масштабированной задержкой; on_text получает растущий текст."""
+        content = entry['content']
+        latency = entry.get('latency', 0) * self.latency_scale
+        if on_text is None:
+            if latency > 0:
+                await asyncio.sleep(latency)
+        else:
+            first = (entry.get('first_token_latency') or 0) * self.latency_scale
+            words = content.split(' ')
+            chunks = [' '.join(words[i:i + REPLAY_CHUNK_WORDS]) for i in range(0, len(words), REPLAY_CHUNK_WORDS)]
+            step = max(0.0, latency - first) / max(1, len(chunks))
+            if first > 0:
+                await asyncio.sleep(first)
+            text = ""
+            for i, chunk in enumerate(chunks):
+                text += (' ' if i else '') + chunk
+                await on_text(text)
+                if step > 0:
+                    await asyncio.sleep(step)
+        return {
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": content},
+                "finish_reason": entry.get('finish_reason')
+            }]
+        }
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'mode': self.mode,
+            'archive': self.path,
+            'recorded': self.recorded,
+            'replay_hits': self.hits,
+            'replay_misses': self.misses,
+        }
+
+
+def main():
+    path = sys.argv[1] if len(sys.argv) > 1 else GROK_TRAFFIC_ARCHIVE
+    entries = read_archive(path)
+    if not entries:
+        print(f"{path}: no recorded responses")
+        return
+    latencies = sorted(entry['latency'] for entry in entries)
+    print(f"{path}: {len(entries)} responses, {len({entry['hash'] for entry in entries})} distinct requests, "
+          f"{sum(1 for entry in entries if entry.get('stream'))} streamed")
+    print(f"latency p50 {latencies[len(latencies) // 2]:.2f}s, "
+          f"p95 {latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]:.2f}s, max {latencies[-1]:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
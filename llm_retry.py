@@ -0,0 +1,227 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Повторы, экспоненциальная задержка и автомат-предохранитель для запросов к Grok.
+
+call_with_retries() выполняет попытку запроса, пока не получит ответ, не
+исчерпает GROK_MAX_RETRIES повторов или бюджет времени GROK_REQUEST_DEADLINE.
+Повторяются только сбои на стороне провайдера: 5xx, 429 (с учетом
+Retry-After), таймауты и обрывы соединения. Задержка между попытками -
+экспоненциальная со случайным разбросом (full jitter), чтобы чаты не
+повторяли запросы синхронно.
+
+CircuitBreaker после GROK_BREAKER_THRESHOLD сбоев подряд на
+GROK_BREAKER_RESET_SECONDS перестает отправлять запросы и сразу отвечает
+отказом, затем пропускает один пробный запрос. Исходы всех попыток копятся
+в provider_health.
+"""
+
+import asyncio
+import email.utils
+import logging
+import random
+import threading
+import time
+from typing import Awaitable, Callable, Dict, Optional, TypeVar
+
+import config
+
+logger = logging.getLogger(__name__)
+
+# Настройки необязательны в config.py
+GROK_MAX_RETRIES = getattr(config, 'GROK_MAX_RETRIES', 3)  # повторов после первой попытки
+GROK_RETRY_BASE_DELAY = getattr(config, 'GROK_RETRY_BASE_DELAY', 1.0)  # секунд, удваивается с каждой попыткой
+GROK_RETRY_MAX_DELAY = getattr(config, 'GROK_RETRY_MAX_DELAY', 20.0)
+GROK_REQUEST_DEADLINE = getattr(config, 'GROK_REQUEST_DEADLINE', 240.0)  # секунд на запрос со всеми повторами
+GROK_CONNECT_TIMEOUT = getattr(config, 'GROK_CONNECT_TIMEOUT', 10.0)
+GROK_BREAKER_THRESHOLD = getattr(config, 'GROK_BREAKER_THRESHOLD', 5)  # сбоев подряд до размыкания
+GROK_BREAKER_RESET_SECONDS = getattr(config, 'GROK_BREAKER_RESET_SECONDS', 60.0)
+
+T = TypeVar('T')
+
+
+class RetryableError(Exception):
+    """Сбой провайдера, после которого запрос стоит повторить."""
+
+    def __init__(self, outcome: str, message: str, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.outcome = outcome  # ключ счетчика в provider_health
+        self.retry_after = retry_after
+
+
+class PermanentError(Exception):
+    """Ошибка, которую повтор не исправит (400, 401, 404...)."""
+
+    def __init__(self, outcome: str, message: str):
+        super().__init__(message)
+        self.outcome = outcome
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Заголовок Retry-After в секундах: число секунд или HTTP-дата."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        moment = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, moment.timestamp() - time.time())
+
+
+def backoff_delay(attempt: int, base: float = GROK_RETRY_BASE_DELAY, cap: float = GROK_RETRY_MAX_DELAY) -> float:
+    """Задержка перед повтором номер attempt (с 0): случайная в [0, min(cap, base * 2^attempt)]."""
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+
+class ProviderHealth:
+    """Счетчики исходов запросов к провайдеру."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.outcomes: Dict[str, int] = {}
+
+    def record(self, outcome: str):
+        with self._lock:
+            self.outcomes[outcome] = self.outcomes.get(outcome, 0) + 1
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self.outcomes)
+
+
+# Глобальный экземпляр счетчиков
+provider_health = ProviderHealth()
+
+
+class CircuitBreaker:
+    """Предохранитель: после серии сбоев временно отказывает без обращения к провайдеру."""
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, threshold: int = GROK_BREAKER_THRESHOLD, reset_seconds: float = GROK_BREAKER_RESET_SECONDS):
+        self.threshold = max(1, threshold)
+        self.reset_seconds = reset_seconds
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probe_in_flight = False
+
+    def allow(self) -> bool:
+        """Можно ли отправить запрос сейчас."""
+        if self.state == self.CLOSED:
+            return True
+        if self.state == self.OPEN:
+            if time.monotonic() - self.opened_at < self.reset_seconds:
+                return False
+            self.state = self.HALF_OPEN
+            self._probe_in_flight = False
+            logger.info("GROK BREAKER: half-open, letting one probe request through")
+        # HALF_OPEN: одна пробная попытка за раз
+        if self._probe_in_flight:
+            return False
+        self._probe_in_flight = True
+        return True
+
+    def record_success(self):
+        if self.state != self.CLOSED:
+            logger.info("GROK BREAKER: provider recovered, closing")
+        self.state = self.CLOSED
+        self.failures = 0
+        self._probe_in_flight = False
+
+    def record_failure(self):
+        self.failures += 1
+        self._probe_in_flight = False
+        if self.state == self.HALF_OPEN or self.failures >= self.threshold:
+            if self.state != self.OPEN:
+                logger.error(f"GROK BREAKER: open after {self.failures} consecutive failures, "
+                             f"failing fast for {self.reset_seconds:.0f}s")
+            self.state = self.OPEN
+            self.opened_at = time.monotonic()
+
+    def abandon(self):
+        """Пробный запрос отменен без результата - следующий запрос станет новой пробой."""
+        self._probe_in_flight = False
+
+    def retry_in(self) -> float:
+        """Через сколько секунд предохранитель пропустит пробный запрос."""
+        if self.state != self.OPEN:
+            return 0.0
+        return max(0.0, self.reset_seconds - (time.monotonic() - self.opened_at))
+
+
+async def call_with_retries(attempt: Callable[[float], Awaitable[T]], breaker: CircuitBreaker,
+                            deadline: Optional[float] = None, max_retries: int = GROK_MAX_RETRIES,
+                            health: ProviderHealth = provider_health) -> Optional[T]:
+    """Выполняет attempt(remaining_seconds) с повторами; None, если ответа получить не удалось.
+
+    deadline - момент time.monotonic(), к которому нужен ответ (по умолчанию
+    сейчас + GROK_REQUEST_DEADLINE). Попытка получает оставшийся бюджет и
+    должна выбрасывать RetryableError или PermanentError.
+    """
+    if deadline is None:
+        deadline = time.monotonic() + GROK_REQUEST_DEADLINE
+
+    for retry in range(max_retries + 1):
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            health.record('deadline_exceeded')
+            logger.error("GROK RETRY: deadline exceeded before the request could be sent")
+            return None
+
+        if not breaker.allow():
+            health.record('circuit_open')
+            logger.warning(f"GROK RETRY: circuit open, failing fast (next probe in {breaker.retry_in():.0f}s)")
+            return None
+
+        try:
+            result = await asyncio.wait_for(attempt(remaining), timeout=remaining)
+        except RetryableError as e:
+            health.record(e.outcome)
+            breaker.record_failure()
+            delay = max(backoff_delay(retry), e.retry_after or 0.0)
+            if retry == max_retries or breaker.retry_in() > 0:
+                # Попытки кончились или предохранитель только что разомкнулся - ждать незачем
+                health.record('gave_up')
+                logger.error(f"GROK RETRY: {e.outcome} ({e}), giving up after {retry + 1} attempts")
+                return None
+            if time.monotonic() + delay >= deadline:
+                health.record('deadline_exceeded')
+                logger.error(f"GROK RETRY: {e.outcome} ({e}), no time left for another attempt")
+                return None
+            health.record('retry')
+            logger.warning(f"GROK RETRY: {e.outcome} ({e}), attempt {retry + 2}/{max_retries + 1} in {delay:.1f}s")
+            await asyncio.sleep(delay)
+            continue
+        except PermanentError as e:
+            # Провайдер отвечает, плох сам запрос - для предохранителя это не сбой
+            health.record(e.outcome)
+            breaker.record_success()
+            logger.error(f"GROK RETRY: {e.outcome} ({e}), not retrying")
+            return None
+        except asyncio.TimeoutError:
+            health.record('deadline_exceeded')
+            breaker.record_failure()
+            logger.error(f"GROK RETRY: request did not finish within its {remaining:.0f}s budget")
+            return None
+        except asyncio.CancelledError:
+            breaker.abandon()
+            raise
+        except Exception as e:
+            health.record('unexpected_error')
+            breaker.record_failure()
+            logger.error(f"GROK RETRY: unexpected {type(e).__name__}: {e}")
+            return None
+
+        breaker.record_success()
+        health.record('success' if retry == 0 else 'success_after_retry')
+        return result
+
+    return None
@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Планировщик запросов к Grok.
+
+Два уровня очередности:
+- adventure(adventure_id) - по приключению одновременно выполняется один ход
+  (чтение истории, запрос, запись ответа), поэтому два колбэка одного чата не
+  перемешивают историю;
+- request(priority) - глобально одновременно идет не больше
+  GROK_MAX_CONCURRENT_REQUESTS запросов и не чаще GROK_RATE_LIMIT в секунду
+  (token bucket с запасом GROK_RATE_BURST). Ожидающие запросы выходят из
+  очереди по приоритету, внутри приоритета - по порядку поступления.
+
+Глубина очереди и время ожидания копятся в stats().
+"""
+
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Dict, List, Optional, Tuple
+
+import config
+
+logger = logging.getLogger(__name__)
+
+# Настройки необязательны в config.py
+GROK_MAX_CONCURRENT_REQUESTS = getattr(config, 'GROK_MAX_CONCURRENT_REQUESTS', 4)
+GROK_RATE_LIMIT = getattr(config, 'GROK_RATE_LIMIT', 2.0)  # запросов в секунду; 0 - без ограничения
+GROK_RATE_BURST = getattr(config, 'GROK_RATE_BURST', 4)  # запросов подряд без ожидания
+
+# Приоритеты: меньше - раньше
+PRIORITY_COMBAT_END = 0  # игроки ждут итог боя
+PRIORITY_ACTION = 1
+PRIORITY_INTRO = 2
+PRIORITY_BACKGROUND = 3  # краткое содержание истории
+
+PRIORITY_NAMES = {
+    PRIORITY_COMBAT_END: 'combat_end',
+    PRIORITY_ACTION: 'action',
+    PRIORITY_INTRO: 'intro',
+    PRIORITY_BACKGROUND: 'background',
+}
+
+WAIT_SAMPLES = 500  # последних ожиданий для перцентилей
+SLOW_WAIT_SECONDS = 2.0  # дольше - пишем в лог
+
+
+class LLMScheduler:
+    """Очередь запросов к модели: по одному на приключение, глобальный лимит и приоритеты."""
+
+    def __init__(self, max_concurrent: int = GROK_MAX_CONCURRENT_REQUESTS,
+                 rate: float = GROK_RATE_LIMIT, burst: int = GROK_RATE_BURST):
+        self.max_concurrent = max(1, max_concurrent)
+        self.rate = rate
+        self.burst = max(1, burst)
+        self._tokens = float(self.burst)
+        self._refilled_at = time.monotonic()
+        self._in_flight = 0
+        # (priority, seq, future) - ожидающие глобального слота
+        self._queue: List[Tuple[int, int, asyncio.Future]] = []
+        self._seq = itertools.count()
+        self._wake_handle: Optional[asyncio.TimerHandle] = None
+        # adventure_id -> [lock, сколько корутин держат или ждут его]
+        self._adventures: Dict[int, list] = {}
+
+        self.requests = 0
+        self.max_queued = 0
+        self.max_wait = 0.0
+        self._waits = deque(maxlen=WAIT_SAMPLES)
+        self._waits_by_priority: Dict[int, List[float]] = {}  # priority -> [count, total]
+
+    # --- По приключению ----------------------------------------------------------
+
+    @asynccontextmanager
+    async def adventure(self, adventure_id: int):
+        """Один ход приключения за раз; остальные ждут своей очереди."""
+        entry = self._adventures.get(adventure_id)
+        if entry is None:
+            entry = [asyncio.Lock(), 0]
+            self._adventures[adventure_id] = entry
+        entry[1] += 1
+        try:
+            if entry[0].locked():
+                logger.info(f"LLM SCHEDULER: adventure {adventure_id} is busy, waiting for the previous turn")
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                self._adventures.pop(adventure_id, None)
+
+    # --- Глобальная очередь ----------------------------------------------------
+
+    @asynccontextmanager
+    async def request(self, priority: int = PRIORITY_ACTION):
+        """Слот для одного запроса к модели с учетом лимитов и приоритета."""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        queued_at = time.monotonic()
+        heapq.heappush(self._queue, (priority, next(self._seq), future))
+        self.max_queued = max(self.max_queued, len(self._queue))
+        self._dispatch()
+        try:
+            await future
+        except asyncio.CancelledError:
+            # Слот успели выдать, но ожидающий ушел - вернем его
+            if future.done() and not future.cancelled():
+                self._release()
+            raise
+        self._record_wait(priority, time.monotonic() - queued_at)
+        try:
+            yield
+        finally:
+            self._release()
+
+    def _release(self):
+        self._in_flight -= 1
+        self._dispatch()
+
+    def _refill(self):
+        if self.rate <= 0:
+            self._tokens = float(self.burst)
+            return
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._refilled_at) * self.rate)
+        self._refilled_at = now
+
+    def _dispatch(self):
+        """Выдает слоты ожидающим, пока есть свободная конкурентность и токены."""
+        while self._queue and self._in_flight < self.max_concurrent:
+            _, _, future = self._queue[0]
+            if future.done():
+                # Ожидающего отменили
+                heapq.heappop(self._queue)
+                continue
+            self._refill()
+            if self._tokens < 1:
+                # Разбудим себя, когда появится токен
+                if self._wake_handle is None:
+                    delay = (1 - self._tokens) / self.rate
+                    self._wake_handle = asyncio.get_running_loop().call_later(delay, self._on_wake)
+                return
+            heapq.heappop(self._queue)
+            self._tokens -= 1
+            self._in_flight += 1
+            future.set_result(None)
+
+    def _on_wake(self):
+        self._wake_handle = None
+        self._dispatch()
+
+    # --- Метрики -------------------------------------------------------------
+
+    def _record_wait(self, priority: int, wait: float):
+        self.requests += 1
+        self.max_wait = max(self.max_wait, wait)
+        self._waits.append(wait)
+        counters = self._waits_by_priority.setdefault(priority, [0, 0.0])
+        counters[0] += 1
+        counters[1] += wait
+        if wait >= SLOW_WAIT_SECONDS:
+            logger.warning(f"LLM SCHEDULER: {PRIORITY_NAMES.get(priority, priority)} request waited {wait:.1f}s "
+                           f"({len(self._queue)} still queued, {self._in_flight} in flight)")
+
+    def stats(self) -> Dict:
+        waits = sorted(self._waits)
+
+        def percentile(p):
+            return waits[min(len(waits) - 1, int(len(waits) * p))] if waits else 0.0
+
+        return {
+            'in_flight': self._in_flight,
+            'queued': sum(1 for _, _, future in self._queue if not future.done()),
+            'max_queued': self.max_queued,
+            'busy_adventures': len(self._adventures),
+            'requests': self.requests,
+            'wait_p50': percentile(0.5),
+            'wait_p95': percentile(0.95),
+            'wait_max': self.max_wait,
+            'avg_wait_by_priority': {
+                PRIORITY_NAMES.get(priority, priority): total / count
+                for priority, (count, total) in self._waits_by_priority.items()
+            },
+        }
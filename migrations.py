@@ -0,0 +1,448 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Версионированные миграции схемы базы данных.
+
+Каждая миграция имеет номер версии и применяется один раз; номер последней
+примененной миграции хранится в таблице schema_version. Функции миграций
+принимают объект с методами execute_query/execute_many (DatabaseManager или
+DatabaseSetupManager) и должны быть идемпотентными: они заменяют старые
+разовые скрипты add_*.py, которые могли уже быть запущены на рабочей базе.
+
+Миграции применяются при старте бота (bot.py) и в конце database_manager.py,
+поэтому код бота может рассчитывать на актуальную схему и не создавать
+таблицы/колонки на лету.
+
+Запуск вручную: python migrations.py
+"""
+
+import json
+import logging
+from typing import Callable, List, NamedTuple, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class Migration(NamedTuple):
+    version: int
+    description: str
+    apply: Callable
+    # Таблицы, которые должны существовать до миграции (spells создает import_all_spells.py)
+    requires: Tuple[str, ...] = ()
+
+
+# --- Вспомогательные функции ----------------------------------------------
+
+def _column_exists(db, table: str, column: str) -> bool:
+    result = db.execute_query("""
+        SELECT 1 FROM information_schema.columns
+        WHERE table_schema = DATABASE() AND table_name = %s AND column_name = %s
+    """, (table, column))
+    return bool(result)
+
+
+def _table_exists(db, table: str) -> bool:
+    result = db.execute_query("""
+        SELECT 1 FROM information_schema.tables
+        WHERE table_schema = DATABASE() AND table_name = %s
+    """, (table,))
+    return bool(result)
+
+
+def _index_exists(db, table: str, index: str) -> bool:
+    result = db.execute_query("""
+        SELECT 1 FROM information_schema.statistics
+        WHERE table_schema = DATABASE() AND table_name = %s AND index_name = %s
+    """, (table, index))
+    return bool(result)
+
+
+def _add_column(db, table: str, column: str, definition: str) -> bool:
+    """Добавляет колонку, если ее еще нет. Возвращает False при ошибке."""
+    if _column_exists(db, table, column):
+        return True
+    logger.info(f"MIGRATION: adding column {table}.{column}")
+    return db.execute_query(f"ALTER TABLE {table} ADD COLUMN {column} {definition}") is not None
+
+
+def _create_index(db, table: str, index: str, columns: str) -> bool:
+    """Создает индекс, если его еще нет. Возвращает False при ошибке."""
+    if _index_exists(db, table, index):
+        return True
+    logger.info(f"MIGRATION: creating index {index} ON {table} ({columns})")
+    return db.execute_query(f"CREATE INDEX {index} ON {table} ({columns})") is not None
+
+
+# --- Данные миграций --------------------------------------------------------
+
+CLASS_SAVING_THROWS = {
+    'Бард': ['Ловкость', 'Харизма'],
+    'Варвар': ['Сила', 'Телосложение'],
+    'Воин': ['Сила', 'Телосложение'],
+    'Волшебник': ['Интеллект', 'Мудрость'],
+    'Друид': ['Интеллект', 'Мудрость'],
+    'Жрец': ['Мудрость', 'Харизма'],
+    'Колдун': ['Мудрость', 'Харизма'],
+    'Монах': ['Сила', 'Ловкость'],
+    'Паладин': ['Мудрость', 'Харизма'],
+    'Плут': ['Ловкость', 'Интеллект'],
+    'Следопыт': ['Сила', 'Ловкость'],
+    'Чародей': ['Телосложение', 'Харизма']
+}
+
+ACHIEVEMENTS = [
+    # Достижения за уровни (20 достижений)
+    ('level_2', 'Первые шаги', 'Достигнуть 2-го уровня', 10, 'levels', '📈', False),
+    ('level_3', 'Начинающий искатель', 'Достигнуть 3-го уровня', 15, 'levels', '📈', False),
+    ('level_4', 'Опытный путник', 'Достигнуть 4-го уровня', 20, 'levels', '📈', False),
+    ('level_5', 'Закаленный воин', 'Достигнуть 5-го уровня', 30, 'levels', '⭐', False),
+    ('level_6', 'Ветеран приключений', 'Достигнуть 6-го уровня', 35, 'levels', '⭐', False),
+    ('level_7', 'Герой таверн', 'Достигнуть 7-го уровня', 40, 'levels', '⭐', False),
+    ('level_8', 'Гроза подземелий', 'Достигнуть 8-го уровня', 45, 'levels', '🌟', False),
+    ('level_9', 'Мастер клинка и магии', 'Достигнуть 9-го уровня', 50, 'levels', '🌟', False),
+    ('level_10', 'Легенда становится', 'Достигнуть 10-го уровня', 60, 'levels', '✨', False),
+    ('level_11', 'За гранью возможного', 'Достигнуть 11-го уровня', 70, 'levels', '✨', False),
+    ('level_12', 'Избранный судьбой', 'Достигнуть 12-го уровня', 80, 'levels', '💫', False),
+    ('level_13', 'Мифический герой', 'Достигнуть 13-го уровня', 90, 'levels', '💫', False),
+    ('level_14', 'Сила стихий', 'Достигнуть 14-го уровня', 100, 'levels', '🌠', False),
+    ('level_15', 'Полубог', 'Достигнуть 15-го уровня', 120, 'levels', '🌠', False),
+    ('level_16', 'Воплощение силы', 'Достигнуть 16-го уровня', 140, 'levels', '⚡', False),
+    ('level_17', 'Разрушитель миров', 'Достигнуть 17-го уровня', 160, 'levels', '⚡', False),
+    ('level_18', 'Покоритель судьбы', 'Достигнуть 18-го уровня', 180, 'levels', '🔥', False),
+    ('level_19', 'На пороге божественности', 'Достигнуть 19-го уровня', 200, 'levels', '🔥', False),
+    ('level_20', 'Живая легенда', 'Достигнуть максимального 20-го уровня', 250, 'levels', '👑', False),
+    
+    # Достижения за урон
+    ('damage_30', 'Сокрушительный удар', 'Нанести 30+ урона одним действием', 25, 'combat', '💥', False),
+    ('damage_50', 'Испепеляющая мощь', 'Нанести 50+ урона одним действием', 50, 'combat', '🔥', False),
+    ('damage_100', 'Апокалипсис в миниатюре', 'Нанести 100+ урона одним действием', 100, 'combat', '☄️', True),
+    
+    # Достижения за массовые убийства
+    ('multikill_3', 'Тройное убийство', 'Убить 3 врагов одним действием', 40, 'combat', '⚔️', False),
+    ('multikill_5', 'Пентакилл', 'Убить 5 врагов одним действием', 80, 'combat', '🗡️', True),
+    
+    # Достижения за максимальные характеристики
+    ('max_strength', 'Сила титана', 'Довести Силу до 20', 50, 'stats', '💪', False),
+    ('max_dexterity', 'Грация кошки', 'Довести Ловкость до 20', 50, 'stats', '🏃', False),
+    ('max_constitution', 'Несокрушимый', 'Довести Телосложение до 20', 50, 'stats', '🛡️', False),
+    ('max_intelligence', 'Гений', 'Довести Интеллект до 20', 50, 'stats', '🧠', False),
+    ('max_wisdom', 'Мудрец', 'Довести Мудрость до 20', 50, 'stats', '🦉', False),
+    ('max_charisma', 'Харизматичный лидер', 'Довести Харизму до 20', 50, 'stats', '👑', False),
+    
+    # Достижение за смерть
+    ('character_death', 'Героическая смерть', 'Погибнуть в бою', 25, 'special', '💀', False),
+    
+    # Достижение за броню
+    ('armor_class_20', 'Неприступная крепость', 'Иметь класс доспехов 20 или выше', 40, 'defense', '🏰', False),
+    
+    # Достижения за низкие характеристики
+    ('dump_strength', 'Хилый', 'Создать персонажа с Силой ниже 5', 15, 'funny', '🦴', True),
+    ('dump_dexterity', 'Неуклюжий', 'Создать персонажа с Ловкостью ниже 5', 15, 'funny', '🦥', True),
+    ('dump_constitution', 'Хрупкий', 'Создать персонажа с Телосложением ниже 5', 15, 'funny', '🍃', True),
+    ('dump_intelligence', 'Простодушный', 'Создать персонажа с Интеллектом ниже 5', 15, 'funny', '🪨', True),
+    ('dump_wisdom', 'Наивный', 'Создать персонажа с Мудростью ниже 5', 15, 'funny', '🙈', True),
+    ('dump_charisma', 'Отталкивающий', 'Создать персонажа с Харизмой ниже 5', 15, 'funny', '🦨', True),
+    
+    # Дополнительные интересные достижения
+    ('first_character', 'Добро пожаловать!', 'Создать первого персонажа', 5, 'special', '👋', False),
+    ('first_kill', 'Первая кровь', 'Убить первого врага', 10, 'combat', '🗡️', False),
+    ('first_spell', 'Начинающий маг', 'Использовать первое заклинание', 10, 'magic', '✨', False),
+    ('critical_hit', 'Критический успех!', 'Нанести критический удар', 15, 'combat', '🎯', False),
+    ('critical_miss', 'Эпический провал', 'Критически промахнуться', 10, 'funny', '😅', True),
+    ('survivor', 'Выживший', 'Выжить с 1 HP', 30, 'special', '🍀', True),
+    ('glass_cannon', 'Стеклянная пушка', 'Иметь максимальную атаку и минимальную защиту', 25, 'funny', '💎', True),
+    ('tank', 'Живой щит', 'Получить 100+ урона за одно приключение и выжить', 35, 'defense', '🛡️', True),
+    ('pacifist', 'Пацифист', 'Завершить бой без нанесения урона', 30, 'special', '☮️', True),
+    ('speedrun', 'Скоростной забег', 'Победить врага за один ход', 20, 'combat', '⚡', False),
+    ('unlucky', 'Невезучий', 'Выбросить 1 на d20 три раза подряд', 25, 'funny', '🎲', True),
+    ('lucky', 'Везунчик', 'Выбросить 20 на d20 три раза подряд', 50, 'special', '🍀', True),
+]
+
+
+# --- Миграции ---------------------------------------------------------------
+
+def _add_hot_lookup_indexes(db) -> bool:
+    """Составные индексы под горячие запросы grok_api, combat_manager и action_handler."""
+    indexes = [
+        # history_cache: WHERE adventure_id = ? ORDER BY timestamp, id (id входит во вторичный индекс InnoDB)
+        ('chat_history', 'idx_chat_history_adventure_ts', 'adventure_id, timestamp'),
+        # combat_manager: WHERE adventure_id = ? ORDER BY turn_order
+        ('combat_participants', 'idx_combat_participants_turn', 'adventure_id, turn_order'),
+        # поиск персонажей игрока: WHERE user_id = ? AND is_active = TRUE
+        ('characters', 'idx_characters_user_active', 'user_id, is_active'),
+        # активное приключение чата: WHERE chat_id = ? AND status = ?
+        ('adventures', 'idx_adventures_chat_status', 'chat_id, status'),
+    ]
+
+    # Живые враги: WHERE adventure_id = ? AND <hp> > 0. В разных версиях
+    # схемы HP врага хранится в hit_points или current_hp - индексируем оба.
+    for hp_column in ('hit_points', 'current_hp'):
+        if _column_exists(db, 'enemies', hp_column):
+            indexes.append(('enemies', f'idx_enemies_adventure_{hp_column}', f'adventure_id, {hp_column}'))
+
+    for table, index, columns in indexes:
+        if not _table_exists(db, table):
+            logger.warning(f"MIGRATION: table {table} not found, skipping {index}")
+            continue
+        if not _create_index(db, table, index, columns):
+            return False
+    return True
+
+
+def _add_weapon_technique(db) -> bool:
+    """Колонка weapons.technique (бывший add_technique_column.py)."""
+    return _add_column(db, 'weapons', 'technique', "VARCHAR(50) DEFAULT 'Нет'")
+
+
+def _add_class_saving_throws(db) -> bool:
+    """Владение спасбросками классов (бывший add_saving_throw_proficiencies.py)."""
+    if not _add_column(db, 'classes', 'saving_throw_proficiencies',
+                       "TEXT COMMENT 'JSON массив с названиями характеристик для спасбросков'"):
+        return False
+    result = db.execute_many(
+        "UPDATE classes SET saving_throw_proficiencies = %s WHERE name = %s",
+        [(json.dumps(proficiencies, ensure_ascii=False), class_name)
+         for class_name, proficiencies in CLASS_SAVING_THROWS.items()]
+    )
+    return result is not None
+
+
+def _create_achievement_tables(db) -> bool:
+    """Таблицы и справочник достижений (бывший create_achievements_tables.py)."""
+    queries = [
+        """
+        CREATE TABLE IF NOT EXISTS achievements (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            code VARCHAR(100) UNIQUE NOT NULL COMMENT 'Уникальный код достижения',
+            name VARCHAR(200) NOT NULL COMMENT 'Название достижения',
+            description TEXT COMMENT 'Описание достижения',
+            points INT NOT NULL DEFAULT 10 COMMENT 'Очки за достижение',
+            category VARCHAR(50) COMMENT 'Категория достижения',
+            icon VARCHAR(10) DEFAULT '🏆' COMMENT 'Эмодзи иконка',
+            is_hidden BOOLEAN DEFAULT FALSE COMMENT 'Скрытое достижение',
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        ) COMMENT='Справочник достижений'
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS user_achievements (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            user_id BIGINT NOT NULL COMMENT 'ID пользователя Telegram',
+            achievement_id INT NOT NULL,
+            achieved_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            character_name VARCHAR(100) COMMENT 'Имя персонажа при получении',
+            details TEXT COMMENT 'Дополнительные детали получения',
+            FOREIGN KEY (achievement_id) REFERENCES achievements(id) ON DELETE CASCADE,
+            UNIQUE KEY unique_user_achievement (user_id, achievement_id),
+            INDEX idx_user_id (user_id),
+            INDEX idx_achieved_at (achieved_at)
+        ) COMMENT='Достижения пользователей'
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS achievement_progress (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            user_id BIGINT NOT NULL,
+            achievement_code VARCHAR(100) NOT NULL,
+            progress INT DEFAULT 0,
+            target INT DEFAULT 1,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+            UNIQUE KEY unique_user_progress (user_id, achievement_code),
+            INDEX idx_user_progress (user_id)
+        ) COMMENT='Прогресс к достижениям'
+        """,
+    ]
+    for query in queries:
+        if db.execute_query(query) is None:
+            return False
+
+    result = db.execute_many("""
+        INSERT INTO achievements (code, name, description, points, category, icon, is_hidden)
+        VALUES (%s, %s, %s, %s, %s, %s, %s)
+        ON DUPLICATE KEY UPDATE
+            name = VALUES(name),
+            description = VALUES(description),
+            points = VALUES(points),
+            category = VALUES(category),
+            icon = VALUES(icon),
+            is_hidden = VALUES(is_hidden)
+    """, ACHIEVEMENTS)
+    return result is not None
+
+
+def _create_combat_tables(db) -> bool:
+    """Служебные таблицы боя (раньше combat_achievements.ensure_tables() на каждом ударе)."""
+    queries = [
+        """
+        CREATE TABLE IF NOT EXISTS combat_state (
+            adventure_id INT PRIMARY KEY,
+            round INT NOT NULL DEFAULT 1,
+            started_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS combat_metrics (
+            adventure_id INT NOT NULL,
+            character_id INT NOT NULL,
+            damage_dealt INT NOT NULL DEFAULT 0,
+            damage_taken INT NOT NULL DEFAULT 0,
+            kills INT NOT NULL DEFAULT 0,
+            PRIMARY KEY (adventure_id, character_id)
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+        """,
+    ]
+    return all(db.execute_query(query) is not None for query in queries)
+
+
+def _add_spell_saving_throw(db) -> bool:
+    """Колонка spells.saving_throw (бывший add_saving_throw_to_spells.py; данные заполняет import_all_spells.py)."""
+    return _add_column(db, 'spells', 'saving_throw',
+                       "VARCHAR(20) DEFAULT NULL COMMENT 'Тип спасброска: Сила, Ловкость, Телосложение, Интеллект, Мудрость, Харизма'")
+
+
+def _create_spell_scaling_tables(db) -> bool:
+    """Схема усиления заклинаний (бывший add_spell_scaling_system.py; данные заполняют import_all_spells.py и populate_spell_scaling_ru.py)."""
+    if not _add_column(db, 'spells', 'scaling_type',
+                       "VARCHAR(50) DEFAULT NULL COMMENT 'Тип усиления: cantrip_damage, slot_damage, slot_duration, slot_targets, etc.'"):
+        return False
+    if not _add_column(db, 'spells', 'base_scaling_info',
+                       "TEXT DEFAULT NULL COMMENT 'JSON с базовой информацией об усилении'"):
+        return False
+
+    queries = [
+        """
+        CREATE TABLE IF NOT EXISTS cantrip_scaling (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            spell_id INT NOT NULL,
+            character_level INT NOT NULL,
+            damage_dice VARCHAR(50) COMMENT 'Кости урона на этом уровне, например 2d10',
+            num_beams INT DEFAULT NULL COMMENT 'Количество лучей/снарядов (для Eldritch Blast и т.п.)',
+            other_effects TEXT DEFAULT NULL COMMENT 'JSON с другими эффектами усиления',
+            FOREIGN KEY (spell_id) REFERENCES spells(id) ON DELETE CASCADE,
+            UNIQUE KEY unique_cantrip_level (spell_id, character_level)
+        ) COMMENT='Усиление заговоров в зависимости от уровня персонажа'
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS spell_slot_scaling (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            spell_id INT NOT NULL,
+            slot_level INT NOT NULL COMMENT 'Уровень слота (от минимального уровня заклинания до 9)',
+            damage_bonus VARCHAR(50) DEFAULT NULL COMMENT 'Дополнительный урон, например +1d6',
+            duration_bonus VARCHAR(100) DEFAULT NULL COMMENT 'Дополнительная длительность',
+            target_bonus INT DEFAULT NULL COMMENT 'Дополнительные цели',
+            other_effects TEXT DEFAULT NULL COMMENT 'JSON с другими эффектами усиления',
+            FOREIGN KEY (spell_id) REFERENCES spells(id) ON DELETE CASCADE,
+            UNIQUE KEY unique_spell_slot (spell_id, slot_level)
+        ) COMMENT='Усиление заклинаний при использовании слотов высокого уровня'
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS spell_scaling_rules (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            spell_id INT NOT NULL,
+            rule_type VARCHAR(50) NOT NULL COMMENT 'Тип правила: damage_per_slot, healing_per_slot, etc.',
+            rule_value VARCHAR(100) NOT NULL COMMENT 'Значение правила, например 1d8',
+            rule_description TEXT COMMENT 'Текстовое описание правила',
+            FOREIGN KEY (spell_id) REFERENCES spells(id) ON DELETE CASCADE
+        ) COMMENT='Специальные правила усиления заклинаний'
+        """,
+    ]
+    return all(db.execute_query(query) is not None for query in queries)
+
+
+def _create_adventure_summaries(db) -> bool:
+    """Сжатое содержание старых ходов приключения (conversation_context.py)."""
+    result = db.execute_query("""
+        CREATE TABLE IF NOT EXISTS adventure_summaries (
+            adventure_id INT PRIMARY KEY,
+            summary TEXT NOT NULL,
+            summarized_messages INT NOT NULL DEFAULT 0 COMMENT 'Сколько сообщений chat_history (после system) свернуто в summary',
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+            FOREIGN KEY (adventure_id) REFERENCES adventures(id) ON DELETE CASCADE
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+    """)
+    return result is not None
+
+
+MIGRATIONS: List[Migration] = [
+    Migration(1, "secondary indexes on hot lookup columns", _add_hot_lookup_indexes),
+    Migration(2, "weapons.technique column", _add_weapon_technique),
+    Migration(3, "class saving throw proficiencies", _add_class_saving_throws),
+    Migration(4, "achievements tables and catalogue", _create_achievement_tables),
+    Migration(5, "combat state and metrics tables", _create_combat_tables),
+    Migration(6, "spells.saving_throw column", _add_spell_saving_throw, requires=('spells',)),
+    Migration(7, "spell scaling tables", _create_spell_scaling_tables, requires=('spells',)),
+    Migration(8, "adventure history summaries", _create_adventure_summaries),
+]
+
+
+# --- Запуск -----------------------------------------------------------------
+
+def _ensure_version_table(db) -> bool:
+    return db.execute_query("""
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INT PRIMARY KEY,
+            description VARCHAR(255),
+            applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+    """) is not None
+
+
+def get_schema_version(db) -> int:
+    """Номер последней примененной миграции (0, если миграций не было)."""
+    result = db.execute_query("SELECT MAX(version) AS version FROM schema_version")
+    return (result[0]['version'] or 0) if result else 0
+
+
+def pending_migrations(db) -> List[Migration]:
+    """Миграции, которые еще не применены к базе."""
+    current = get_schema_version(db) if _table_exists(db, 'schema_version') else 0
+    return [m for m in sorted(MIGRATIONS, key=lambda m: m.version) if m.version > current]
+
+
+def apply_migrations(db=None) -> int:
+    """
+    Применяет все еще не примененные миграции по порядку.
+
+    Returns:
+        Текущая версия схемы после применения
+
+    Raises:
+        RuntimeError: если миграция завершилась с ошибкой
+    """
+    if db is None:
+        from database import get_db
+        db = get_db()
+        if not db.connection or not db.connection.is_connected():
+            db.connect()
+
+    if not _ensure_version_table(db):
+        raise RuntimeError("Не удалось создать таблицу schema_version")
+
+    current = get_schema_version(db)
+    for migration in sorted(MIGRATIONS, key=lambda m: m.version):
+        if migration.version <= current:
+            continue
+
+        missing = [table for table in migration.requires if not _table_exists(db, table)]
+        if missing:
+            # Порядок важен: останавливаемся и доприменяем после появления таблиц
+            logger.warning(f"MIGRATION: {migration.version} waits for tables {', '.join(missing)}; "
+                           f"run the import scripts and restart")
+            break
+
+        logger.info(f"MIGRATION: applying {migration.version} - {migration.description}")
+        if not migration.apply(db):
+            raise RuntimeError(f"Миграция {migration.version} ({migration.description}) не применена")
+
+        db.execute_query(
+            "INSERT INTO schema_version (version, description) VALUES (%s, %s)",
+            (migration.version, migration.description)
+        )
+        current = migration.version
+
+    logger.info(f"MIGRATION: schema is at version {current}")
+    return current
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    print(f"Schema version: {apply_migrations()}")
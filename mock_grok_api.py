@@ -1,186 +1,388 @@
 #!/usr/bin/env python3
 """
-Mock Grok API Server for debugging DnD Bot
+Mock Grok API Server for debugging and load-testing DnD Bot
 Запуск: python mock_grok_api.py
+
+Асинхронный сервер на aiohttp: ответы загружаются в память при старте,
+задержка берется из распределения (fixed, lognormal или replay из архива
+llm_recorder), ошибки 429/500 и зависания внедряются с заданной вероятностью,
+GET /stats показывает частоту запросов и задержки. Настройки - переменные
+окружения MOCK_* (см. MOCK_API_README.md) или POST /config во время работы.
 """
 
-from flask import Flask, request, jsonify
+import asyncio
 import json
-import os
 import logging
+import math
+import os
+import random
+import re
+import time
+from collections import Counter, deque
+
+from aiohttp import web
+
+from llm_recorder import read_archive, request_hash
 
-app = Flask(__name__)
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 # Путь к файлам с ответами
 RESPONSES_DIR = "mock_responses"
 
-def load_response_file(filename):
-    """Загружает ответ из файла"""
-    file_path = os.path.join(RESPONSES_DIR, filename)
-    if os.path.exists(file_path):
-        with open(file_path, 'r', encoding='utf-8') as f:
-            return f.read().strip()
-    return None
+# Настройки; все можно поменять на ходу через POST /config
+SETTINGS = {
+    # Потоковый режим ("stream": true): по сколько слов в чанке и пауза между чанками
+    'stream_chunk_words': int(os.environ.get('MOCK_STREAM_CHUNK_WORDS', 3)),
+    'stream_chunk_delay': float(os.environ.get('MOCK_STREAM_CHUNK_DELAY', 0.05)),
+    # Задержка до ответа (до первого чанка в потоке): fixed, lognormal или replay
+    'latency': os.environ.get('MOCK_LATENCY', 'fixed'),
+    'latency_ms': float(os.environ.get('MOCK_LATENCY_MS', 0)),  # fixed - значение, lognormal - медиана
+    'latency_sigma': float(os.environ.get('MOCK_LATENCY_SIGMA', 0.5)),  # разброс lognormal
+    'latency_scale': float(os.environ.get('MOCK_LATENCY_SCALE', 1.0)),  # множитель для replay
+    # Внедрение ошибок: вероятности от 0 до 1
+    'error_429': float(os.environ.get('MOCK_ERROR_429', 0)),
+    'error_500': float(os.environ.get('MOCK_ERROR_500', 0)),
+    'error_timeout': float(os.environ.get('MOCK_ERROR_TIMEOUT', 0)),
+    'retry_after': float(os.environ.get('MOCK_RETRY_AFTER', 1)),  # секунд в заголовке Retry-After
+    'timeout_seconds': float(os.environ.get('MOCK_TIMEOUT_SECONDS', 300)),  # сколько "висит" запрос
+}
+
+# Архив записанного трафика (llm_recorder): ответы по хэшу запроса и их задержки
+REPLAY_ARCHIVE = os.environ.get('MOCK_REPLAY_ARCHIVE', '')
+
+STATS_WINDOW = 60  # секунд истории для частоты запросов
+LATENCY_SAMPLES = 1000
+
+
+class MockState:
+    """Ответы в памяти и статистика сервера."""
+
+    def __init__(self):
+        self.responses = {}
+        self.recorded = {}  # хэш запроса -> записи архива
+        self.recorded_latencies = []
+        self.started_at = time.monotonic()
+        self.requests = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.arrivals = deque()  # время поступления запросов за последние STATS_WINDOW секунд
+        self.statuses = Counter()
+        self.selected = Counter()
+        self.latencies = deque(maxlen=LATENCY_SAMPLES)
+
+    def load(self):
+        if os.path.exists(RESPONSES_DIR):
+            for filename in sorted(os.listdir(RESPONSES_DIR)):
+                if filename.endswith('.txt'):
+                    with open(os.path.join(RESPONSES_DIR, filename), 'r', encoding='utf-8') as f:
+                        self.responses[filename] = f.read().strip()
+        logger.info(f"Loaded {len(self.responses)} response files into memory: {list(self.responses)}")
+        if REPLAY_ARCHIVE:
+            for entry in read_archive(REPLAY_ARCHIVE):
+                self.recorded.setdefault(entry['hash'], []).append(entry)
+                self.recorded_latencies.append(entry['latency'])
+            logger.info(f"Loaded {len(self.recorded_latencies)} recorded responses from {REPLAY_ARCHIVE}")
+
+    def arrived(self):
+        now = time.monotonic()
+        self.requests += 1
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        self.arrivals.append(now)
+        while self.arrivals and self.arrivals[0] < now - STATS_WINDOW:
+            self.arrivals.popleft()
+
+    def finished(self, status, started):
+        self.in_flight -= 1
+        self.statuses[status] += 1
+        self.latencies.append(time.monotonic() - started)
+
+    def stats(self):
+        now = time.monotonic()
+        recent = [t for t in self.arrivals if t >= now - STATS_WINDOW]
+        last_10s = sum(1 for t in recent if t >= now - 10)
+        latencies = sorted(self.latencies)
+
+        def percentile(p):
+            return round(latencies[min(len(latencies) - 1, int(len(latencies) * p))], 3) if latencies else 0.0
+
+        return {
+            "uptime_seconds": round(now - self.started_at, 1),
+            "requests": self.requests,
+            "in_flight": self.in_flight,
+            "max_in_flight": self.max_in_flight,
+            "rps_10s": round(last_10s / 10, 2),
+            "rps_60s": round(len(recent) / STATS_WINDOW, 2),
+            "statuses": dict(self.statuses),
+            "responses": dict(self.selected),
+            "latency_seconds": {"p50": percentile(0.5), "p95": percentile(0.95), "p99": percentile(0.99),
+                                "max": round(latencies[-1], 3) if latencies else 0.0},
+            "settings": SETTINGS,
+        }
+
+
+state = MockState()
+
 
 def get_mock_response(request_data):
-    """Определяет какой файл использовать для ответа на основе запроса"""
-    
+    """Определяет какой ответ использовать на основе запроса: (имя, текст, запись архива или None)"""
+    if state.recorded:
+        entries = state.recorded.get(request_hash(request_data))
+        if entries:
+            entry = random.choice(entries)
+            return 'recorded', entry['content'], entry
+
     # Получаем последнее сообщение пользователя
     messages = request_data.get('messages', [])
     if not messages:
-        return load_response_file('default.txt')
-    
-    last_message = messages[-1].get('content', '').lower()
-    
-    # Определяем тип запроса и возвращаем соответствующий ответ
-    if 'создай захватывающее вступление' in last_message:
-        return load_response_file('adventure_intro.txt')
-    elif 'действия игроков' in last_message:
-        # Проверяем есть ли в действиях что-то связанное с боем
-        if any(word in last_message for word in ['атака', 'напада', 'сражени', 'бой', 'враг', 'монстр']):
-            return load_response_file('combat_start.txt')
-        else:
-            return load_response_file('continue_adventure.txt')
-    elif 'сражение завершено' in last_message:
-        return load_response_file('combat_end.txt')
+        name = 'default.txt'
     else:
-        return load_response_file('default.txt')
+        last_message = messages[-1].get('content', '').lower()
+
+        # Определяем тип запроса и возвращаем соответствующий ответ
+        if 'создай захватывающее вступление' in last_message:
+            name = 'adventure_intro.txt'
+        elif 'действия игроков' in last_message:
+            # Проверяем есть ли в действиях что-то связанное с боем
+            if any(word in last_message for word in ['атака', 'напада', 'сражени', 'бой', 'враг', 'монстр']):
+                # Бот в режиме GROK_COMBAT_FORMAT = 'json' просит врагов JSON-объектом
+                system_prompt = messages[0].get('content', '') if messages[0].get('role') == 'system' else ''
+                name = 'combat_start_json.txt' if '"enemies"' in system_prompt else 'combat_start.txt'
+            else:
+                name = 'continue_adventure.txt'
+        elif 'сражение завершено' in last_message:
+            name = 'combat_end.txt'
+        else:
+            name = 'default.txt'
+    return name, state.responses.get(name), None
+
+
+def sample_latency(entry=None):
+    """Задержка до ответа в секундах по выбранному распределению"""
+    mode = SETTINGS['latency']
+    if mode == 'replay':
+        if entry is not None:
+            latency = entry.get('first_token_latency') or entry['latency']
+        elif state.recorded_latencies:
+            latency = random.choice(state.recorded_latencies)
+        else:
+            latency = 0.0
+        return latency * SETTINGS['latency_scale']
+    median = SETTINGS['latency_ms'] / 1000
+    if mode == 'lognormal' and median > 0:
+        return random.lognormvariate(math.log(median), SETTINGS['latency_sigma'])
+    return median
+
+
+def completion(response_content):
+    """Ответ в формате OpenAI API"""
+    return {
+        "id": "mock-response-123",
+        "object": "chat.completion",
+        "created": 1234567890,
+        "model": "mock-grok",
+        "choices": [
+            {
+                "index": 0,
+                "message": {
+                    "role": "assistant",
+                    "content": response_content
+                },
+                "finish_reason": "stop"
+            }
+        ],
+        "usage": {
+            "prompt_tokens": 100,
+            "completion_tokens": len(response_content.split()),
+            "total_tokens": 100 + len(response_content.split())
+        }
+    }
+
+
+async def stream_response(request, response_content):
+    """Отдает ответ как SSE-поток chat.completion.chunk, как это делает Grok API"""
+    response = web.StreamResponse(headers={'Content-Type': 'text/event-stream', 'Cache-Control': 'no-cache'})
+    await response.prepare(request)
+
+    async def sse(delta, finish_reason=None):
+        chunk = {
+            "id": "mock-response-123",
+            "object": "chat.completion.chunk",
+            "created": 1234567890,
+            "model": "mock-grok",
+            "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}]
+        }
+        await response.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode('utf-8'))
+
+    await sse({"role": "assistant"})
+    # Слова вместе с пробелами и переводами строк, чтобы текст собрался байт в байт
+    tokens = re.findall(r'\S+\s*|\s+', response_content)
+    words = max(1, SETTINGS['stream_chunk_words'])
+    for i in range(0, len(tokens), words):
+        await sse({"content": "".join(tokens[i:i + words])})
+        if SETTINGS['stream_chunk_delay'] > 0:
+            await asyncio.sleep(SETTINGS['stream_chunk_delay'])
+    await sse({}, finish_reason="stop")
+    await response.write(b"data: [DONE]\n\n")
+    await response.write_eof()
+    return response
+
 
-@app.route('/v1/chat/completions', methods=['POST', 'OPTIONS'])
-def chat_completions():
+def error_response(status, message, headers=None):
+    return web.json_response({"error": {"message": message, "type": "mock_injected_error"}},
+                             status=status, headers=headers)
+
+
+async def chat_completions(request):
     """Эндпоинт, совместимый с OpenAI API"""
-    # Handle CORS preflight
-    if request.method == 'OPTIONS':
-        return jsonify({"status": "ok"})
-        
+    started = time.monotonic()
+    state.arrived()
+    status = 200
     try:
-        request_data = request.get_json()
-        
+        try:
+            request_data = await request.json()
+        except ValueError:
+            request_data = None
         if not request_data:
             logger.error("No JSON data received")
-            return jsonify({"error": "No JSON data provided"}), 400
-        
-        logger.info(f"Received request with {len(request_data.get('messages', []))} messages")
-        logger.info(f"Request data keys: {list(request_data.keys())}")
-        
+            status = 400
+            return web.json_response({"error": "No JSON data provided"}, status=400)
+
+        logger.debug(f"Received request with {len(request_data.get('messages', []))} messages")
+
+        # Внедряемые ошибки
+        roll = random.random()
+        if roll < SETTINGS['error_429']:
+            status = 429
+            return error_response(429, "Rate limit exceeded", {"Retry-After": f"{SETTINGS['retry_after']:g}"})
+        roll -= SETTINGS['error_429']
+        if roll < SETTINGS['error_500']:
+            status = 500
+            return error_response(500, "Internal server error")
+        roll -= SETTINGS['error_500']
+        if roll < SETTINGS['error_timeout']:
+            # Клиент должен сам оборвать запрос по таймауту
+            status = 504
+            await asyncio.sleep(SETTINGS['timeout_seconds'])
+            return error_response(504, "Gateway timeout")
+
         # Получаем подходящий ответ
-        response_content = get_mock_response(request_data)
-        
+        name, response_content, entry = get_mock_response(request_data)
         if response_content is None:
             response_content = "Произошла ошибка при загрузке mock ответа. Проверьте файлы в папке mock_responses."
-        
-        logger.info(f"Selected response file, returning response with {len(response_content)} characters")
-        
-        # Формируем ответ в формате OpenAI API
-        response = {
-            "id": "mock-response-123",
-            "object": "chat.completion", 
-            "created": 1234567890,
-            "model": "mock-grok",
-            "choices": [
-                {
-                    "index": 0,
-                    "message": {
-                        "role": "assistant",
-                        "content": response_content
-                    },
-                    "finish_reason": "stop"
-                }
-            ],
-            "usage": {
-                "prompt_tokens": 100,
-                "completion_tokens": len(response_content.split()),
-                "total_tokens": 100 + len(response_content.split())
-            }
-        }
-        
-        return jsonify(response), 200
-        
+        state.selected[name] += 1
+
+        latency = sample_latency(entry)
+        if latency > 0:
+            await asyncio.sleep(latency)
+
+        logger.info(f"Selected {name}, returning {len(response_content)} characters after {latency:.2f}s")
+        if request_data.get('stream'):
+            return await stream_response(request, response_content)
+        return web.json_response(completion(response_content), dumps=lambda d: json.dumps(d, ensure_ascii=False))
+
+    except (asyncio.CancelledError, ConnectionResetError):
+        # Клиент закрыл соединение (таймаут на его стороне)
+        status = 499
+        raise
     except Exception as e:
-        logger.error(f"Error processing request: {e}")
-        import traceback
-        logger.error(f"Traceback: {traceback.format_exc()}")
-        return jsonify({"error": str(e)}), 500
+        logger.exception(f"Error processing request: {e}")
+        status = 500
+        return web.json_response({"error": str(e)}, status=500)
+    finally:
+        state.finished(status, started)
 
-@app.route('/health', methods=['GET'])
-def health():
+
+async def health(request):
     """Проверка здоровья сервера"""
-    return jsonify({"status": "ok", "service": "mock-grok-api"})
+    return web.json_response({"status": "ok", "service": "mock-grok-api"})
+
+
+async def list_responses(request):
+    """Список загруженных ответов"""
+    return web.json_response({"available_responses": list(state.responses),
+                              "recorded_requests": len(state.recorded)})
+
+
+async def stats(request):
+    """Частота запросов, коды ответов и задержки"""
+    return web.json_response(state.stats())
+
+
+async def update_config(request):
+    """Меняет настройки на ходу: POST /config {"error_429": 0.1, "latency": "lognormal", ...}"""
+    try:
+        changes = await request.json()
+    except ValueError:
+        return web.json_response({"error": "JSON object expected"}, status=400)
+    unknown = [key for key in changes if key not in SETTINGS]
+    if unknown:
+        return web.json_response({"error": f"unknown settings: {unknown}"}, status=400)
+    for key, value in changes.items():
+        SETTINGS[key] = type(SETTINGS[key])(value)
+    logger.info(f"Settings updated: {changes}")
+    return web.json_response(SETTINGS)
 
-@app.route('/responses', methods=['GET'])
-def list_responses():
-    """Список available response files"""
-    if not os.path.exists(RESPONSES_DIR):
-        return jsonify({"error": "responses directory not found"})
-    
-    files = [f for f in os.listdir(RESPONSES_DIR) if f.endswith('.txt')]
-    return jsonify({"available_responses": files})
 
-@app.route('/', methods=['GET'])
-def root():
+async def root(request):
     """Корневая страница"""
-    return jsonify({
+    return web.json_response({
         "service": "Mock Grok API",
         "status": "running",
         "endpoints": {
-            "POST /v1/chat/completions": "Main API endpoint",
-            "GET /health": "Health check", 
-            "GET /responses": "List response files"
+            "POST /v1/chat/completions": "Main API endpoint (supports \"stream\": true)",
+            "GET /health": "Health check",
+            "GET /responses": "List loaded responses",
+            "GET /stats": "Request rate, status codes and latency percentiles",
+            "POST /config": "Change latency, streaming and error injection settings"
         }
     })
 
-@app.errorhandler(404)
-def not_found(error):
+
+@web.middleware
+async def not_found(request, handler):
     """Обработчик 404 ошибок"""
-    logger.warning(f"404 Not Found: {request.method} {request.path}")
-    return jsonify({
-        "status": "error",
-        "message": "Not found",
-        "path": request.path,
-        "method": request.method,
-        "available_endpoints": [
-            "POST /v1/chat/completions",
-            "GET /health",
-            "GET /responses",
-            "GET /"
-        ]
-    }), 404
-
-@app.before_request
-def log_request_info():
-    """Логируем все входящие запросы"""
-    logger.info(f"Incoming request: {request.method} {request.path} from {request.remote_addr}")
-    if request.is_json:
-        logger.info(f"Request has JSON data: {bool(request.get_json())}")
+    try:
+        return await handler(request)
+    except web.HTTPNotFound:
+        logger.warning(f"404 Not Found: {request.method} {request.path}")
+        return web.json_response({
+            "status": "error",
+            "message": "Not found",
+            "path": request.path,
+            "method": request.method,
+            "available_endpoints": [
+                "POST /v1/chat/completions",
+                "GET /health",
+                "GET /responses",
+                "GET /stats",
+                "POST /config",
+                "GET /"
+            ]
+        }, status=404)
+
+
+def create_app():
+    app = web.Application(middlewares=[not_found])
+    app.router.add_post('/v1/chat/completions', chat_completions)
+    app.router.add_get('/health', health)
+    app.router.add_get('/responses', list_responses)
+    app.router.add_get('/stats', stats)
+    app.router.add_post('/config', update_config)
+    app.router.add_get('/', root)
+    return app
+
 
 if __name__ == '__main__':
     # Создаем папку для ответов если её нет
     if not os.path.exists(RESPONSES_DIR):
         os.makedirs(RESPONSES_DIR)
         logger.info(f"Created {RESPONSES_DIR} directory")
-    
-    # Проверяем наличие файлов ответов
-    logger.info(f"Checking responses directory: {os.path.abspath(RESPONSES_DIR)}")
-    if os.path.exists(RESPONSES_DIR):
-        files = [f for f in os.listdir(RESPONSES_DIR) if f.endswith('.txt')]
-        logger.info(f"Found response files: {files}")
-    else:
-        logger.warning(f"Responses directory does not exist: {RESPONSES_DIR}")
-    
-    # Показываем зарегистрированные маршруты
-    logger.info("Registered routes:")
-    for rule in app.url_map.iter_rules():
-        logger.info(f"  {rule.methods} {rule.rule}")
-    
-    port = 5001  # Используем другой порт для теста
+
+    state.load()
+
+    port = int(os.environ.get('MOCK_PORT', 5001))  # Используем другой порт для теста
     logger.info(f"Starting Mock Grok API server on http://localhost:{port}")
-    logger.info(f"Responses directory: {RESPONSES_DIR}")
-    logger.info("Available endpoints:")
-    logger.info("  POST /v1/chat/completions - Main API endpoint")
-    logger.info("  GET /health - Health check")
-    logger.info("  GET /responses - List available response files")
-    logger.info("  GET / - Root endpoint")
-    
-    app.run(host='0.0.0.0', port=port, debug=True)
+    logger.info(f"Settings: {SETTINGS}")
+    web.run_app(create_app(), host='0.0.0.0', port=port, access_log=None)
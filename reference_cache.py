@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Кэш справочных таблиц (правила D&D): расы, классы, происхождения, доспехи,
+оружие, заклинания, уровни, слоты заклинаний и усиление заклинаний.
+
+Таблицы меняются только скриптами импорта, поэтому загружаются один раз
+и дальше отдаются из памяти без SQL. После запуска скриптов импорта кэш
+нужно сбросить через invalidate() (в боте - команда /reloaddata).
+"""
+
+import json
+import logging
+import threading
+from collections import Counter
+from types import MappingProxyType
+from typing import Dict, Iterable, Optional, Tuple
+
+from database import get_db
+
+logger = logging.getLogger(__name__)
+
+# Запросы загрузки справочников; порядок строк задает порядок в all()
+REFERENCE_TABLES = {
+    'races': "SELECT * FROM races ORDER BY name",
+    'classes': "SELECT * FROM classes ORDER BY name",
+    'origins': "SELECT * FROM origins ORDER BY name",
+    'armor': "SELECT * FROM armor ORDER BY id",
+    'weapons': "SELECT * FROM weapons ORDER BY id",
+    'spells': "SELECT * FROM spells ORDER BY level, name",
+    'levels': "SELECT * FROM levels ORDER BY level",
+    'class_spell_slots': "SELECT * FROM class_spell_slots ORDER BY class_id, level",
+    'cantrip_scaling': "SELECT * FROM cantrip_scaling ORDER BY spell_id, character_level",
+    'spell_slot_scaling': "SELECT * FROM spell_slot_scaling ORDER BY spell_id, slot_level",
+    'spell_scaling_rules': "SELECT * FROM spell_scaling_rules ORDER BY spell_id",
+}
+
+
+def _has_class(available_classes, class_name: str) -> bool:
+    """Аналог JSON_CONTAINS(available_classes, '"Класс"') с запасным вариантом LIKE."""
+    if not available_classes:
+        return False
+    if isinstance(available_classes, (list, tuple)):
+        return class_name in available_classes
+    try:
+        classes = json.loads(available_classes)
+        if isinstance(classes, list):
+            return class_name in classes
+    except (TypeError, ValueError):
+        pass
+    return f'"{class_name}"' in str(available_classes)
+
+
+class ReferenceTable:
+    """Неизменяемый снимок справочной таблицы с индексами."""
+
+    def __init__(self, name: str, rows: Iterable[dict]):
+        self.name = name
+        self.rows: Tuple[MappingProxyType, ...] = tuple(MappingProxyType(dict(row)) for row in rows)
+
+        by_id = {}
+        by_name = {}
+        for row in self.rows:
+            if 'id' in row:
+                by_id[row['id']] = row
+            if 'name' in row:
+                by_name.setdefault(row['name'], row)
+        self.by_id = MappingProxyType(by_id)
+        self.by_name = MappingProxyType(by_name)
+        self._groups: Dict[Tuple[str, ...], MappingProxyType] = {}
+
+    def group_by(self, *columns: str) -> MappingProxyType:
+        """Индекс {значение(я) колонок: кортеж строк} с сохранением порядка; строится один раз."""
+        index = self._groups.get(columns)
+        if index is None:
+            groups: Dict = {}
+            for row in self.rows:
+                key = row[columns[0]] if len(columns) == 1 else tuple(row[c] for c in columns)
+                groups.setdefault(key, []).append(row)
+            index = MappingProxyType({key: tuple(value) for key, value in groups.items()})
+            self._groups[columns] = index
+        return index
+
+
+class ReferenceCache:
+    """Read-through кэш справочников с ленивой загрузкой и счетчиками попаданий."""
+
+    def __init__(self):
+        self.db = get_db()
+        self._tables: Dict[str, ReferenceTable] = {}
+        # Производные выборки; хранят индекс, из которого построены, чтобы не пережить invalidate()
+        self._derived: Dict[Tuple, Tuple] = {}
+        self._lock = threading.RLock()
+        self.hits = Counter()
+        self.misses = Counter()
+
+    # --- Загрузка и сброс ---------------------------------------------------
+
+    def _table(self, name: str) -> ReferenceTable:
+        table = self._tables.get(name)
+        if table is not None:
+            self.hits[name] += 1
+            return table
+
+        with self._lock:
+            table = self._tables.get(name)
+            if table is not None:
+                self.hits[name] += 1
+                return table
+
+            self.misses[name] += 1
+            if not self.db.connection or not self.db.connection.is_connected():
+                self.db.connect()
+            rows = self.db.execute_query(REFERENCE_TABLES[name])
+            if rows is None:
+                # Ошибка БД (или таблицы еще нет) - не кэшируем, попробуем в следующий раз
+                logger.warning(f"REFERENCE CACHE: failed to load {name}")
+                return ReferenceTable(name, ())
+
+            table = ReferenceTable(name, rows)
+            self._tables[name] = table
+            logger.info(f"REFERENCE CACHE: loaded {name} ({len(table.rows)} rows)")
+            return table
+
+    def _index(self, name: str, *columns: str) -> MappingProxyType:
+        return self._table(name).group_by(*columns)
+
+    def warm_up(self):
+        """Загружает все справочники заранее (при старте бота)."""
+        for name in REFERENCE_TABLES:
+            self._table(name)
+
+    def invalidate(self, *tables: str):
+        """Сбрасывает указанные таблицы (или все) - следующее обращение перечитает их из БД."""
+        with self._lock:
+            names = tables or tuple(self._tables)
+            for name in names:
+                self._tables.pop(name, None)
+        logger.info(f"REFERENCE CACHE: invalidated {', '.join(names) or 'nothing'}")
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        """Счетчики попаданий/промахов по таблицам."""
+        return {
+            name: {
+                'hits': self.hits[name],
+                'misses': self.misses[name],
+                'rows': len(self._tables[name].rows) if name in self._tables else 0,
+            }
+            for name in REFERENCE_TABLES
+        }
+
+    # --- Общие выборки -------------------------------------------------------
+
+    def get(self, table: str, row_id) -> Optional[MappingProxyType]:
+        """Строка справочника по id."""
+        return self._table(table).by_id.get(row_id)
+
+    def get_by_name(self, table: str, name: str) -> Optional[MappingProxyType]:
+        """Строка справочника по названию."""
+        return self._table(table).by_name.get(name)
+
+    def lookup(self, table: str, row_id) -> list:
+        """Строка по id в формате результата execute_query: [row] или []."""
+        row = self.get(table, row_id)
+        return [row] if row is not None else []
+
+    def all(self, table: str) -> Tuple[MappingProxyType, ...]:
+        """Все строки справочника."""
+        return self._table(table).rows
+
+    # --- Уровни ------------------------------------------------------------
+
+    def get_level(self, level: int) -> Optional[MappingProxyType]:
+        return self._index('levels', 'level').get(level, (None,))[0]
+
+    def level_for_xp(self, xp: int) -> int:
+        """Уровень персонажа по опыту: максимальный уровень с experience_required <= xp."""
+        level = 1
+        for row in self.all('levels'):
+            if row['experience_required'] <= xp and row['level'] > level:
+                level = row['level']
+        return level
+
+    def proficiency_bonus(self, level: int) -> int:
+        row = self.get_level(level)
+        return row['proficiency_bonus'] if row else 2
+
+    # --- Заклинания и слоты -------------------------------------------------
+
+    def class_spell_slots(self, class_id: int, level: int) -> Optional[MappingProxyType]:
+        return self._index('class_spell_slots', 'class_id', 'level').get((class_id, level), (None,))[0]
+
+    def spells_for_class(self, class_name: str, level: int) -> Tuple[MappingProxyType, ...]:
+        """Заклинания указанного уровня, доступные классу (по JSON-полю available_classes)."""
+        index = self._index('spells', 'level')
+        cache_key = ('spells_for_class', class_name, level)
+        result = self._derived.get(cache_key)
+        if result is None or result[0] is not index:
+            spells = tuple(spell for spell in index.get(level, ())
+                           if _has_class(spell.get('available_classes'), class_name))
+            result = (index, tuple(sorted(spells, key=lambda spell: spell['name'])))
+            self._derived[cache_key] = result
+        return result[1]
+
+    def cantrip_scaling(self, spell_id: int, character_level: int) -> Optional[MappingProxyType]:
+        """Ближайшая ступень усиления заговора не выше уровня персонажа."""
+        best = None
+        for row in self._index('cantrip_scaling', 'spell_id').get(spell_id, ()):
+            if row['character_level'] <= character_level:
+                best = row
+        return best
+
+    def spell_slot_scaling(self, spell_id: int, slot_level: int) -> Optional[MappingProxyType]:
+        return self._index('spell_slot_scaling', 'spell_id', 'slot_level').get((spell_id, slot_level), (None,))[0]
+
+    def spell_scaling_rules(self, spell_id: int) -> Tuple[MappingProxyType, ...]:
+        return self._index('spell_scaling_rules', 'spell_id').get(spell_id, ())
+
+
+# Глобальный экземпляр кэша
+reference_cache = ReferenceCache()
@@ -0,0 +1,438 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Разбор ответов Grok за один проход.
+
+Предкомпилированный токенизатор один раз проходит ответ и находит все
+управляющие маркеры (***COMBAT_START***, ***XP_REWARD: N***, ***ADVENTURE_END***),
+а текст после начала боя разбирается построчно на блоки противников
+(ENEMY:, HP:, STR: ... XP:). Результат - ParsedResponse: текст для игроков,
+список врагов, награда опытом и признак конца приключения.
+
+Разбор терпим к отклонениям формата: переводы строк Windows, лишние пробелы,
+регистр ключей, отсутствующие строки ATTACK (атака по умолчанию) и
+модификаторы (считаются по значению характеристики). Модуль не обращается
+к базе данных - сохранение врагов выполняет GrokAPI.
+
+В режиме GROK_COMBAT_FORMAT = 'json' модель после ***COMBAT_START*** присылает
+JSON-объект {"enemies": [...]}, который проверяется по COMBAT_JSON_SCHEMA.
+Если JSON нет или он не проходит проверку, враги разбираются из текста, как
+раньше. Успешность разбора по режимам копится в parse_metrics.
+
+Сравнение со старыми функциями: python benchmark_response_parser.py
+"""
+
+import json
+import logging
+import re
+import threading
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Управляющие маркеры; литеральный префикс *** позволяет движку regex быстро
+# пропускать обычный текст
+MARKER_RE = re.compile(r"\*\*\*[ \t]*(?:(?P<combat>COMBAT_START)|XP_REWARD[ \t]*:[ \t]*(?P<xp_reward>\d+)|(?P<end>ADVENTURE_END))[ \t]*\*\*\*")
+# Строка блока противника: "ENEMY: Гоблин", "**HP:** 7", "- ATTACK: ..."
+FIELD_RE = re.compile(r"[ \t>*`-]*(?P<key>ENEMY|HP|STR|DEX|CON|INT|WIS|CHA|ATTACK|XP)[ \t*]*:[ \t]*(?P<value>.*)", re.IGNORECASE)
+
+# Канонический блок из system prompt целиком - быстрый путь одним regex;
+# все, что в него не укладывается, разбирается построчно (FIELD_RE)
+_STAT = r"(\d+) \(мод: ([+-]?\d+)\)\n"
+CANONICAL_BLOCK_RE = re.compile(
+    r"^ENEMY: (?P<name>[^\n]+)\nHP: (?P<hp>\d+)\n"
+    r"STR: " + _STAT + r"DEX: " + _STAT + r"CON: " + _STAT +
+    r"INT: " + _STAT + r"WIS: " + _STAT + r"CHA: " + _STAT +
+    r"(?P<attacks>(?:ATTACK: [^\n]*\n)*)XP: (?P<xp>\d+)",
+    re.MULTILINE
+)
+
+# "15 (мод: +2)", "15 (+2)", "15"
+STAT_RE = re.compile(r"(-?\d+)(?:\s*\(\s*(?:мод\s*:\s*)?([+-]?)\s*(\d+)\s*\))?", re.IGNORECASE)
+# "Ржавый меч (1d8+2 slashing, бонус к атаке: +4)"
+ATTACK_RE = re.compile(r"(?P<name>.+?)\s*\(\s*(?P<damage>[^,()]+?)\s*(?:,\s*бонус к атаке\s*:\s*(?P<bonus>[+-]?\s*\d+)\s*)?\)", re.IGNORECASE)
+NUMBER_RE = re.compile(r"\d+")
+
+STAT_FIELDS = {
+    'STR': 'strength',
+    'DEX': 'dexterity',
+    'CON': 'constitution',
+    'INT': 'intelligence',
+    'WIS': 'wisdom',
+    'CHA': 'charisma',
+}
+
+DEFAULT_ATTACK = ("Удар", "1d4", 0)
+
+# Формат боевых данных в режиме 'json' (подмножество JSON Schema; текст этой
+# схемы попадает и в system prompt)
+_STAT_SCHEMA = {"type": "integer", "minimum": 1, "maximum": 30}
+COMBAT_JSON_SCHEMA = {
+    "type": "object",
+    "required": ["enemies"],
+    "properties": {
+        "enemies": {
+            "type": "array",
+            "minItems": 1,
+            "items": {
+                "type": "object",
+                "required": ["name", "hp", "str", "dex", "con", "int", "wis", "cha", "xp"],
+                "properties": {
+                    "name": {"type": "string", "minLength": 1},
+                    "hp": {"type": "integer", "minimum": 1},
+                    "str": _STAT_SCHEMA,
+                    "dex": _STAT_SCHEMA,
+                    "con": _STAT_SCHEMA,
+                    "int": _STAT_SCHEMA,
+                    "wis": _STAT_SCHEMA,
+                    "cha": _STAT_SCHEMA,
+                    "xp": {"type": "integer", "minimum": 0},
+                    "attacks": {
+                        "type": "array",
+                        "items": {
+                            "type": "object",
+                            "required": ["name", "damage", "attack_bonus"],
+                            "properties": {
+                                "name": {"type": "string", "minLength": 1},
+                                "damage": {"type": "string", "minLength": 1},
+                                "attack_bonus": {"type": "integer"},
+                            },
+                        },
+                    },
+                },
+            },
+        },
+    },
+}
+
+_JSON_TYPES = {
+    "object": dict,
+    "array": list,
+    "string": str,
+    "integer": int,
+}
+
+
+class ParsedResponse(NamedTuple):
+    text: str  # исходный ответ целиком (сохраняется в историю)
+    clean_text: str  # то, что видят игроки
+    enemies: List[Dict]  # данные врагов в формате таблицы enemies (+ 'attacks')
+    xp_reward: int
+    adventure_ended: bool
+    combat_started: bool
+    enemy_format: str = ""  # откуда взяты враги: 'json', 'text' или '' (боя нет)
+    json_error: Optional[str] = None  # почему JSON-блок боя не принят (если он был)
+
+
+def _parse_stat(value: str) -> Optional[tuple]:
+    match = STAT_RE.match(value.strip())
+    if not match:
+        return None
+    score = int(match.group(1))
+    if match.group(3) is not None:
+        modifier = int(match.group(3)) * (-1 if match.group(2) == '-' else 1)
+    else:
+        modifier = (score - 10) // 2
+    return score, modifier
+
+
+def _parse_attack(value: str) -> tuple:
+    match = ATTACK_RE.match(value.strip())
+    if not match:
+        # "Укус" без скобок - название без урона
+        return value.strip() or DEFAULT_ATTACK[0], DEFAULT_ATTACK[1], 0
+    bonus = match.group('bonus')
+    return (match.group('name').strip(), match.group('damage').strip(),
+            int(bonus.replace(' ', '')) if bonus else 0)
+
+
+def _build_enemy(fields: Dict) -> Optional[Dict]:
+    """Данные врага из собранных полей блока; None, если блок непригоден."""
+    name = fields.get('name')
+    hit_points = fields.get('hit_points')
+    if not name or not hit_points:
+        logger.warning(f"PARSE: skipping enemy block without name or HP: {fields}")
+        return None
+
+    missing = [key for key in STAT_FIELDS.values() if key not in fields]
+    if missing:
+        logger.warning(f"PARSE: enemy {name} has no {', '.join(missing)}, using 10")
+
+    dex_modifier = fields.get('dexterity', (10, 0))[1]
+    attacks = fields.get('attacks') or [DEFAULT_ATTACK]
+    enemy = {
+        'name': name,
+        'hit_points': hit_points,
+        'max_hit_points': hit_points,
+        'experience_reward': fields.get('experience_reward', 0),
+        'armor_class': 12 + (dex_modifier if dex_modifier > 0 else 0),  # AC = 12 + DEX mod if positive
+        'attacks': attacks,
+        # Первая атака - для совместимости со старой схемой
+        'attack_name': attacks[0][0],
+        'attack_damage': attacks[0][1],
+        'attack_bonus': attacks[0][2],
+    }
+    for key in STAT_FIELDS.values():
+        enemy[key] = fields.get(key, (10, 0))[0]
+    return enemy
+
+
+def _parse_canonical_attacks(lines: str) -> Optional[List[tuple]]:
+    """Строки "ATTACK: Имя (урон, бонус к атаке: +N)" без regex; None, если строка не в этом виде."""
+    attacks = []
+    for line in lines.split('\n')[:-1]:
+        name, _, rest = line[8:].partition(' (')
+        damage, found, bonus = rest.partition(', бонус к атаке: ')
+        if not found or not bonus.endswith(')'):
+            return None
+        try:
+            attacks.append((name.strip(), damage.strip(), int(bonus[:-1])))
+        except ValueError:
+            return None
+    return attacks
+
+
+def _parse_canonical_blocks(combat_text: str) -> Optional[List[Dict]]:
+    """Быстрый путь: готовые данные врагов, если все блоки в точном формате промпта; иначе None."""
+    enemies = []
+    for match in CANONICAL_BLOCK_RE.finditer(combat_text):
+        (name, hp, strength, _, dexterity, dex_modifier, constitution, _, intelligence, _,
+         wisdom, _, charisma, _, attack_lines, xp) = match.groups()
+        attacks = [DEFAULT_ATTACK]
+        if attack_lines:
+            attacks = _parse_canonical_attacks(attack_lines)
+            if attacks is None:
+                return None
+        name = name.strip()
+        hit_points = int(hp)
+        if not name or not hit_points:
+            # Такой блок отбросит и построчный разбор - с предупреждением в лог
+            return None
+        dex_modifier = int(dex_modifier)
+        first_attack = attacks[0]
+        # Те же поля, что собирает _build_enemy
+        enemies.append({
+            'name': name,
+            'hit_points': hit_points,
+            'max_hit_points': hit_points,
+            'experience_reward': int(xp),
+            'armor_class': 12 + (dex_modifier if dex_modifier > 0 else 0),
+            'attacks': attacks,
+            'attack_name': first_attack[0],
+            'attack_damage': first_attack[1],
+            'attack_bonus': first_attack[2],
+            'strength': int(strength),
+            'dexterity': int(dexterity),
+            'constitution': int(constitution),
+            'intelligence': int(intelligence),
+            'wisdom': int(wisdom),
+            'charisma': int(charisma),
+        })
+    if len(enemies) != combat_text.count('ENEMY:'):
+        return None
+    return enemies
+
+
+def _parse_enemy_lines(combat_text: str) -> List[Dict]:
+    """Поля блоков противников по строкам текста после ***COMBAT_START***."""
+    blocks = []
+    current = None
+    for line in combat_text.split('\n'):
+        match = FIELD_RE.match(line)
+        if not match:
+            continue
+        key = match.group('key').upper()
+        value = match.group('value').strip().strip('*`').strip()
+        if key == 'ENEMY':
+            current = {'name': value}
+            blocks.append(current)
+        elif current is None:
+            continue
+        elif key == 'HP':
+            number = NUMBER_RE.search(value)
+            if number:
+                current['hit_points'] = int(number.group())
+        elif key == 'XP':
+            number = NUMBER_RE.search(value)
+            if number:
+                current['experience_reward'] = int(number.group())
+        elif key == 'ATTACK':
+            current.setdefault('attacks', []).append(_parse_attack(value))
+        else:
+            stat = _parse_stat(value)
+            if stat:
+                current[STAT_FIELDS[key]] = stat
+    return blocks
+
+
+def validate_json(value: Any, schema: Dict, path: str = "$") -> Optional[str]:
+    """Проверяет value по подмножеству JSON Schema; возвращает описание первой ошибки или None."""
+    expected = schema.get("type")
+    if expected:
+        # bool - подкласс int, но в схеме это не число
+        if not isinstance(value, _JSON_TYPES[expected]) or isinstance(value, bool):
+            return f"{path}: expected {expected}"
+    if isinstance(value, dict):
+        for key in schema.get("required", ()):
+            if key not in value:
+                return f"{path}: missing '{key}'"
+        for key, subschema in schema.get("properties", {}).items():
+            if key in value:
+                error = validate_json(value[key], subschema, f"{path}.{key}")
+                if error:
+                    return error
+    elif isinstance(value, list):
+        if len(value) < schema.get("minItems", 0):
+            return f"{path}: expected at least {schema['minItems']} items"
+        for index, item in enumerate(value):
+            error = validate_json(item, schema.get("items", {}), f"{path}[{index}]")
+            if error:
+                return error
+    elif isinstance(value, str):
+        if len(value.strip()) < schema.get("minLength", 0):
+            return f"{path}: empty string"
+    elif isinstance(value, int):
+        if "minimum" in schema and value < schema["minimum"]:
+            return f"{path}: {value} < {schema['minimum']}"
+        if "maximum" in schema and value > schema["maximum"]:
+            return f"{path}: {value} > {schema['maximum']}"
+    return None
+
+
+def _parse_json_blocks(combat_text: str) -> Tuple[Optional[List[Dict]], Optional[str]]:
+    """Поля врагов из JSON-объекта после ***COMBAT_START***: (blocks, None) или (None, ошибка)."""
+    start = combat_text.find('{')
+    if start == -1:
+        return None, "no JSON object"
+    try:
+        # raw_decode читает ровно один объект - ограждения ```json и текст вокруг не мешают
+        data, _ = json.JSONDecoder().raw_decode(combat_text, start)
+    except ValueError as e:
+        return None, f"invalid JSON: {e}"
+    error = validate_json(data, COMBAT_JSON_SCHEMA)
+    if error:
+        return None, error
+
+    blocks = []
+    for enemy in data["enemies"]:
+        fields = {
+            'name': enemy['name'].strip(),
+            'hit_points': enemy['hp'],
+            'experience_reward': enemy['xp'],
+        }
+        for short, key in STAT_FIELDS.items():
+            score = enemy[short.lower()]
+            fields[key] = (score, (score - 10) // 2)
+        attacks = [(attack['name'].strip(), attack['damage'].strip(), attack['attack_bonus'])
+                   for attack in enemy.get('attacks') or []]
+        if attacks:
+            fields['attacks'] = attacks
+        blocks.append(fields)
+    return blocks, None
+
+
+def parse_response(text: str) -> ParsedResponse:
+    """Разбирает ответ Grok: один проход по маркерам и построчный разбор блока боя."""
+    if '\r' in text:
+        text = text.replace('\r\n', '\n').replace('\r', '\n')
+
+    clean_parts = []
+    position = 0
+    combat_start = None
+    adventure_ended = False
+    xp_reward = 0
+
+    for match in MARKER_RE.finditer(text):
+        # Все до маркера (пока бой не начался) - текст для игроков
+        if combat_start is None:
+            clean_parts.append(text[position:match.start()])
+            position = match.end()
+        kind = match.lastgroup
+        if kind == 'combat':
+            if combat_start is None:
+                combat_start = match.end()
+        elif kind == 'xp_reward':
+            if not xp_reward:
+                xp_reward = int(match.group('xp_reward'))
+        elif kind == 'end':
+            adventure_ended = True
+
+    enemies = []
+    enemy_format = ""
+    json_error = None
+    if combat_start is None:
+        clean_parts.append(text[position:])
+    else:
+        # Строки "HP:" в повествовании до боя - обычный текст, блоки ищем только после маркера
+        combat_text = text[combat_start:]
+        blocks = None
+        # JSON-блок принимаем в любом режиме: история старых приключений может быть в другом формате
+        if '{' in combat_text:
+            blocks, json_error = _parse_json_blocks(combat_text)
+            if json_error:
+                logger.warning(f"PARSE: combat JSON rejected ({json_error}), falling back to text blocks")
+        if blocks is not None:
+            enemy_format = "json"
+        else:
+            enemy_format = "text"
+            # Канонические блоки сразу дают готовых врагов, минуя _build_enemy
+            canonical = _parse_canonical_blocks(combat_text)
+            if canonical is not None:
+                enemies = canonical
+            else:
+                blocks = _parse_enemy_lines(combat_text)
+        for block in blocks or ():
+            enemy = _build_enemy(block)
+            if enemy is not None:
+                enemies.append(enemy)
+
+    return ParsedResponse(
+        text=text,
+        clean_text="".join(clean_parts).strip(),
+        enemies=enemies,
+        xp_reward=xp_reward,
+        adventure_ended=adventure_ended,
+        combat_started=combat_start is not None,
+        enemy_format=enemy_format,
+        json_error=json_error,
+    )
+
+
+class ParseMetrics:
+    """Успешность разбора боевых данных по режимам GROK_COMBAT_FORMAT."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # режим -> счетчики
+        self._modes: Dict[str, Dict[str, int]] = {}
+
+    def record(self, mode: str, parsed: ParsedResponse):
+        """Учитывает ответ с ***COMBAT_START***, полученный в режиме mode."""
+        if not parsed.combat_started:
+            return
+        with self._lock:
+            counters = self._modes.setdefault(mode, {'combats': 0, 'parsed': 0, 'json': 0, 'text_fallback': 0, 'failed': 0})
+            counters['combats'] += 1
+            if parsed.enemies:
+                counters['parsed'] += 1
+                if parsed.enemy_format == 'json':
+                    counters['json'] += 1
+                elif mode == 'json':
+                    counters['text_fallback'] += 1
+            else:
+                counters['failed'] += 1
+            rate = counters['parsed'] / counters['combats']
+        logger.info(f"PARSE METRICS: mode {mode}, enemies from {parsed.enemy_format or 'nothing'}, "
+                    f"success rate {rate:.0%} over {counters['combats']} combats")
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        with self._lock:
+            return {
+                mode: dict(counters, success_rate=counters['parsed'] / counters['combats'])
+                for mode, counters in self._modes.items()
+            }
+
+
+# Глобальный экземпляр метрик
+parse_metrics = ParseMetrics()
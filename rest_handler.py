@@ -10,7 +10,6 @@ import asyncio
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes
 from database import get_db
-from spell_slot_manager import spell_slot_manager
 
 logger = logging.getLogger(__name__)
 
@@ -25,11 +24,8 @@ class RestHandler:
         user_id = update.effective_user.id
         chat_id = update.effective_chat.id
         
-        if not self.db.connection or not self.db.connection.is_connected():
-            self.db.connect()
-        
         # Проверяем, есть ли у игрока персонаж в активном приключении
-        adventure_info = self.db.execute_query("""
+        adventure_info = await self.db.fetch("""
             SELECT a.id, a.status, c.id as character_id, c.name
             FROM adventures a
             JOIN adventure_participants ap ON a.id = ap.adventure_id
@@ -50,7 +46,7 @@ class RestHandler:
             return
         
         # Получаем всех участников приключения
-        participants = self.db.execute_query("""
+        participants = await self.db.fetch("""
             SELECT c.user_id, c.name
             FROM adventure_participants ap
             JOIN characters c ON ap.character_id = c.id
@@ -112,16 +108,13 @@ class RestHandler:
         vote_type = parts[2]  # yes или no
         adventure_id = int(parts[3])
         
-        if not self.db.connection or not self.db.connection.is_connected():
-            self.db.connect()
-        
         # Проверяем, что голосование активно
         if adventure_id not in self.rest_votes:
             await query.answer("Голосование уже завершено")
             return
         
         # Проверяем, является ли пользователь участником приключения
-        participant = self.db.execute_query("""
+        participant = await self.db.fetch("""
             SELECT c.id, c.name
             FROM adventure_participants ap
             JOIN characters c ON ap.character_id = c.id
@@ -145,7 +138,7 @@ class RestHandler:
             return
         
         # Получаем всех участников
-        participants = self.db.execute_query("""
+        participants = await self.db.fetch("""
             SELECT c.user_id, c.name
             FROM adventure_participants ap
             JOIN characters c ON ap.character_id = c.id
@@ -203,7 +196,7 @@ class RestHandler:
         votes = self.rest_votes[adventure_id]
         
         # Получаем всех участников
-        participants = self.db.execute_query("""
+        participants = await self.db.fetch("""
             SELECT c.user_id, c.name
             FROM adventure_participants ap
             JOIN characters c ON ap.character_id = c.id
@@ -237,13 +230,27 @@ class RestHandler:
                 text=f"❌ Голосование завершено. За отдых проголосовало {yes_votes} из необходимых {total_needed}. Приключение продолжается!"
             )
     
+    def _apply_long_rest(self, characters):
+        """Восстанавливает HP и слоты заклинаний всей группы в одной транзакции"""
+        if not characters:
+            return
+        with self.db.transaction():
+            self.db.execute_many(
+                "UPDATE characters SET current_hp = max_hp WHERE id = %s",
+                [(char['id'],) for char in characters]
+            )
+            casters = [(char['id'],) for char in characters if char['is_spellcaster']]
+            if casters:
+                # То же, что spell_slot_manager.rest_long, но без поглощения ошибок
+                self.db.execute_many(
+                    "UPDATE character_spell_slots SET used_slots = 0 WHERE character_id = %s",
+                    casters
+                )
+    
     async def initiate_rest(self, update: Update, context: ContextTypes.DEFAULT_TYPE, adventure_id: int):
         """Инициирует отдых для всей группы"""
-        if not self.db.connection or not self.db.connection.is_connected():
-            self.db.connect()
-        
         # Получаем всех персонажей в приключении
-        characters = self.db.execute_query("""
+        characters = await self.db.fetch("""
             SELECT c.id, c.name, c.current_hp, c.max_hp, cl.is_spellcaster
             FROM adventure_participants ap
             JOIN characters c ON ap.character_id = c.id
@@ -251,19 +258,20 @@ class RestHandler:
             WHERE ap.adventure_id = %s
         """, (adventure_id,))
         
+        # HP и слоты всей группы восстанавливаются одной транзакцией: либо все, либо никто
+        try:
+            await self.db.run(self._apply_long_rest, characters)
+        except Exception as e:
+            logger.error(f"Ошибка при длинном отдыхе в приключении {adventure_id}: {e}")
+            await context.bot.send_message(
+                chat_id=update.effective_chat.id,
+                text="❌ Не удалось провести отдых. Попробуйте еще раз."
+            )
+            return
+        
         rest_text = "🏕️ **Группа устраивает длинный отдых (8 часов)**\n\n"
         
         for char in characters:
-            # Полное восстановление HP
-            self.db.execute_query(
-                "UPDATE characters SET current_hp = max_hp WHERE id = %s",
-                (char['id'],)
-            )
-            
-            # Восстановление слотов для заклинателей
-            if char['is_spellcaster']:
-                spell_slot_manager.rest_long(char['id'])
-            
             rest_text += f"• **{char['name']}**: ❤️ Здоровье восстановлено ({char['max_hp']}/{char['max_hp']})\n"
             if char['is_spellcaster']:
                 rest_text += f"  🔮 Слоты заклинаний восстановлены\n"
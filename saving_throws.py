@@ -89,7 +89,8 @@ class SavingThrowManager:
     
     def make_saving_throw(self, target_id: int, target_type: str, 
                          save_type: str, dc: int, 
-                         advantage: bool = False, disadvantage: bool = False) -> Tuple[bool, str]:
+                         advantage: bool = False, disadvantage: bool = False,
+                         stats: Optional[Dict] = None) -> Tuple[bool, str]:
         """
         Совершает спасбросок для цели.
         
@@ -100,6 +101,8 @@ class SavingThrowManager:
             dc: Сложность спасброска
             advantage: Преимущество на бросок
             disadvantage: Помеха на бросок
+            stats: Характеристики цели, если уже известны (например, из состояния боя) -
+                   тогда база не читается
             
         Returns:
             (успех, текст_результата)
@@ -109,10 +112,10 @@ class SavingThrowManager:
         
         # Получаем характеристики цели
         if target_type == 'character':
-            stats = self._get_character_stats(target_id)
+            stats = stats or self._get_character_stats(target_id)
             proficiency_bonus = self._get_character_proficiency(target_id, save_type)
         else:  # enemy
-            stats = self._get_enemy_stats(target_id)
+            stats = stats or self._get_enemy_stats(target_id)
             proficiency_bonus = 0  # Враги пока не имеют владения спасбросками
         
         if not stats:
@@ -287,7 +290,7 @@ class SavingThrowManager:
             spell_id: ID заклинания
             caster_id: ID заклинателя
             targets: Список словарей с информацией о целях
-                    [{'id': enemy_id, 'type': 'enemy'}, ...]
+                    [{'id': enemy_id, 'type': 'enemy', 'stats': {...} (необязательно)}, ...]
         
         Returns:
             Словарь {target_id: (успех, текст_результата)}
@@ -312,7 +315,7 @@ class SavingThrowManager:
         # Каждая цель делает отдельный спасбросок
         for target in targets:
             success, result_text = self.make_saving_throw(
-                target['id'], target.get('type', 'enemy'), save_type, dc
+                target['id'], target.get('type', 'enemy'), save_type, dc, stats=target.get('stats')
             )
             results[target['id']] = (success, result_text)
         
@@ -9,7 +9,7 @@ import logging
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes
 from database import get_db
-from dice_utils import roll_dice, roll_dice_detailed, is_critical_hit, is_critical_miss, calculate_modifier, roll_d20
+from dice_utils import roll_expression, is_critical_hit, is_critical_miss, calculate_modifier, roll_d20
 from spell_slot_manager import spell_slot_manager
 from spell_scaling import (
     get_cantrip_scaling, 
@@ -19,6 +19,7 @@ from spell_scaling import (
     get_spell_scaling_rules
 )
 from saving_throws import saving_throw_manager
+from spell_combat import damage_hint
 
 logger = logging.getLogger(__name__)
 
@@ -28,16 +29,13 @@ class EnhancedSpellCombatManager:
     
     async def display_combat_spells(self, update: Update, character_id: int, adventure_id: int, turn_index: int):
         """Показывает список боевых заклинаний персонажа для выбора."""
-        if not self.db.connection or not self.db.connection.is_connected():
-            self.db.connect()
-        
         # Получаем уровень персонажа
         char_query = "SELECT level FROM characters WHERE id = %s"
-        char_result = self.db.execute_query(char_query, (character_id,))
+        char_result = await self.db.fetch(char_query, (character_id,))
         character_level = char_result[0]['level'] if char_result else 1
         
         # Получаем доступные слоты
-        available_slots = spell_slot_manager.get_available_slots(character_id)
+        available_slots = await self.db.run(spell_slot_manager.get_available_slots, character_id)
         
         # Получаем боевые заклинания персонажа
         combat_spells_query = """
@@ -49,7 +47,7 @@ class EnhancedSpellCombatManager:
             ORDER BY s.level, s.name
         """
         
-        combat_spells = self.db.execute_query(combat_spells_query, (character_id,))
+        combat_spells = await self.db.fetch(combat_spells_query, (character_id,))
         
         if not combat_spells:
             await update.callback_query.edit_message_text(
@@ -64,11 +62,11 @@ class EnhancedSpellCombatManager:
             if spell['level'] == 0:
                 available_spells.append(spell)
             # Для обычных заклинаний проверяем слоты
-            elif spell_slot_manager.has_available_slot(character_id, spell['level']):
+            elif await self.db.run(spell_slot_manager.has_available_slot, character_id, spell['level']):
                 available_spells.append(spell)
         
         if not available_spells:
-            slot_info = spell_slot_manager.get_spell_slots_info(character_id)
+            slot_info = await self.db.run(spell_slot_manager.get_spell_slots_info, character_id)
             await update.callback_query.edit_message_text(
                 f"❌ У вас нет доступных слотов для боевых заклинаний!\n\n{slot_info}"
             )
@@ -94,17 +92,17 @@ class EnhancedSpellCombatManager:
                 if spell['scaling_type'] == 'cantrip_damage':
                     scaling = get_cantrip_scaling(spell['id'], character_level)
                     if scaling and 'damage_dice' in scaling:
-                        damage_info = f" ({scaling['damage_dice']})"
+                        damage_info = damage_hint(scaling['damage_dice'])
                     else:
-                        damage_info = f" ({spell['damage']})" if spell['damage'] else ""
+                        damage_info = damage_hint(spell['damage'])
                 elif spell['scaling_type'] == 'cantrip_beams':
                     scaling = get_cantrip_scaling(spell['id'], character_level)
                     if scaling and 'num_beams' in scaling:
-                        damage_info = f" ({spell['damage']} x{scaling['num_beams']})"
+                        damage_info = damage_hint(spell['damage'], scaling['num_beams'])
                     else:
-                        damage_info = f" ({spell['damage']})" if spell['damage'] else ""
+                        damage_info = damage_hint(spell['damage'])
                 else:
-                    damage_info = f" ({spell['damage']})" if spell['damage'] else ""
+                    damage_info = damage_hint(spell['damage'])
                 
                 aoe_mark = " [AoE]" if spell['is_area_of_effect'] else ""
                 
@@ -117,7 +115,7 @@ class EnhancedSpellCombatManager:
             if level in spells_by_level:
                 for spell in spells_by_level[level]:
                     spell_name = spell['name']
-                    damage_info = f" ({spell['damage']})" if spell['damage'] else ""
+                    damage_info = damage_hint(spell['damage'])
                     aoe_mark = " [AoE]" if spell['is_area_of_effect'] else ""
                     
                     # Проверяем, есть ли скалирование
@@ -135,7 +133,7 @@ class EnhancedSpellCombatManager:
         reply_markup = InlineKeyboardMarkup(keyboard)
         
         # Получаем информацию о слотах для отображения
-        slot_info = spell_slot_manager.get_spell_slots_info(character_id)
+        slot_info = await self.db.run(spell_slot_manager.get_spell_slots_info, character_id)
         spell_text = f"🪄 Выберите заклинание для использования:\n\n{slot_info}"
         spell_text += "\n\n⬆️ - заклинание можно усилить слотом высокого уровня"
         
@@ -144,12 +142,9 @@ class EnhancedSpellCombatManager:
     async def handle_spell_cast(self, update: Update, context: ContextTypes.DEFAULT_TYPE, 
                                character_id: int, adventure_id: int, turn_index: int, spell_id: int):
         """Обрабатывает использование заклинания персонажем."""
-        if not self.db.connection or not self.db.connection.is_connected():
-            self.db.connect()
-        
         # Получаем информацию о персонаже
         char_query = "SELECT name, level FROM characters WHERE id = %s"
-        char_result = self.db.execute_query(char_query, (character_id,))
+        char_result = await self.db.fetch(char_query, (character_id,))
         if not char_result:
             await update.callback_query.edit_message_text("❌ Персонаж не найден!")
             return
@@ -165,7 +160,7 @@ class EnhancedSpellCombatManager:
             WHERE s.id = %s
         """
         
-        spell_info = self.db.execute_query(spell_query, (spell_id,))
+        spell_info = await self.db.fetch(spell_query, (spell_id,))
         if not spell_info:
             await update.callback_query.edit_message_text("❌ Заклинание не найдено!")
             return
@@ -176,7 +171,7 @@ class EnhancedSpellCombatManager:
         
         # Проверяем, есть ли у персонажа это заклинание
         char_spell_query = "SELECT id FROM character_spells WHERE character_id = %s AND spell_id = %s"
-        has_spell = self.db.execute_query(char_spell_query, (character_id, spell_id))
+        has_spell = await self.db.fetch(char_spell_query, (character_id, spell_id))
         
         if not has_spell:
             await update.callback_query.edit_message_text(
@@ -196,9 +191,9 @@ class EnhancedSpellCombatManager:
                                              spell_id, spell)
             else:
                 # Заклинание без скалирования - используем минимальный доступный слот
-                slot_level = spell_slot_manager.use_spell_slot(character_id, spell_level)
+                slot_level = await self.db.run(spell_slot_manager.use_spell_slot, character_id, spell_level)
                 if slot_level is None:
-                    slot_info = spell_slot_manager.get_spell_slots_info(character_id)
+                    slot_info = await self.db.run(spell_slot_manager.get_spell_slots_info, character_id)
                     await update.callback_query.edit_message_text(
                         f"❌ Нет доступных слотов для заклинания '{spell_name}' (уровень {spell_level})!\n\n{slot_info}"
                     )
@@ -211,7 +206,7 @@ class EnhancedSpellCombatManager:
                                 turn_index: int, spell_id: int, spell: dict):
         """Предлагает выбор слота для заклинания с возможностью усиления."""
         # Получаем доступные слоты
-        available_slots = spell_slot_manager.get_available_slots(character_id)
+        available_slots = await self.db.run(spell_slot_manager.get_available_slots, character_id)
         
         # Фильтруем слоты, которые можно использовать для этого заклинания
         usable_slots = []
@@ -220,7 +215,7 @@ class EnhancedSpellCombatManager:
                 usable_slots.append(slot_level)
         
         if not usable_slots:
-            slot_info = spell_slot_manager.get_spell_slots_info(character_id)
+            slot_info = await self.db.run(spell_slot_manager.get_spell_slots_info, character_id)
             await update.callback_query.edit_message_text(
                 f"❌ Нет доступных слотов для заклинания '{spell['name']}'!\n\n{slot_info}"
             )
@@ -270,12 +265,9 @@ class EnhancedSpellCombatManager:
                                    character_id: int, adventure_id: int, turn_index: int, 
                                    spell_id: int, slot_level: int):
         """Обрабатывает выбор слота для заклинания."""
-        if not self.db.connection or not self.db.connection.is_connected():
-            self.db.connect()
-        
         # Получаем информацию о персонаже и заклинании
         char_query = "SELECT name, level FROM characters WHERE id = %s"
-        char_result = self.db.execute_query(char_query, (character_id,))
+        char_result = await self.db.fetch(char_query, (character_id,))
         char_name = char_result[0]['name'] if char_result else "Неизвестный"
         character_level = char_result[0]['level'] if char_result else 1
         
@@ -283,7 +275,7 @@ class EnhancedSpellCombatManager:
             SELECT name, level, damage, damage_type, description, is_area_of_effect, scaling_type
             FROM spells WHERE id = %s
         """
-        spell_info = self.db.execute_query(spell_query, (spell_id,))
+        spell_info = await self.db.fetch(spell_query, (spell_id,))
         if not spell_info:
             await update.callback_query.edit_message_text("❌ Заклинание не найдено!")
             return
@@ -291,14 +283,14 @@ class EnhancedSpellCombatManager:
         spell = spell_info[0]
         
         # Используем выбранный слот
-        used_slot = spell_slot_manager.use_spell_slot(character_id, spell['level'])
+        used_slot = await self.db.run(spell_slot_manager.use_spell_slot, character_id, spell['level'])
         if used_slot != slot_level:
             # Если автоматически был использован другой слот, возвращаем его и используем выбранный
             if used_slot is not None:
-                spell_slot_manager.restore_spell_slot(character_id, used_slot)
+                await self.db.run(spell_slot_manager.restore_spell_slot, character_id, used_slot)
             
             # Используем конкретный слот
-            success = self.db.execute_query("""
+            success = await self.db.execute("""
                 UPDATE character_spell_slots
                 SET used_slots = used_slots + 1
                 WHERE character_id = %s AND slot_level = %s AND used_slots < max_slots
@@ -333,9 +325,6 @@ class EnhancedSpellCombatManager:
                                   turn_index: int, spell_id: int, spell: dict, char_name: str,
                                   character_level: int, scaling: dict):
         """Выбор целей для заговора с несколькими лучами."""
-        if not self.db.connection or not self.db.connection.is_connected():
-            self.db.connect()
-        
         # Получаем всех живых врагов
         enemies_query = """
             SELECT e.id, e.name, e.current_hp, e.max_hp
@@ -344,7 +333,7 @@ class EnhancedSpellCombatManager:
             WHERE cp.adventure_id = %s AND cp.participant_type = 'enemy' AND e.current_hp > 0
         """
         
-        alive_enemies = self.db.execute_query(enemies_query, (adventure_id,))
+        alive_enemies = await self.db.fetch(enemies_query, (adventure_id,))
         
         if not alive_enemies:
             await update.callback_query.edit_message_text("❌ Нет доступных целей для заклинания!")
@@ -424,9 +413,6 @@ class EnhancedSpellCombatManager:
                                     turn_index: int, spell: dict, char_name: str, 
                                     scaling: dict, slot_level: int = None):
         """Показывает доступные цели для заклинания."""
-        if not self.db.connection or not self.db.connection.is_connected():
-            self.db.connect()
-        
         # Получаем всех живых врагов
         enemies_query = """
             SELECT e.id, e.name, e.current_hp, e.max_hp
@@ -435,7 +421,7 @@ class EnhancedSpellCombatManager:
             WHERE cp.adventure_id = %s AND cp.participant_type = 'enemy' AND e.current_hp > 0
         """
         
-        alive_enemies = self.db.execute_query(enemies_query, (adventure_id,))
+        alive_enemies = await self.db.fetch(enemies_query, (adventure_id,))
         
         if not alive_enemies:
             await update.callback_query.edit_message_text("❌ Нет доступных целей для заклинания!")
@@ -474,9 +460,6 @@ class EnhancedSpellCombatManager:
     async def _cast_aoe_spell(self, update: Update, character_id: int, adventure_id: int, spell_id: int,
                              spell: dict, char_name: str, scaling: dict, slot_level: int = None):
         """Применяет заклинание по области."""
-        if not self.db.connection or not self.db.connection.is_connected():
-            self.db.connect()
-        
         # Получаем всех живых врагов
         enemies_query = """
             SELECT e.id, e.name, e.current_hp, e.max_hp, e.armor_class
@@ -485,7 +468,7 @@ class EnhancedSpellCombatManager:
             WHERE cp.adventure_id = %s AND cp.participant_type = 'enemy' AND e.current_hp > 0
         """
         
-        alive_enemies = self.db.execute_query(enemies_query, (adventure_id,))
+        alive_enemies = await self.db.fetch(enemies_query, (adventure_id,))
         
         if not alive_enemies:
             await update.callback_query.edit_message_text("❌ Нет целей для заклинания!")
@@ -529,7 +512,7 @@ class EnhancedSpellCombatManager:
             
             # Применяем урон
             new_hp = max(0, enemy['current_hp'] - damage_taken)
-            self.db.execute_query("UPDATE enemies SET current_hp = %s WHERE id = %s",
+            await self.db.execute("UPDATE enemies SET current_hp = %s WHERE id = %s",
                                  (new_hp, enemy_id))
             
             if new_hp <= 0:
@@ -542,7 +525,7 @@ class EnhancedSpellCombatManager:
         
         # Проверяем окончание боя
         alive_enemies_query = "SELECT COUNT(*) as count FROM enemies WHERE adventure_id = %s AND current_hp > 0"
-        alive_enemies_check = self.db.execute_query(alive_enemies_query, (adventure_id,))
+        alive_enemies_check = await self.db.fetch(alive_enemies_query, (adventure_id,))
         
         if alive_enemies_check and alive_enemies_check[0]['count'] == 0:
             from combat_manager import combat_manager
@@ -551,9 +534,6 @@ class EnhancedSpellCombatManager:
     async def _cast_multi_target_spell(self, update: Update, character_id: int, adventure_id: int,
                                       spell: dict, char_name: str, scaling: dict, slot_level: int = None):
         """Применяет заклинание к нескольким целям."""
-        if not self.db.connection or not self.db.connection.is_connected():
-            self.db.connect()
-        
         # Получаем живых врагов
         enemies_query = """
             SELECT e.id, e.name, e.current_hp, e.max_hp
@@ -564,7 +544,7 @@ class EnhancedSpellCombatManager:
         """
         
         num_targets = scaling['num_targets']
-        targets = self.db.execute_query(enemies_query, (adventure_id, num_targets))
+        targets = await self.db.fetch(enemies_query, (adventure_id, num_targets))
         
         if not targets:
             await update.callback_query.edit_message_text("❌ Нет целей для заклинания!")
@@ -582,7 +562,7 @@ class EnhancedSpellCombatManager:
             result_text += f"💥 {target['name']}: {damage_result['text']} {spell['damage_type']} урона\n"
             
             new_hp = max(0, target['current_hp'] - damage_result['total'])
-            self.db.execute_query("UPDATE enemies SET current_hp = %s WHERE id = %s",
+            await self.db.execute("UPDATE enemies SET current_hp = %s WHERE id = %s",
                                  (new_hp, target['id']))
             
             if new_hp <= 0:
@@ -619,32 +599,11 @@ class EnhancedSpellCombatManager:
     
     def _roll_spell_damage(self, damage_dice: str, critical: bool = False) -> dict:
         """Бросает кубики урона заклинания."""
-        if critical:
-            # Для критического попадания удваиваем кубики
-            total1, rolls1, modifier1, _ = roll_dice_detailed(damage_dice)
-            total2, rolls2, modifier2, _ = roll_dice_detailed(damage_dice)
-            
-            all_rolls = rolls1 + rolls2
-            total_damage = sum(all_rolls) + modifier1  # Модификатор не удваивается
-            
-            if len(all_rolls) == 1:
-                if modifier1 != 0:
-                    damage_text = f"{all_rolls[0]} + {modifier1} = {total_damage}"
-                else:
-                    damage_text = f"{all_rolls[0]} = {total_damage}"
-            else:
-                rolls_str = " + ".join(map(str, all_rolls))
-                if modifier1 != 0:
-                    damage_text = f"{rolls_str} + {modifier1} = {total_damage}"
-                else:
-                    damage_text = f"{rolls_str} = {total_damage}"
-        else:
-            # Обычный урон
-            total_damage, damage_text = roll_dice(damage_dice)
-        
+        # При критическом попадании кубики удваиваются, модификатор - нет
+        result = roll_expression(damage_dice, critical)
         return {
-            'total': total_damage,
-            'text': damage_text
+            'total': result.total,
+            'text': result.breakdown
         }
 
 # Global instance
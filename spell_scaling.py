@@ -9,7 +9,7 @@
 import json
 import logging
 import re
-from database import execute_query
+from reference_cache import reference_cache
 
 logger = logging.getLogger(__name__)
 
@@ -26,16 +26,9 @@ def get_cantrip_scaling(spell_id: int, character_level: int) -> dict:
     """
     try:
         # Получаем данные усиления для ближайшего подходящего уровня
-        scaling_data = execute_query("""
-            SELECT damage_dice, num_beams, other_effects
-            FROM cantrip_scaling
-            WHERE spell_id = %s AND character_level <= %s
-            ORDER BY character_level DESC
-            LIMIT 1
-        """, (spell_id, character_level))
+        data = reference_cache.cantrip_scaling(spell_id, character_level)
         
-        if scaling_data:
-            data = scaling_data[0]
+        if data:
             result = {
                 'damage_dice': data['damage_dice'],
                 'num_beams': data['num_beams']
@@ -62,14 +55,9 @@ def get_spell_slot_scaling(spell_id: int, slot_level: int) -> dict:
         Словарь с параметрами усиления
     """
     try:
-        scaling_data = execute_query("""
-            SELECT damage_bonus, duration_bonus, target_bonus, other_effects
-            FROM spell_slot_scaling
-            WHERE spell_id = %s AND slot_level = %s
-        """, (spell_id, slot_level))
+        data = reference_cache.spell_slot_scaling(spell_id, slot_level)
         
-        if scaling_data:
-            data = scaling_data[0]
+        if data:
             result = {}
             
             if data['damage_bonus']:
@@ -98,13 +86,7 @@ def get_spell_scaling_rules(spell_id: int) -> list:
         Список правил усиления
     """
     try:
-        rules = execute_query("""
-            SELECT rule_type, rule_value, rule_description
-            FROM spell_scaling_rules
-            WHERE spell_id = %s
-        """, (spell_id,))
-        
-        return rules or []
+        return list(reference_cache.spell_scaling_rules(spell_id))
     except Exception as e:
         logger.error(f"Ошибка при получении правил усиления для заклинания {spell_id}: {e}")
         return []
@@ -169,11 +151,7 @@ def get_spell_description_with_scaling(spell_id: int, slot_level: int = None, ch
     """
     try:
         # Получаем базовую информацию о заклинании
-        spell_data = execute_query("""
-            SELECT name, level, damage, description, scaling_type
-            FROM spells
-            WHERE id = %s
-        """, (spell_id,))
+        spell_data = reference_cache.lookup('spells', spell_id)
         
         if not spell_data:
             return ""
@@ -253,11 +231,7 @@ def apply_spell_scaling_in_combat(spell_id: int, base_damage: str, slot_level: i
     
     try:
         # Получаем информацию о заклинании
-        spell_data = execute_query("""
-            SELECT level, scaling_type
-            FROM spells
-            WHERE id = %s
-        """, (spell_id,))
+        spell_data = reference_cache.lookup('spells', spell_id)
         
         if not spell_data:
             return result
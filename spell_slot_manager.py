@@ -6,15 +6,15 @@
 """
 
 import logging
-from database import DatabaseManager
+from database import get_db
+from reference_cache import reference_cache
 from typing import Optional, List, Dict, Tuple
 
 logger = logging.getLogger(__name__)
 
 class SpellSlotManager:
     def __init__(self):
-        self.db = DatabaseManager()
-        self.db.connect()
+        self.db = get_db()
     
     def initialize_character_slots(self, character_id: int) -> bool:
         """
@@ -23,32 +23,23 @@ class SpellSlotManager:
         try:
             # Получаем информацию о персонаже
             character = self.db.execute_query("""
-                SELECT c.id, c.level, c.class_id, cl.is_spellcaster
-                FROM characters c
-                JOIN classes cl ON c.class_id = cl.id
-                WHERE c.id = %s
+                SELECT id, level, class_id FROM characters WHERE id = %s
             """, (character_id,))
             
-            if not character or not character[0]['is_spellcaster']:
+            class_info = reference_cache.get('classes', character[0]['class_id']) if character else None
+            if not class_info or not class_info['is_spellcaster']:
                 logger.info(f"Персонаж {character_id} не является заклинателем")
                 return False
             
             char_info = character[0]
             
-            # Получаем информацию о слотах для данного класса и уровня
-            slots_info = self.db.execute_query("""
-                SELECT slot_level_1, slot_level_2, slot_level_3, slot_level_4, 
-                       slot_level_5, slot_level_6, slot_level_7, slot_level_8, slot_level_9
-                FROM class_spell_slots
-                WHERE class_id = %s AND level = %s
-            """, (char_info['class_id'], char_info['level']))
+            # Получаем информацию о слотах для данного класса и уровня (из кэша справочников)
+            slots = reference_cache.class_spell_slots(char_info['class_id'], char_info['level'])
             
-            if not slots_info:
+            if not slots:
                 logger.warning(f"Не найдена информация о слотах для класса {char_info['class_id']} уровня {char_info['level']}")
                 return False
             
-            slots = slots_info[0]
-            
             # Обновляем или создаем записи для каждого уровня слотов
             for slot_level in range(1, 10):
                 slot_column = f'slot_level_{slot_level}'
@@ -277,11 +268,6 @@ class SpellSlotManager:
         except Exception as e:
             logger.error(f"Ошибка при получении информации о слотах: {e}")
             return "Ошибка при получении информации о слотах"
-    
-    def __del__(self):
-        """Деструктор для закрытия соединения с БД"""
-        if hasattr(self, 'db'):
-            self.db.disconnect()
 
 
 # Глобальный экземпляр менеджера слотов
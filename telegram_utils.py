@@ -1,12 +1,21 @@
+import asyncio
 import logging
+import time
 from typing import List
 from telegram import Update
+from telegram.error import BadRequest, RetryAfter, TelegramError
 from telegram.ext import ContextTypes
+import config
 
 logger = logging.getLogger(__name__)
 
 TELEGRAM_MAX_MESSAGE_LENGTH = 4096
 
+# Telegram limits edits to roughly one per second per chat (stricter in groups)
+STREAM_EDIT_INTERVAL = getattr(config, 'STREAM_EDIT_INTERVAL', 1.5)  # seconds between edits
+STREAM_MIN_CHARS = getattr(config, 'STREAM_MIN_CHARS', 40)  # don't edit for fewer new characters
+STREAM_REMOVED_TEXT = "…"  # left in a streamed message that Telegram would not delete
+
 def split_long_message(text: str, max_length: int = TELEGRAM_MAX_MESSAGE_LENGTH) -> List[str]:
     """
     Splits a long message into chunks that fit within Telegram's message limit.
@@ -117,3 +126,116 @@ async def edit_long_message(query, text: str, parse_mode: str = None, reply_mark
                 parse_mode=parse_mode,
                 reply_markup=chunk_reply_markup
             )
+
+
+class StreamingMessage:
+    """
+    Shows text that is still being generated by editing Telegram messages in place.
+    Edits are throttled to STREAM_EDIT_INTERVAL; text longer than the Telegram
+    limit continues in additional messages, split like send_long_message.
+    """
+    
+    def __init__(self, bot, chat_id: int, min_interval: float = STREAM_EDIT_INTERVAL,
+                 min_chars: int = STREAM_MIN_CHARS):
+        self.bot = bot
+        self.chat_id = chat_id
+        self.min_interval = min_interval
+        self.min_chars = min_chars
+        self.messages = []  # sent Message objects, one per chunk
+        self._shown = []  # text currently displayed in each message
+        self._shown_length = 0
+        self._next_edit = 0.0
+        self.edits = 0
+    
+    @property
+    def started(self) -> bool:
+        return bool(self.messages)
+    
+    async def update(self, text: str):
+        """Show partial text, skipping the call if the last edit was too recent"""
+        if not text.strip():
+            return
+        now = time.monotonic()
+        if now < self._next_edit:
+            return
+        if self.started and len(text) < self._shown_length:
+            # The stream restarted after a retry: the text on screen is stale, show the new one
+            self._shown_length = 0
+        elif self.started and len(text) - self._shown_length < self.min_chars:
+            return
+        self._next_edit = now + self.min_interval
+        try:
+            await self._render(text)
+        except RetryAfter as e:
+            # Flood control: skip edits until the penalty is over
+            logger.warning(f"Streaming edit rate limited, retry after {e.retry_after}s")
+            self._next_edit = time.monotonic() + _retry_delay(e)
+    
+    async def finish(self, text: str) -> bool:
+        """
+        Show the final text without throttling; messages left over from a longer
+        streamed text are removed.
+        Returns False if nothing was streamed or the final text could not be shown -
+        the partial text is then removed and the caller sends the text its usual way.
+        """
+        if not self.started:
+            return False
+        shown = True
+        if text.strip():
+            shown = False
+            for attempt in range(3):
+                try:
+                    shown = await self._render(text)
+                    break
+                except RetryAfter as e:
+                    # The final text must get through - wait out the penalty
+                    await asyncio.sleep(_retry_delay(e))
+        keep = len(split_long_message(text)) if shown and text.strip() else 0
+        await self._remove_surplus(keep)
+        logger.info(f"Streamed message finished: {len(self.messages)} messages, {self.edits} edits")
+        return shown
+    
+    async def _render(self, text: str) -> bool:
+        """Show text in the chunk messages; False if Telegram rejected an edit"""
+        chunks = split_long_message(text)
+        for i, chunk in enumerate(chunks):
+            try:
+                if i >= len(self.messages):
+                    self.messages.append(await self.bot.send_message(chat_id=self.chat_id, text=chunk))
+                    self._shown.append(chunk)
+                elif self._shown[i] != chunk:
+                    await self.messages[i].edit_text(chunk)
+                    self._shown[i] = chunk
+                    self.edits += 1
+            except BadRequest as e:
+                if "not modified" not in str(e).lower():
+                    logger.warning(f"Streaming edit rejected: {e}")
+                    return False
+                self._shown[i] = chunk
+            except RetryAfter:
+                raise
+            except TelegramError as e:
+                logger.warning(f"Streaming edit failed: {e}")
+                return False
+        self._shown_length = len(text)
+        return True
+    
+    async def _remove_surplus(self, keep: int):
+        """Delete chunk messages after the first `keep`; ones that cannot be deleted are blanked"""
+        while len(self.messages) > keep:
+            message = self.messages.pop()
+            self._shown.pop()
+            try:
+                await message.delete()
+            except TelegramError as e:
+                logger.warning(f"Could not delete streamed message, blanking it: {e}")
+                try:
+                    await message.edit_text(STREAM_REMOVED_TEXT)
+                except TelegramError as e:
+                    logger.warning(f"Could not blank streamed message: {e}")
+
+
+def _retry_delay(error: RetryAfter) -> float:
+    """RetryAfter.retry_after is int seconds or timedelta depending on the library version"""
+    delay = error.retry_after
+    return delay.total_seconds() if hasattr(delay, 'total_seconds') else float(delay)
@@ -0,0 +1,106 @@
+"""ActionHandler: повторная отправка действий и завершение приключения."""
+
+import asyncio
+from unittest import mock
+
+import action_handler
+from combat_rules import CHARACTER, Combatant
+from combat_state import combat_states
+
+
+def make_handler():
+    handler = action_handler.ActionHandler()
+    handler.db = mock.Mock()
+    handler.db.execute = mock.AsyncMock(return_value=1)
+    return handler
+
+
+def make_update_and_context(chat_id=42):
+    update = mock.Mock()
+    update.effective_chat.id = chat_id
+    context = mock.Mock()
+    context.bot.send_message = mock.AsyncMock()
+    return update, context
+
+
+def test_end_adventure_forgets_combat_and_cleans_up():
+    handler = make_handler()
+    handler.pending_actions[7] = {1: "атакую"}
+    update, context = make_update_and_context()
+    combat_states.start(7, 42, [Combatant(CHARACTER, 1, "Герой", 10, 5, 10, 12)])
+
+    asyncio.run(handler.end_adventure(update, context, 7))
+
+    assert combat_states.peek(7) is None
+    assert 7 not in handler.pending_actions
+    queries = [call.args[0] for call in handler.db.execute.await_args_list]
+    assert any("status = 'finished'" in query for query in queries)
+    assert any("DELETE FROM combat_participants" in query for query in queries)
+    assert any("DELETE FROM combat_metrics" in query for query in queries)
+    context.bot.send_message.assert_awaited_once()
+    assert context.bot.send_message.await_args.kwargs['chat_id'] == 42
+
+
+def test_end_adventure_without_combat():
+    handler = make_handler()
+    update, context = make_update_and_context()
+
+    asyncio.run(handler.end_adventure(update, context, 8))
+
+    context.bot.send_message.assert_awaited_once()
+
+
+def make_spell_handler(slots):
+    """Обработчик с одним заклинателем в приключении 9; slots - вызовы use/restore_spell_slot."""
+    handler = make_handler()
+
+    async def fetch(query, params=None):
+        if "a.status = 'active'" in query:
+            return [{'id': 3, 'name': "Маг", 'adventure_id': 9}]
+        if "character_skills" in query:
+            return []
+        if "character_spells" in query:
+            return [{'name': "Огненный шар", 'level': 3, 'id': 30}]
+        return [{'user_id': 5, 'name': "Маг"}]
+
+    async def run(func, *args):
+        slots.append((func.__name__, args))
+        return {'has_available_slot': True, 'use_spell_slot': 3}.get(func.__name__, "слоты")
+
+    handler.db.fetch = fetch
+    handler.db.run = run
+    return handler
+
+
+def submit(handler, text):
+    update, context = make_update_and_context()
+    update.effective_user.id = 5
+    context.args = text.split()
+    with mock.patch.object(action_handler.grok, 'continue_adventure', mock.AsyncMock(return_value=None)), \
+            mock.patch.object(action_handler, 'StreamingMessage') as stream:
+        stream.return_value.finish = mock.AsyncMock(return_value=False)
+        asyncio.run(handler.handle_action_command(update, context))
+
+
+def test_resubmitted_spell_action_spends_the_slot_once():
+    slots = []
+    handler = make_spell_handler(slots)
+
+    # Grok не ответил - действие остается в pending_actions, игрок отправляет его снова
+    submit(handler, "кастую [Огненный шар]")
+    submit(handler, "кастую [Огненный шар]")
+
+    assert [args for name, args in slots if name == 'use_spell_slot'] == [(3, 3)]
+    assert not [name for name, args in slots if name == 'restore_spell_slot']
+    assert handler.pending_actions[9][5]['spent_slots'] == [("Огненный шар", 3)]
+
+
+def test_changed_action_returns_the_unused_slot():
+    slots = []
+    handler = make_spell_handler(slots)
+
+    submit(handler, "кастую [Огненный шар]")
+    submit(handler, "бегу к двери")
+
+    assert [args for name, args in slots if name == 'restore_spell_slot'] == [(3, 3)]
+    assert handler.pending_actions[9][5]['spent_slots'] == []
@@ -0,0 +1,34 @@
+"""Инициатива в CombatManager.start_combat."""
+
+import asyncio
+from unittest import mock
+
+import combat_manager as combat_manager_module
+from combat_manager import combat_manager
+from combat_state import combat_states
+
+
+def test_start_combat_rolls_initiative_from_dexterity_scores():
+    chars = [{'id': 1, 'name': "Герой", 'current_hp': 12, 'max_hp': 12, 'armor_class': 14, 'user_id': 5,
+              'strength': 10, 'dexterity': 16, 'constitution': 12, 'intelligence': 10, 'wisdom': 10, 'charisma': 10}]
+    enemies = [{'id': 30, 'name': "Гоблин", 'hit_points': 7, 'max_hit_points': 7, 'armor_class': 13,
+                'dexterity': 14, 'attacks': [("Удар", "1d4", 0)]}]
+    update = mock.Mock()
+    update.effective_chat.id = 42
+
+    with mock.patch.object(combat_manager, 'db') as db, \
+            mock.patch.object(combat_manager_module, 'roll_initiative', side_effect=[15, 9]) as roll, \
+            mock.patch.object(combat_manager, 'show_initiative_order', mock.AsyncMock()), \
+            mock.patch.object(combat_manager, 'preview_combat', mock.AsyncMock()), \
+            mock.patch.object(combat_manager, 'handle_turn', mock.AsyncMock()):
+        db.fetch = mock.AsyncMock(return_value=chars)
+        db.execute_batch = mock.AsyncMock()
+        db.run = mock.AsyncMock()
+        started = asyncio.run(combat_manager.start_combat(update, mock.Mock(), 22, enemies))
+
+    assert started is True
+    # Значения характеристики, а не модификаторы - модификатор считает combat_rules.roll_initiative
+    assert [call.args for call in roll.call_args_list] == [(16,), (14,)]
+    rows = db.execute_batch.await_args.args[1]
+    assert [(row[1], row[2], row[3]) for row in rows] == [('character', 1, 15), ('enemy', 30, 9)]
+    combat_states.discard(22)
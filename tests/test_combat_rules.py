@@ -0,0 +1,30 @@
+"""Правила боя: заклинательная характеристика и шанс вывести цель из строя."""
+
+import pytest
+
+from combat_rules import knockout_chance, spell_save_dc, spellcasting_modifier
+
+
+def test_spellcasting_modifier_follows_class_ability():
+    stats = {'intelligence': 18, 'wisdom': 12, 'charisma': 8}
+    assert spellcasting_modifier('Интеллект', stats) == 4
+    assert spellcasting_modifier('Мудрость', stats) == 1
+    assert spellcasting_modifier('Харизма', stats) == -1
+    # Не заклинатель и неизвестная характеристика
+    assert spellcasting_modifier(None, stats) == 0
+    # Характеристика не указана - как 10
+    assert spellcasting_modifier('Сила', stats) == 0
+    assert spell_save_dc(spellcasting_modifier('Интеллект', stats)) == 14
+
+
+def test_knockout_chance_is_exact():
+    # Бонус +4 против КД 13: попадают натуральные 9-19 (11/20), 20 - крит (1/20)
+    expected = 11 / 20 * 1 / 6 + 1 / 20 * 26 / 36  # 1d6 >= 6 и 2d6 >= 6
+    assert knockout_chance(4, 13, '1d6', 6) == pytest.approx(expected)
+    # Любое попадание снимает 1 HP
+    assert knockout_chance(4, 13, '1d6', 1) == pytest.approx(12 / 20)
+    # Даже крит не наберет 13
+    assert knockout_chance(4, 13, '1d6', 13) == 0.0
+    # Недостижимый КД - только натуральная 20
+    assert knockout_chance(0, 30, '1d6', 1) == pytest.approx(1 / 20)
+    assert knockout_chance(4, 13, 'особый', 1) == 0.0
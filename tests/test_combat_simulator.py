@@ -0,0 +1,18 @@
+"""Безголовый симулятор боев."""
+
+import pytest
+
+from combat_simulator import DEMO_ENEMIES, DEMO_PARTY, simulate
+
+
+def test_simulate_rejects_empty_series():
+    with pytest.raises(ValueError):
+        simulate(DEMO_PARTY, DEMO_ENEMIES, fights=0)
+
+
+def test_simulate_is_reproducible_with_seed():
+    first = simulate(DEMO_PARTY, DEMO_ENEMIES, fights=20, workers=1, seed=7)
+    second = simulate(DEMO_PARTY, DEMO_ENEMIES, fights=20, workers=1, seed=7)
+    assert first.fights == 20
+    assert first.win_rate + first.loss_rate + first.draw_rate == pytest.approx(1)
+    assert (first.win_rate, first.damage_dealt) == (second.win_rate, second.damage_dealt)
@@ -0,0 +1,78 @@
+"""ConnectionPool: число соединений ограничено семафором с таймаутом."""
+
+from unittest import mock
+
+import pytest
+from mysql.connector import Error
+from mysql.connector.errors import PoolError
+
+import database
+from database import ConnectionPool
+
+
+class FakeConnection:
+    def __init__(self):
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+class FakeMySQLPool:
+    """Пул mysql.connector без сервера: выдает соединения без ограничения."""
+
+    def __init__(self, **kwargs):
+        self.kwargs = kwargs
+        self.fail = False
+
+    def get_connection(self):
+        if self.fail:
+            raise Error(msg="server has gone away")
+        return FakeConnection()
+
+    def _remove_connections(self):
+        pass
+
+
+@pytest.fixture
+def make_pool():
+    with mock.patch.object(database.pooling, 'MySQLConnectionPool', FakeMySQLPool):
+        yield lambda pool_size=2, timeout=0.05: ConnectionPool(pool_size=pool_size, timeout=timeout)
+
+
+def test_checkout_waits_for_a_free_slot_and_times_out(make_pool):
+    pool = make_pool(pool_size=2)
+    first = pool.get_connection()
+    pool.get_connection()
+
+    with pytest.raises(PoolError):
+        pool.get_connection()
+
+    # Возврат соединения освобождает слот
+    pool.release(first)
+    assert first.closed
+    assert pool.get_connection() is not None
+
+
+def test_failed_checkout_frees_its_slot(make_pool):
+    pool = make_pool(pool_size=1)
+    pool._pool.fail = True
+    with pytest.raises(Error):
+        pool.get_connection()
+
+    pool._pool.fail = False
+    assert pool.get_connection() is not None
+
+
+def test_pool_size_is_clamped(make_pool):
+    assert make_pool(pool_size=0).pool_size == 1
+    assert make_pool(pool_size=database.MAX_POOL_SIZE + 5).pool_size == database.MAX_POOL_SIZE
+
+
+def test_closed_pool_refuses_checkouts(make_pool):
+    pool = make_pool()
+    pool.close()
+
+    assert not pool.is_connected()
+    with pytest.raises(Error):
+        pool.get_connection()
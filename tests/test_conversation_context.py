@@ -0,0 +1,83 @@
+"""ConversationContext.build: бюджет токенов и скользящее содержание."""
+
+import asyncio
+from unittest import mock
+
+from conversation_context import SUMMARY_PREFIX, ConversationContext, count_message_tokens
+
+SYSTEM = {"role": "system", "content": "Ты - мастер подземелий."}
+
+
+def make_turns(count):
+    return [{"role": "user" if i % 2 == 0 else "assistant", "content": f"Ход {i}. " + "событие " * 40}
+            for i in range(count)]
+
+
+def make_context(summarize=None, stored=None, **kwargs):
+    context = ConversationContext(summarize or mock.AsyncMock(return_value="Новое содержание"), **kwargs)
+    context.db = mock.Mock()
+    context.db.run = mock.AsyncMock(side_effect=lambda func, *args: func(*args))
+    context.db.execute_query = mock.Mock(return_value=stored or [])
+    return context
+
+
+def test_long_history_fits_the_budget_and_keeps_recent_turns_verbatim():
+    turns = make_turns(40)
+    new = [{"role": "user", "content": "Действия игроков: осматриваемся"}]
+    context = make_context(token_budget=1500, keep_exchanges=2)
+
+    async def build():
+        messages = await context.build(1, [SYSTEM] + turns, new)
+        await asyncio.gather(*context._tasks.values())
+        return messages
+
+    messages = asyncio.run(build())
+
+    assert count_message_tokens(messages) <= 1500
+    assert messages[0] == SYSTEM
+    assert messages[-5:] == turns[-4:] + new
+    # Не поместившиеся старые ходы уходят в фоновое содержание
+    summarize = context._summarize
+    summarize.assert_awaited_once()
+    previous_summary, summarized_turns = summarize.await_args.args
+    assert previous_summary == ""
+    assert summarized_turns == turns[:-4]
+    assert context._summaries[1] == ("Новое содержание", 36)
+
+
+def test_summary_replaces_the_turns_it_covers():
+    turns = make_turns(20)
+    stored = [{'summary': "Герои вошли в пещеру", 'summarized_messages': 12}]
+    context = make_context(stored=stored, token_budget=100000, keep_exchanges=2)
+
+    messages = asyncio.run(context.build(1, [SYSTEM] + turns, []))
+
+    assert messages[0] == SYSTEM
+    assert messages[1] == {"role": "system", "content": SUMMARY_PREFIX + "Герои вошли в пещеру"}
+    assert messages[2:] == turns[12:]
+    context._summarize.assert_not_awaited()
+
+
+def test_short_history_is_sent_whole_without_summary():
+    turns = make_turns(6)
+    context = make_context(token_budget=100000, keep_exchanges=6)
+
+    messages = asyncio.run(context.build(1, [SYSTEM] + turns, []))
+
+    assert messages == [SYSTEM] + turns
+    assert not context._tasks
+    context._summarize.assert_not_awaited()
+
+
+def test_tight_budget_keeps_at_least_the_last_exchange():
+    turns = make_turns(12)
+    context = make_context(token_budget=50, keep_exchanges=6)
+
+    async def build():
+        messages = await context.build(1, [SYSTEM] + turns, [])
+        await asyncio.gather(*context._tasks.values())
+        return messages
+
+    messages = asyncio.run(build())
+
+    assert messages == [SYSTEM] + turns[-2:]
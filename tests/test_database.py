@@ -0,0 +1,110 @@
+"""DatabaseManager.transaction(): одно соединение и один commit на блок."""
+
+import pytest
+from mysql.connector import Error
+
+from database import DatabaseManager
+
+
+class FakeCursor:
+    def __init__(self, connection):
+        self.connection = connection
+        self.rowcount = 1
+        self.lastrowid = 0
+
+    def execute(self, query, params=()):
+        if 'FAIL' in query:
+            raise Error(msg="query failed")
+        self.connection.queries.append(query)
+
+    def executemany(self, query, params_list):
+        self.connection.queries.append(query)
+
+    def fetchall(self):
+        return []
+
+    def close(self):
+        pass
+
+
+class FakeConnection:
+    def __init__(self):
+        self.queries = []
+        self.commits = 0
+        self.rollbacks = 0
+
+    def cursor(self, dictionary=False):
+        return FakeCursor(self)
+
+    def commit(self):
+        self.commits += 1
+
+    def rollback(self):
+        self.rollbacks += 1
+
+
+class FakePool:
+    def __init__(self):
+        self.connections = []
+
+    def is_connected(self):
+        return True
+
+    def get_connection(self):
+        connection = FakeConnection()
+        self.connections.append(connection)
+        return connection
+
+    def release(self, connection):
+        pass
+
+
+def make_db():
+    db = DatabaseManager(pool_size=2)
+    db.connection = FakePool()
+    return db
+
+
+def test_transaction_commits_once_on_one_connection():
+    db = make_db()
+
+    with db.transaction():
+        db.execute_query("UPDATE enemies SET hit_points = 1 WHERE id = 1")
+        db.execute_many("UPDATE enemies SET hit_points = %s WHERE id = %s", [(0, 2), (0, 3)])
+        # Вложенный блок присоединяется к внешнему
+        with db.transaction():
+            db.execute_query("UPDATE characters SET current_hp = 5 WHERE id = 1")
+        assert db.in_transaction()
+
+    assert not db.in_transaction()
+    [connection] = db.connection.connections
+    assert len(connection.queries) == 3
+    assert connection.commits == 1
+    assert connection.rollbacks == 0
+
+
+def test_error_rolls_back_the_whole_block():
+    db = make_db()
+
+    with pytest.raises(Error):
+        with db.transaction():
+            db.execute_query("UPDATE enemies SET hit_points = 1 WHERE id = 1")
+            with db.transaction():
+                # Внутри транзакции ошибка пробрасывается, а не превращается в None
+                db.execute_query("UPDATE FAIL")
+
+    [connection] = db.connection.connections
+    assert connection.commits == 0
+    assert connection.rollbacks == 1
+    assert not db.in_transaction()
+
+
+def test_calls_outside_a_transaction_commit_each_and_swallow_errors():
+    db = make_db()
+
+    assert db.execute_query("UPDATE enemies SET hit_points = 1 WHERE id = 1") == 1
+    assert db.execute_query("UPDATE FAIL") is None
+
+    first, second = db.connection.connections
+    assert first.commits == 1
+    assert second.rollbacks == 1
@@ -0,0 +1,43 @@
+"""Точные распределения урона."""
+
+import pytest
+
+from dice_utils import damage_distribution
+
+
+def test_distribution_of_2d6_plus_3():
+    distribution = damage_distribution('2d6+3')
+    assert (distribution.minimum, distribution.maximum) == (5, 15)
+    assert distribution.mean == pytest.approx(10)
+    # Дисперсия 1d6 - 35/12, у двух костей вдвое больше
+    assert distribution.variance == pytest.approx(35 / 6)
+    assert sum(distribution.probabilities) == pytest.approx(1)
+
+
+def test_chance_at_least():
+    distribution = damage_distribution('2d6+3')
+    assert distribution.chance_at_least(10) == pytest.approx(7 / 12)
+    assert distribution.chance_at_least(15) == pytest.approx(1 / 36)
+    # За пределами диапазона
+    assert distribution.chance_at_least(5) == 1.0
+    assert distribution.chance_at_least(-3) == 1.0
+    assert distribution.chance_at_least(16) == 0.0
+
+
+def test_percentile():
+    distribution = damage_distribution('2d6+3')
+    assert distribution.percentile(0) == 5
+    assert distribution.percentile(0.5) == 10
+    # P(total <= 13) = 33/36
+    assert distribution.percentile(33 / 36) == 13
+    assert distribution.percentile(1) == 15
+
+
+def test_critical_doubles_dice_not_modifier():
+    distribution = damage_distribution('2d6+3', critical=True)
+    assert (distribution.minimum, distribution.maximum) == (7, 27)
+    assert distribution.mean == pytest.approx(17)
+
+
+def test_invalid_notation():
+    assert damage_distribution('особый') is None
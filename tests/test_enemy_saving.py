@@ -0,0 +1,47 @@
+"""Враги, которые не удалось сохранить в базе, не ломают бой."""
+
+import asyncio
+import os
+from unittest import mock
+
+from combat_manager import combat_manager
+from combat_state import combat_states
+from grok_api import grok
+from response_parser import parse_response
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+with open(os.path.join(ROOT, "mock_responses", "combat_start.txt"), encoding="utf-8") as f:
+    COMBAT_RESPONSE = f.read()
+
+
+def test_save_enemies_returns_nothing_when_the_transaction_fails():
+    enemies = parse_response(COMBAT_RESPONSE).enemies
+    assert enemies
+
+    with mock.patch.object(grok, 'db') as db:
+        db.execute_insert_rows.side_effect = RuntimeError("connection lost")
+        assert grok.save_enemies(1, enemies) == []
+
+
+def test_save_enemies_fills_ids():
+    enemies = parse_response(COMBAT_RESPONSE).enemies
+
+    with mock.patch.object(grok, 'db') as db:
+        db.execute_insert_rows.return_value = [10 + i for i in range(len(enemies))]
+        saved = grok.save_enemies(1, enemies)
+
+    assert [enemy['id'] for enemy in saved] == [10 + i for i in range(len(enemies))]
+    db.execute_many.assert_called_once()
+
+
+def test_start_combat_without_saved_enemies_does_not_start():
+    enemies = parse_response(COMBAT_RESPONSE).enemies  # без id
+
+    with mock.patch.object(combat_manager, 'db') as db:
+        db.fetch = mock.AsyncMock(return_value=[])
+        started = asyncio.run(combat_manager.start_combat(mock.Mock(), mock.Mock(), 21, enemies))
+
+    assert started is False
+    assert combat_states.peek(21) is None
+    db.fetch.assert_not_called()
@@ -0,0 +1,37 @@
+"""GrokAPI: видимая часть ответа при потоковой генерации."""
+
+import asyncio
+from unittest import mock
+
+import grok_api
+from grok_api import grok
+
+
+def test_preview_reparses_the_buffer_at_most_once_per_interval():
+    on_text = mock.AsyncMock()
+    clock = mock.Mock(return_value=100.0)
+
+    async def stream():
+        preview = grok._previewer(on_text)
+        text = ""
+        for word in ["Вы ", "входите ", "в ", "темную ", "пещеру. "]:
+            text += word
+            await preview(text)
+        clock.return_value += grok_api.GROK_PREVIEW_INTERVAL
+        await preview(text + "Слышен ")
+
+    with mock.patch.object(grok_api.time, 'monotonic', clock), \
+            mock.patch.object(grok, 'preview_for_players', wraps=grok.preview_for_players) as parse:
+        asyncio.run(stream())
+
+    # Первая дельта показывается сразу, остальные в пределах интервала не разбираются
+    assert parse.call_count == 2
+    assert [call.args[0] for call in on_text.await_args_list] == ["Вы", "Вы входите в темную пещеру. Слышен"]
+
+
+def test_preview_callback_errors_do_not_break_the_stream():
+    on_text = mock.AsyncMock(side_effect=RuntimeError("telegram down"))
+
+    asyncio.run(grok._previewer(on_text)("Текст ответа "))
+
+    on_text.assert_awaited_once()
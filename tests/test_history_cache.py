@@ -0,0 +1,135 @@
+"""HistoryCache: LRU и выгрузка простаивающих приключений, пакетная запись в chat_history."""
+
+import asyncio
+from unittest import mock
+
+import history_cache
+from history_cache import HistoryCache
+
+
+def make_cache(**kwargs):
+    cache = HistoryCache(**kwargs)
+    cache.db = mock.Mock()
+    cache.db.run = mock.AsyncMock(side_effect=lambda func, *args: func(*args))
+    cache.db.stream = mock.Mock(side_effect=lambda query, params: iter(
+        [{'role': 'system', 'content': f"Приключение {params[0]}"}]))
+    cache.db.execute_batch = mock.AsyncMock(side_effect=lambda query, rows: len(rows))
+    return cache
+
+
+def test_least_recently_used_adventure_is_evicted():
+    evicted = []
+    cache = make_cache(capacity=2, on_evict=evicted.append)
+
+    async def scenario():
+        await cache.get(1)
+        await cache.get(2)
+        await cache.get(1)  # 2 теперь самое давнее
+        await cache.get(3)
+
+    asyncio.run(scenario())
+
+    assert evicted == [2]
+    assert list(cache._entries) == [1, 3]
+    assert (cache.hits, cache.misses) == (1, 3)
+
+
+def test_idle_adventures_are_evicted():
+    evicted = []
+    cache = make_cache(idle_seconds=60, on_evict=evicted.append)
+    clock = mock.Mock(return_value=1000.0)
+
+    with mock.patch.object(history_cache.time, 'monotonic', clock):
+        asyncio.run(cache.get(1))
+        clock.return_value = 1030.0
+        asyncio.run(cache.get(2))
+        clock.return_value = 1070.0
+        cache._evict_idle()
+
+    assert evicted == [1]
+    assert list(cache._entries) == [2]
+
+
+def test_full_batch_is_written_at_once():
+    cache = make_cache()
+
+    async def scenario():
+        for i in range(3):
+            await cache.append(1, 'user', f"Действие {i}")
+        await asyncio.sleep(0)  # пачка пишется отдельной задачей
+        cache._flusher.cancel()
+
+    with mock.patch.object(history_cache, 'HISTORY_FLUSH_BATCH', 3):
+        asyncio.run(scenario())
+
+    cache.db.execute_batch.assert_awaited_once()
+    query, rows = cache.db.execute_batch.await_args.args
+    assert rows == [(1, 'user', f"Действие {i}") for i in range(3)]
+    assert not cache._pending
+    # В памяти история уже дополнена, без повторного чтения из базы
+    assert len(asyncio.run(cache.get(1))) == 4
+    cache.db.stream.assert_called_once()
+
+
+def test_pending_messages_are_written_by_interval():
+    cache = make_cache()
+
+    async def scenario():
+        await cache.append(1, 'assistant', "Ответ мастера")
+        cache.db.execute_batch.assert_not_awaited()
+        await asyncio.sleep(0.05)
+        await cache.close()
+
+    with mock.patch.object(history_cache, 'HISTORY_FLUSH_INTERVAL', 0.01):
+        asyncio.run(scenario())
+
+    cache.db.execute_batch.assert_awaited_once()
+    assert cache.db.execute_batch.await_args.args[1] == [(1, 'assistant', "Ответ мастера")]
+
+
+def test_close_drains_the_queue():
+    cache = make_cache()
+
+    async def scenario():
+        await cache.append(1, 'user', "Первое")
+        await cache.append(2, 'user', "Второе")
+        await cache.close()
+
+    asyncio.run(scenario())
+
+    assert cache._flusher is None
+    assert not cache._pending
+    cache.db.execute_batch.assert_awaited_once()
+    assert cache.db.execute_batch.await_args.args[1] == [(1, 'user', "Первое"), (2, 'user', "Второе")]
+
+
+def test_failed_write_is_retried():
+    cache = make_cache()
+    cache.db.execute_batch = mock.AsyncMock(side_effect=[None, 1])
+
+    async def scenario():
+        await cache.append(1, 'user', "Действие")
+        await cache.flush()
+        assert cache._pending == [(1, 'user', "Действие")]
+        await cache.close()
+
+    asyncio.run(scenario())
+
+    assert cache.db.execute_batch.await_count == 2
+    assert not cache._pending
+
+
+def test_evicted_adventure_writes_pending_messages_before_reload():
+    cache = make_cache(capacity=1)
+
+    async def scenario():
+        await cache.append(1, 'user', "Действие")
+        await cache.get(2)  # приключение 1 выгружено, сообщение еще в очереди
+        await cache.get(1)
+        cache._flusher.cancel()
+
+    asyncio.run(scenario())
+
+    # Запись ушла в базу раньше, чем история была прочитана заново
+    cache.db.execute_batch.assert_awaited_once()
+    assert not cache._pending
@@ -0,0 +1,191 @@
+"""Повторы запросов к Grok: предохранитель, Retry-After, бюджет времени и ошибки 4xx."""
+
+import asyncio
+import email.utils
+import time
+from unittest import mock
+
+import pytest
+
+import llm_retry
+from llm_retry import (CircuitBreaker, PermanentError, ProviderHealth, RetryableError, call_with_retries,
+                       parse_retry_after)
+
+
+@pytest.fixture
+def clock():
+    clock = mock.Mock(return_value=1000.0)
+    with mock.patch.object(llm_retry.time, 'monotonic', clock):
+        yield clock
+
+
+@pytest.fixture
+def sleeps():
+    """Паузы между попытками записываются, а не выжидаются; разброс задержки нулевой."""
+    delays = []
+
+    async def sleep(delay):
+        delays.append(delay)
+
+    with mock.patch.object(llm_retry.asyncio, 'sleep', sleep), \
+            mock.patch.object(llm_retry, 'backoff_delay', return_value=0.0):
+        yield delays
+
+
+def attempts(*results):
+    """attempt(remaining): по очереди выбрасывает исключения из results или возвращает значения."""
+    calls = []
+
+    async def attempt(remaining):
+        calls.append(remaining)
+        result = results[len(calls) - 1]
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    return attempt, calls
+
+
+def test_breaker_opens_after_threshold_and_lets_one_probe_through(clock):
+    breaker = CircuitBreaker(threshold=3, reset_seconds=60)
+    for _ in range(2):
+        assert breaker.allow()
+        breaker.record_failure()
+    assert breaker.state == CircuitBreaker.CLOSED
+
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    assert not breaker.allow()
+    assert breaker.retry_in() == 60
+
+    clock.return_value += 60
+    assert breaker.allow()  # пробный запрос
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    assert not breaker.allow()  # второй ждет результата пробы
+
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert breaker.failures == 0
+    assert breaker.allow() and breaker.allow()
+
+
+def test_failed_probe_reopens_the_breaker(clock):
+    breaker = CircuitBreaker(threshold=1, reset_seconds=30)
+    breaker.record_failure()
+    clock.return_value += 30
+    assert breaker.allow()
+
+    breaker.record_failure()
+
+    assert breaker.state == CircuitBreaker.OPEN
+    assert breaker.retry_in() == 30
+    assert not breaker.allow()
+
+
+def test_abandoned_probe_lets_the_next_request_probe(clock):
+    breaker = CircuitBreaker(threshold=1, reset_seconds=30)
+    breaker.record_failure()
+    clock.return_value += 30
+    assert breaker.allow()
+
+    breaker.abandon()
+
+    assert breaker.allow()
+
+
+def test_retry_after_sets_the_delay(sleeps):
+    health = ProviderHealth()
+    attempt, calls = attempts(RetryableError('rate_limited', "429", retry_after=3.0), "ответ")
+
+    result = asyncio.run(call_with_retries(attempt, CircuitBreaker(), time.monotonic() + 60, health=health))
+
+    assert result == "ответ"
+    assert len(calls) == 2
+    assert sleeps == [3.0]
+    assert health.stats() == {'rate_limited': 1, 'retry': 1, 'success_after_retry': 1}
+
+
+def test_gives_up_after_max_retries(sleeps):
+    health = ProviderHealth()
+    breaker = CircuitBreaker(threshold=10)
+    attempt, calls = attempts(*[RetryableError('server_error', "502")] * 3)
+
+    result = asyncio.run(call_with_retries(attempt, breaker, time.monotonic() + 60, max_retries=2, health=health))
+
+    assert result is None
+    assert len(calls) == 3
+    assert health.stats() == {'server_error': 3, 'retry': 2, 'gave_up': 1}
+    assert breaker.failures == 3
+
+
+def test_no_retry_when_retry_after_exceeds_the_deadline(sleeps):
+    health = ProviderHealth()
+    attempt, calls = attempts(RetryableError('rate_limited', "429", retry_after=30.0), "ответ")
+
+    result = asyncio.run(call_with_retries(attempt, CircuitBreaker(), time.monotonic() + 5, health=health))
+
+    assert result is None
+    assert len(calls) == 1
+    assert not sleeps
+    assert health.stats() == {'rate_limited': 1, 'deadline_exceeded': 1}
+
+
+def test_expired_deadline_sends_nothing():
+    health = ProviderHealth()
+    attempt, calls = attempts("ответ")
+
+    result = asyncio.run(call_with_retries(attempt, CircuitBreaker(), time.monotonic() - 1, health=health))
+
+    assert result is None
+    assert not calls
+    assert health.stats() == {'deadline_exceeded': 1}
+
+
+def test_attempt_is_cut_off_at_the_deadline():
+    health = ProviderHealth()
+    breaker = CircuitBreaker()
+
+    async def attempt(remaining):
+        assert remaining <= 0.05
+        await asyncio.sleep(1)
+
+    result = asyncio.run(call_with_retries(attempt, breaker, time.monotonic() + 0.05, health=health))
+
+    assert result is None
+    assert health.stats() == {'deadline_exceeded': 1}
+    assert breaker.failures == 1
+
+
+def test_client_error_is_not_retried_and_does_not_trip_the_breaker(sleeps):
+    health = ProviderHealth()
+    breaker = CircuitBreaker(threshold=1)
+    attempt, calls = attempts(PermanentError('client_error', "400 Bad Request"), "ответ")
+
+    assert asyncio.run(call_with_retries(attempt, breaker, time.monotonic() + 60, health=health)) is None
+    assert len(calls) == 1
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert breaker.failures == 0
+
+    # Следующий запрос проходит: предохранитель не разомкнулся
+    assert asyncio.run(call_with_retries(attempt, breaker, time.monotonic() + 60, health=health)) == "ответ"
+    assert health.stats() == {'client_error': 1, 'success': 1}
+
+
+def test_open_breaker_fails_fast():
+    health = ProviderHealth()
+    breaker = CircuitBreaker(threshold=1, reset_seconds=60)
+    breaker.record_failure()
+    attempt, calls = attempts("ответ")
+
+    assert asyncio.run(call_with_retries(attempt, breaker, time.monotonic() + 60, health=health)) is None
+    assert not calls
+    assert health.stats() == {'circuit_open': 1}
+
+
+def test_parse_retry_after():
+    assert parse_retry_after("3") == 3.0
+    assert parse_retry_after("-1") == 0.0
+    assert parse_retry_after(None) is None
+    assert parse_retry_after("скоро") is None
+    in_ten_seconds = email.utils.formatdate(time.time() + 10, usegmt=True)
+    assert 8 <= parse_retry_after(in_ten_seconds) <= 10
@@ -0,0 +1,130 @@
+"""LLMScheduler: приоритеты, очередь по приключению, token bucket и отмена ожидания."""
+
+import asyncio
+import time
+
+from llm_scheduler import (PRIORITY_ACTION, PRIORITY_BACKGROUND, PRIORITY_COMBAT_END, PRIORITY_INTRO,
+                           LLMScheduler)
+
+
+async def hold(scheduler, name, order, priority=PRIORITY_ACTION, release=None):
+    async with scheduler.request(priority):
+        order.append(name)
+        if release is not None:
+            await release.wait()
+
+
+def test_waiting_requests_run_by_priority_then_arrival():
+    async def scenario():
+        scheduler = LLMScheduler(max_concurrent=1, rate=0)
+        order = []
+        release = asyncio.Event()
+        first = asyncio.create_task(hold(scheduler, 'first', order, release=release))
+        await asyncio.sleep(0)
+        waiting = [
+            asyncio.create_task(hold(scheduler, 'summary', order, PRIORITY_BACKGROUND)),
+            asyncio.create_task(hold(scheduler, 'action 1', order, PRIORITY_ACTION)),
+            asyncio.create_task(hold(scheduler, 'intro', order, PRIORITY_INTRO)),
+            asyncio.create_task(hold(scheduler, 'combat end', order, PRIORITY_COMBAT_END)),
+            asyncio.create_task(hold(scheduler, 'action 2', order, PRIORITY_ACTION)),
+        ]
+        await asyncio.sleep(0)
+        assert scheduler.stats()['queued'] == 5
+        release.set()
+        await asyncio.gather(first, *waiting)
+        return order, scheduler.stats()
+
+    order, stats = asyncio.run(scenario())
+
+    assert order == ['first', 'combat end', 'action 1', 'action 2', 'intro', 'summary']
+    assert stats['in_flight'] == 0
+    assert stats['requests'] == 6
+    assert stats['max_queued'] == 5
+
+
+def test_one_turn_per_adventure_at_a_time():
+    async def scenario():
+        scheduler = LLMScheduler()
+        events = []
+
+        async def turn(adventure_id, name):
+            async with scheduler.adventure(adventure_id):
+                events.append(f"{name} start")
+                await asyncio.sleep(0.01)
+                events.append(f"{name} end")
+
+        await asyncio.gather(turn(1, 'a1'), turn(1, 'a2'), turn(2, 'b'))
+        return events, scheduler.stats()
+
+    events, stats = asyncio.run(scenario())
+
+    # Второй ход приключения 1 ждет первый, приключение 2 идет параллельно
+    assert events.index('a2 start') > events.index('a1 end')
+    assert events.index('b start') < events.index('a1 end')
+    assert stats['busy_adventures'] == 0
+
+
+def test_token_bucket_limits_the_request_rate():
+    async def scenario():
+        scheduler = LLMScheduler(max_concurrent=10, rate=10, burst=2)
+        started = []
+        begin = time.monotonic()
+
+        async def request():
+            async with scheduler.request():
+                started.append(time.monotonic() - begin)
+
+        await asyncio.gather(*(request() for _ in range(4)))
+        return sorted(started)
+
+    started = asyncio.run(scenario())
+
+    # Два запроса из запаса сразу, дальше по одному в 1/10 секунды
+    assert started[1] < 0.05
+    assert started[2] >= 0.09
+    assert started[3] >= 0.19
+
+
+def test_cancelled_waiter_does_not_take_a_slot():
+    async def scenario():
+        scheduler = LLMScheduler(max_concurrent=1, rate=0)
+        order = []
+        release = asyncio.Event()
+        first = asyncio.create_task(hold(scheduler, 'first', order, release=release))
+        await asyncio.sleep(0)
+        cancelled = asyncio.create_task(hold(scheduler, 'cancelled', order))
+        later = asyncio.create_task(hold(scheduler, 'later', order))
+        await asyncio.sleep(0)
+
+        cancelled.cancel()
+        release.set()
+        await asyncio.gather(first, later)
+        return order, scheduler.stats()
+
+    order, stats = asyncio.run(scenario())
+
+    assert order == ['first', 'later']
+    assert stats['in_flight'] == 0
+    assert stats['queued'] == 0
+
+
+def test_slot_granted_to_a_cancelled_waiter_is_returned():
+    async def scenario():
+        scheduler = LLMScheduler(max_concurrent=1, rate=0)
+        order = []
+        slot = scheduler.request()
+        await slot.__aenter__()
+        granted = asyncio.create_task(hold(scheduler, 'granted', order))
+        await asyncio.sleep(0)
+
+        # Слот уходит ожидающему, но тот отменен раньше, чем успел его занять
+        await slot.__aexit__(None, None, None)
+        granted.cancel()
+        await asyncio.gather(granted, return_exceptions=True)
+        await hold(scheduler, 'after', order)
+        return order, scheduler.stats()
+
+    order, stats = asyncio.run(scenario())
+
+    assert order == ['after']
+    assert stats['in_flight'] == 0
@@ -0,0 +1,31 @@
+"""Быстрый путь разбора канонических блоков против построчного разбора."""
+
+import os
+
+import response_parser
+
+FIXTURE = os.path.join(os.path.dirname(__file__), '..', 'mock_responses', 'combat_start.txt')
+
+
+def combat_text():
+    with open(FIXTURE, encoding='utf-8') as f:
+        text = f.read()
+    return text[text.index('***COMBAT_START***') + len('***COMBAT_START***'):]
+
+
+def test_canonical_blocks_match_line_parser():
+    text = combat_text()
+    canonical = response_parser._parse_canonical_blocks(text)
+    by_lines = [response_parser._build_enemy(block) for block in response_parser._parse_enemy_lines(text)]
+
+    assert canonical == by_lines
+    assert [enemy['name'] for enemy in canonical] == ["Разбойник-Главарь", "Разбойник-Лучник"]
+    assert canonical[1]['attacks'][0] == ("Короткий лук", "1d6+3 piercing", 5)
+
+
+def test_nonstandard_attack_falls_back_to_line_parser():
+    text = combat_text().replace("ATTACK: Кинжал (1d4+3 piercing, бонус к атаке: +5)", "ATTACK: Кинжал (1d4+3)")
+
+    assert response_parser._parse_canonical_blocks(text) is None
+    parsed = response_parser.parse_response("***COMBAT_START***" + text)
+    assert parsed.enemies[1]['attacks'][1] == ("Кинжал", "1d4+3", 0)
@@ -0,0 +1,114 @@
+"""Режим GROK_COMBAT_FORMAT = "json": проверка по схеме и запасной разбор текста."""
+
+import json
+import os
+
+import pytest
+
+import response_parser
+from response_parser import COMBAT_JSON_SCHEMA, ParseMetrics, parse_response, validate_json
+
+MOCK_RESPONSES = os.path.join(os.path.dirname(__file__), '..', 'mock_responses')
+
+
+def read(name):
+    with open(os.path.join(MOCK_RESPONSES, name), encoding='utf-8') as f:
+        return f.read()
+
+
+def combat_json():
+    text = read('combat_start_json.txt')
+    return json.loads(text[text.index('{'):text.rindex('}') + 1])
+
+
+def with_json(data, text_blocks=""):
+    return "Разбойники атакуют!\n\n***COMBAT_START***\n```json\n" + json.dumps(data, ensure_ascii=False) + \
+        "\n```\n" + text_blocks
+
+
+def test_json_enemies_match_the_text_format():
+    from_json = parse_response(read('combat_start_json.txt'))
+    from_text = parse_response(read('combat_start.txt'))
+
+    assert from_json.enemy_format == 'json'
+    assert from_json.json_error is None
+    assert from_json.enemies == from_text.enemies
+    assert "```" not in from_json.clean_text and '"enemies"' not in from_json.clean_text
+
+
+def test_json_block_surrounded_by_text():
+    blocks, error = response_parser._parse_json_blocks("Вот данные: " + json.dumps(combat_json()) + " конец")
+
+    assert error is None
+    assert [block['name'] for block in blocks] == ["Разбойник-Главарь", "Разбойник-Лучник"]
+    assert blocks[0]['dexterity'] == (12, 1)
+    assert blocks[1]['attacks'][0] == ("Короткий лук", "1d6+3 piercing", 5)
+
+
+def test_broken_json_is_reported():
+    assert response_parser._parse_json_blocks("без JSON") == (None, "no JSON object")
+    blocks, error = response_parser._parse_json_blocks('{"enemies": [')
+    assert blocks is None and error.startswith("invalid JSON")
+
+
+@pytest.mark.parametrize("change, error", [
+    (lambda enemy: enemy.update(hp=5.5), "$.enemies[0].hp: expected integer"),
+    (lambda enemy: enemy.update(hp=0), "$.enemies[0].hp: 0 < 1"),
+    (lambda enemy: enemy.update(dex=True), "$.enemies[0].dex: expected integer"),
+    (lambda enemy: enemy.update(str=31), "$.enemies[0].str: 31 > 30"),
+    (lambda enemy: enemy.pop('xp'), "$.enemies[0]: missing 'xp'"),
+    (lambda enemy: enemy.update(name="  "), "$.enemies[0].name: empty string"),
+    (lambda enemy: enemy['attacks'][1].update(damage=""), "$.enemies[0].attacks[1].damage: empty string"),
+])
+def test_validate_json_names_the_first_error(change, error):
+    data = combat_json()
+    change(data['enemies'][0])
+
+    assert validate_json(data, COMBAT_JSON_SCHEMA) == error
+
+
+def test_validate_json_requires_enemies():
+    assert validate_json({"enemies": []}, COMBAT_JSON_SCHEMA) == "$.enemies: expected at least 1 items"
+    assert validate_json([], COMBAT_JSON_SCHEMA) == "$: expected object"
+    assert validate_json(combat_json(), COMBAT_JSON_SCHEMA) is None
+
+
+def test_invalid_json_falls_back_to_text_blocks():
+    data = combat_json()
+    data['enemies'][0]['hp'] = 5.5
+    text_blocks = read('combat_start.txt').split('***COMBAT_START***')[1]
+
+    parsed = parse_response(with_json(data, text_blocks))
+
+    assert parsed.enemy_format == 'text'
+    assert parsed.json_error == "$.enemies[0].hp: expected integer"
+    assert parsed.enemies == parse_response(read('combat_start.txt')).enemies
+
+
+def test_invalid_json_without_text_blocks_gives_no_enemies():
+    data = combat_json()
+    data['enemies'][1]['attacks'][0]['damage'] = ""
+
+    parsed = parse_response(with_json(data))
+
+    assert parsed.combat_started
+    assert parsed.enemies == []
+    assert parsed.json_error == "$.enemies[1].attacks[0].damage: empty string"
+
+
+def test_parse_metrics_count_each_mode():
+    metrics = ParseMetrics()
+    broken = combat_json()
+    broken['enemies'][0]['hp'] = 5.5
+
+    metrics.record('json', parse_response(read('combat_start_json.txt')))
+    metrics.record('json', parse_response(with_json(broken, read('combat_start.txt').split('***COMBAT_START***')[1])))
+    metrics.record('json', parse_response(with_json(broken)))
+    metrics.record('text', parse_response(read('combat_start.txt')))
+    metrics.record('text', parse_response(read('adventure_intro.txt')))  # без боя - не считается
+
+    stats = metrics.stats()
+    assert stats['json'] == {'combats': 3, 'parsed': 2, 'json': 1, 'text_fallback': 1, 'failed': 1,
+                             'success_rate': pytest.approx(2 / 3)}
+    assert stats['text'] == {'combats': 1, 'parsed': 1, 'json': 0, 'text_fallback': 0, 'failed': 0,
+                             'success_rate': 1.0}
@@ -0,0 +1,92 @@
+"""Боевые заклинания: подсказки урона на кнопках и заклинания по области."""
+
+import asyncio
+from unittest import mock
+
+import spell_combat
+from combat_rules import CHARACTER, ENEMY, Combatant
+from combat_state import combat_states
+from saving_throws import saving_throw_manager
+from spell_combat import damage_hint
+
+
+def test_damage_hint_shows_exact_mean():
+    assert damage_hint("2d6") == " (2d6 ≈7)"
+    assert damage_hint("1d10") == " (1d10 ≈6)"  # 5.5 округляется вверх
+    assert damage_hint("3d4+3") == " (3d4+3 ≈11)"  # 10.5
+
+
+def test_damage_hint_multiplies_beams():
+    assert damage_hint("1d10", 2) == " (1d10 x2 ≈11)"
+
+
+def test_damage_hint_without_dice():
+    assert damage_hint("") == ""
+    assert damage_hint(None) == ""
+    assert damage_hint("особый") == " (особый)"
+
+
+def test_aoe_spell_saves_from_state_and_writes_hp_once():
+    enemies = [Combatant(ENEMY, 100 + i, f"Гоблин {i}", 10, 7, 7, 13, stats={'dexterity': 14})
+               for i in range(3)]
+    combat_states.start(11, 42, enemies + [Combatant(CHARACTER, 1, "Маг", 5, 20, 20, 12)])
+
+    manager = spell_combat.SpellCombatManager()
+    manager.db = mock.Mock()
+    manager.db.fetch = mock.AsyncMock(side_effect=lambda query, params: (
+        [{'saving_throw': 'Ловкость'}] if 'saving_throw' in query else [{'user_id': 9}]))
+    manager.db.run = mock.AsyncMock(side_effect=lambda func, *args: func(*args))
+    update = mock.Mock()
+    update.callback_query.edit_message_text = mock.AsyncMock()
+    spell = {'name': 'Огненный шар', 'level': 3, 'damage': '8d6', 'damage_type': 'огонь'}
+
+    with mock.patch.object(combat_states, 'db') as state_db, \
+            mock.patch.object(saving_throw_manager, 'calculate_spell_save_dc', return_value=13), \
+            mock.patch.object(saving_throw_manager, '_get_enemy_stats') as enemy_stats, \
+            mock.patch('combat_manager.combat_manager') as combat_manager:
+        state_db.run = mock.AsyncMock()
+        combat_manager.end_combat = mock.AsyncMock()
+        asyncio.run(manager.cast_aoe_spell(update, 1, 11, spell, "Маг"))
+
+    # Характеристики для спасбросков - из состояния боя, без запросов по каждой цели
+    enemy_stats.assert_not_called()
+    # Из async-обработчика - только awaitable-вызовы базы
+    manager.db.execute_query.assert_not_called()
+    # HP всех целей записаны одной транзакцией
+    state_db.run.assert_awaited_once()
+    written = state_db.run.await_args.args[1]
+    assert set(written) == {(ENEMY, 100), (ENEMY, 101), (ENEMY, 102)}
+    combat_states.discard(11)
+
+
+def test_single_target_spell_attack_uses_combat_rules():
+    combat_states.start(12, 42, [Combatant(ENEMY, 100, "Гоблин", 10, 30, 30, 13),
+                                 Combatant(CHARACTER, 1, "Маг", 5, 20, 20, 12)])
+
+    def fetch(query, params):
+        if 'spellcasting_ability' in query:
+            return [{'strength': 8, 'dexterity': 14, 'constitution': 12, 'intelligence': 18, 'wisdom': 10,
+                     'charisma': 10, 'spellcasting_ability': 'Интеллект'}]
+        if 'saving_throw' in query:
+            return [{'saving_throw': None}]
+        if 'damage_type' in query:
+            return [{'name': 'Огненный снаряд', 'level': 0, 'damage': '1d10', 'damage_type': 'огонь',
+                     'description': ''}]
+        return [{'name': 'Маг', 'user_id': None}]
+
+    manager = spell_combat.SpellCombatManager()
+    manager.db = mock.Mock()
+    manager.db.fetch = mock.AsyncMock(side_effect=fetch)
+    update = mock.Mock()
+    update.callback_query.edit_message_text = mock.AsyncMock()
+
+    with mock.patch('combat_rules.random.randint', return_value=15):
+        asyncio.run(manager.cast_single_target_spell(update, 1, 12, 5, 100))
+
+    text = update.callback_query.edit_message_text.await_args.args[0]
+    # d20 + Интеллект (+4) + мастерство (+2)
+    assert "15+6 = 21 против AC 13" in text
+    assert "✅ ПОПАДАНИЕ!" in text
+    state = asyncio.run(combat_states.get(12))
+    assert state.get(ENEMY, 100).hp < 30
+    combat_states.discard(12)
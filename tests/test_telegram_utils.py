@@ -0,0 +1,81 @@
+"""StreamingMessage: итоговый текст заменяет все показанное по ходу генерации."""
+
+import asyncio
+from unittest import mock
+
+from telegram.error import BadRequest
+
+from telegram_utils import StreamingMessage, split_long_message
+
+
+def make_stream():
+    bot = mock.Mock()
+    sent = []
+
+    async def send_message(chat_id, text):
+        message = mock.Mock()
+        message.text = text
+        message.edit_text = mock.AsyncMock()
+        message.delete = mock.AsyncMock()
+        sent.append(message)
+        return message
+
+    bot.send_message = send_message
+    return StreamingMessage(bot, 42, min_interval=0, min_chars=0), sent
+
+
+def test_shorter_final_text_removes_extra_chunks():
+    stream, sent = make_stream()
+    long_text = "слово " * 1500  # больше одного сообщения Telegram
+    asyncio.run(stream.update(long_text))
+    assert len(sent) == len(split_long_message(long_text)) > 1
+
+    assert asyncio.run(stream.finish("Короткий итог")) is True
+
+    sent[0].edit_text.assert_awaited_once_with("Короткий итог")
+    for message in sent[1:]:
+        message.delete.assert_awaited_once()
+    assert stream.messages == [sent[0]]
+
+
+def test_undeletable_extra_chunk_is_blanked():
+    stream, sent = make_stream()
+    asyncio.run(stream.update("слово " * 1500))
+    sent[1].delete.side_effect = BadRequest("Message can't be deleted")
+
+    asyncio.run(stream.finish("Короткий итог"))
+
+    sent[1].edit_text.assert_awaited_once_with("…")
+
+
+def test_failed_final_edit_removes_partial_text():
+    stream, sent = make_stream()
+    asyncio.run(stream.update("Начало отв"))
+    sent[0].edit_text.side_effect = BadRequest("Message to edit not found")
+
+    # Вызывающий код отправит итог обычным путем, обрывок ответа не остается
+    assert asyncio.run(stream.finish("Полный ответ")) is False
+    sent[0].delete.assert_awaited_once()
+    assert not stream.messages
+
+
+def test_empty_final_text_removes_partial_text():
+    stream, sent = make_stream()
+    asyncio.run(stream.update("Начало отв"))
+
+    assert asyncio.run(stream.finish("")) is True
+    sent[0].delete.assert_awaited_once()
+
+
+def test_restarted_stream_replaces_longer_stale_text():
+    stream, sent = make_stream()
+    stream.min_chars = 40
+    asyncio.run(stream.update("Первая попытка ответа, которая оборвалась на середине фразы"))
+
+    # Повтор после обрыва начинает текст заново - он короче показанного
+    asyncio.run(stream.update("Вторая попытка"))
+
+    sent[0].edit_text.assert_awaited_once_with("Вторая попытка")
+    # Дальше min_chars отсчитывается от нового текста
+    asyncio.run(stream.update("Вторая попытка, еще"))
+    sent[0].edit_text.assert_awaited_once()